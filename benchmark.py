@@ -0,0 +1,356 @@
+# benchmark.py
+"""
+Benchmarks for VoiceTrackerDatabase and the tracking pipeline.
+
+- storage: events per second of the pooled ConnectionManager against the old
+  behaviour of opening and closing a fresh SQLite connection for every call.
+- pipeline: replays synthetic gateway traces (steady churn, raid bursts, mass
+  stream start, channel deletion) through VoiceTimeTracker with fake
+  member/before/after objects, against the SQLite (file and in-memory),
+  JSON and in-memory storage backends. Reports events/sec, p50/p99
+  handler latency and event loop lag.
+
+    python benchmark.py --events 5000 --users 200
+    python benchmark.py --suite pipeline --trace raid --backend sqlite json
+"""
+
+import argparse
+import asyncio
+import contextlib
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from connection import ConnectionManager
+from database import VoiceTrackerDatabase
+
+
+class OpenPerCallConnections(ConnectionManager):
+    def get(self):
+        # dropped (and therefore closed) as soon as the calling method returns
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.on_connect(conn)
+        return conn
+
+
+class OpenPerCallDatabase(VoiceTrackerDatabase):
+    """Previous behaviour: a brand new connection (and schema load) on every call."""
+
+    def __init__(self, db_path):
+        super().__init__(db_path, backend="sqlite")
+        self.backend.shards = [OpenPerCallConnections(path, on_connect=self.backend._on_connect)
+                               for path in self.backend.shard_paths]
+
+
+class InMemoryConnections(ConnectionManager):
+    def get(self):
+        return self._get_memory_db()
+
+
+class InMemorySQLiteDatabase(VoiceTrackerDatabase):
+    """The in-memory SQLite fallback used when the database file can't be opened."""
+
+    def __init__(self, db_path):
+        super().__init__(db_path, backend="sqlite")
+        backend = self.backend
+        backend.shards = [InMemoryConnections(path, on_memory_init=backend._init_memory_tables,
+                                              on_connect=backend._on_connect)
+                          for path in backend.shard_paths]
+
+
+BACKENDS = {
+    "sqlite": lambda path: VoiceTrackerDatabase(path, backend="sqlite"),
+    "sqlite-memory": lambda path: InMemorySQLiteDatabase(path),
+    "json": lambda path: VoiceTrackerDatabase(path, backend="json"),
+    "memory": lambda path: VoiceTrackerDatabase(path, backend="memory"),
+}
+
+
+# ----------------------------
+# Storage benchmark
+# ----------------------------
+def replay_churn(db, events, users, seed=1):
+    """Join/leave/stream events for random users, returns events per second."""
+    rng = random.Random(seed)
+    in_voice = set()
+    streaming = set()
+    start = time.perf_counter()
+    for _ in range(events):
+        user_id = rng.randrange(users)
+        if user_id in streaming:
+            db.end_stream_session(user_id)
+            streaming.discard(user_id)
+            in_voice.discard(user_id)
+        elif user_id in in_voice:
+            if rng.random() < 0.3:
+                db.start_stream_session(user_id, f"User_{user_id}", 1)
+                streaming.add(user_id)
+            else:
+                db.end_voice_session(user_id)
+                in_voice.discard(user_id)
+        else:
+            db.start_voice_session(user_id, f"User_{user_id}", 1)
+            in_voice.add(user_id)
+    elapsed = time.perf_counter() - start
+    return events / elapsed
+
+
+def run(label, factory, events, users):
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            db = factory(db_path)
+            rate = replay_churn(db, events, users)
+            db.close()
+    print(f"{label:<28} {rate:>10.0f} events/sec")
+    return rate
+
+
+def run_storage(events, users):
+    print(f"📊 Replaying {events} events over {users} users")
+    baseline = run("open-per-call", lambda p: OpenPerCallDatabase(p), events, users)
+    for profile in ("durable", "balanced", "fast"):
+        rate = run(f"pooled ({profile})", lambda p: VoiceTrackerDatabase(p, profile), events, users)
+        print(f"{'':<28} {rate / baseline:>10.1f}x vs open-per-call")
+    for backend in ("json", "memory"):
+        rate = run(f"{backend} backend", BACKENDS[backend], events, users)
+        print(f"{'':<28} {rate / baseline:>10.1f}x vs open-per-call")
+
+
+# ----------------------------
+# Pipeline benchmark: synthetic gateway events through VoiceTimeTracker
+# ----------------------------
+class FakeGuild:
+    def __init__(self, guild_id):
+        self.id = guild_id
+
+
+class FakeChannel:
+    def __init__(self, channel_id, guild):
+        self.id = channel_id
+        self.name = f"voice-{channel_id}"
+        self.guild = guild
+
+
+class FakeMember:
+    def __init__(self, user_id, guild):
+        self.id = user_id
+        self.display_name = f"User_{user_id}"
+        self.guild = guild
+
+
+class FakeVoiceState:
+    def __init__(self, channel=None, self_stream=False):
+        self.channel = channel
+        self.self_stream = self_stream
+
+
+class Trace:
+    """
+    Builds a list of steps from voice state changes:
+    ("voice", member, before, after), ("delete", channel) or ("pause", seconds).
+    """
+
+    def __init__(self, users, channels=10, guilds=1, seed=1):
+        self.rng = random.Random(seed)
+        self.guilds = [FakeGuild(1000 + i) for i in range(guilds)]
+        self.channels = [FakeChannel(2000 + i, self.guilds[i % guilds]) for i in range(channels)]
+        self.members = [FakeMember(i, self.guilds[i % guilds]) for i in range(users)]
+        self.states = {}
+        self.steps = []
+
+    @property
+    def events(self):
+        return sum(1 for step in self.steps if step[0] != "pause")
+
+    def state(self, member):
+        return self.states.get(member.id) or FakeVoiceState()
+
+    def _change(self, member, after):
+        self.steps.append(("voice", member, self.state(member), after))
+        self.states[member.id] = after
+
+    def join(self, member, channel=None):
+        if channel is None:
+            channel = self.rng.choice([c for c in self.channels if c.guild is member.guild])
+        self._change(member, FakeVoiceState(channel))
+
+    def leave(self, member):
+        self._change(member, FakeVoiceState())
+
+    def stream(self, member, on=True):
+        self._change(member, FakeVoiceState(self.state(member).channel, on))
+
+    def delete(self, channel):
+        self.steps.append(("delete", channel))
+        for member_id, state in list(self.states.items()):
+            if state.channel is channel:
+                self.states[member_id] = FakeVoiceState()
+
+    def pause(self, seconds):
+        self.steps.append(("pause", seconds))
+
+
+def trace_steady(events, users, seed=1):
+    """Random joins, moves, leaves and stream toggles at a constant rate."""
+    trace = Trace(users, seed=seed)
+    rng = trace.rng
+    while trace.events < events:
+        member = rng.choice(trace.members)
+        state = trace.state(member)
+        roll = rng.random()
+        if state.channel is None:
+            trace.join(member)
+        elif roll < 0.2:
+            trace.stream(member, not state.self_stream)
+        elif roll < 0.35:
+            trace.join(member)
+        else:
+            trace.leave(member)
+    return trace
+
+
+def trace_raid(events, users, seed=1, burst=0.05):
+    """Every member joins at once, then everyone leaves; repeated."""
+    trace = Trace(users, seed=seed)
+    while trace.events < events:
+        for member in trace.members:
+            trace.join(member)
+        trace.pause(burst)
+        for member in trace.members:
+            trace.leave(member)
+        trace.pause(burst)
+    return trace
+
+
+def trace_stream(events, users, seed=1, burst=0.05):
+    """Everyone is in voice, then everyone starts (and later stops) streaming together."""
+    trace = Trace(users, seed=seed)
+    for member in trace.members:
+        trace.join(member)
+    while trace.events < events:
+        trace.pause(burst)
+        for member in trace.members:
+            trace.stream(member, True)
+        trace.pause(burst)
+        for member in trace.members:
+            trace.stream(member, False)
+    return trace
+
+
+def trace_delete(events, users, seed=1, burst=0.05):
+    """Channels full of members are deleted one after another."""
+    trace = Trace(users, seed=seed)
+    while trace.events < events:
+        for member in trace.members:
+            trace.join(member)
+        trace.pause(burst)
+        for channel in trace.channels:
+            trace.delete(channel)
+    return trace
+
+
+TRACES = {
+    "steady": trace_steady,
+    "raid": trace_raid,
+    "stream": trace_stream,
+    "delete": trace_delete,
+}
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+async def replay_trace(tracker, steps, lag_interval=0.005):
+    """Feed the steps to the tracker as the gateway would; returns the measurements."""
+    loop = asyncio.get_running_loop()
+    latencies = []
+    lags = []
+    done = asyncio.Event()
+
+    async def watch_loop():
+        # how late a short sleep wakes up is how long the loop was blocked
+        while not done.is_set():
+            expected = loop.time() + lag_interval
+            await asyncio.sleep(lag_interval)
+            lags.append(max(0.0, loop.time() - expected))
+
+    watcher = loop.create_task(watch_loop())
+    paused = 0.0
+    start = time.perf_counter()
+    for step in steps:
+        if step[0] == "pause":
+            await asyncio.sleep(step[1])
+            paused += step[1]
+            continue
+        handled = time.perf_counter()
+        if step[0] == "voice":
+            await tracker.handle_voice_state_update(*step[1:])
+        else:
+            await tracker.handle_channel_delete(step[1])
+        latencies.append(time.perf_counter() - handled)
+        # each gateway event is dispatched from its own loop iteration
+        await asyncio.sleep(0)
+    # throughput includes writing everything that was queued
+    await tracker.close()
+    elapsed = time.perf_counter() - start - paused
+    done.set()
+    await watcher
+    return {
+        'events': len(latencies),
+        'events_per_sec': len(latencies) / elapsed if elapsed > 0 else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'lag_p99_ms': percentile(lags, 99) * 1000,
+        'lag_max_ms': max(lags, default=0.0) * 1000,
+    }
+
+
+def run_pipeline_case(backend, trace_name, events, users):
+    from tracker import VoiceTimeTracker
+
+    factory = BACKENDS[backend]
+    trace = TRACES[trace_name](events, users)
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            db = factory(os.path.join(tmp, "bench.db"))
+            tracker = VoiceTimeTracker(db)
+            result = asyncio.run(replay_trace(tracker, trace.steps))
+            db.close()
+    print(f"{backend:<13} {trace_name:<8} {result['events']:>8} {result['events_per_sec']:>12.0f} "
+          f"{result['p50_ms']:>9.3f} {result['p99_ms']:>9.3f} "
+          f"{result['lag_p99_ms']:>9.2f} {result['lag_max_ms']:>9.2f}")
+    return result
+
+
+def run_pipeline(backends, traces, events, users):
+    print(f"📊 Replaying ~{events} gateway events per trace over {users} members")
+    print(f"{'backend':<13} {'trace':<8} {'events':>8} {'events/sec':>12} "
+          f"{'p50 ms':>9} {'p99 ms':>9} {'lag p99':>9} {'lag max':>9}")
+    return {(backend, trace): run_pipeline_case(backend, trace, events, users)
+            for backend in backends for trace in traces}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="VoiceTrackerDatabase and tracker benchmarks")
+    parser.add_argument("--suite", choices=("storage", "pipeline", "all"), default="storage")
+    parser.add_argument("--events", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--backend", nargs="+", choices=sorted(BACKENDS), default=list(BACKENDS))
+    parser.add_argument("--trace", nargs="+", choices=sorted(TRACES), default=list(TRACES))
+    args = parser.parse_args()
+
+    if args.suite in ("storage", "all"):
+        run_storage(args.events, args.users)
+    if args.suite in ("pipeline", "all"):
+        run_pipeline(args.backend, args.trace, args.events, args.users)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,3 +4,38 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 
 if not BOT_TOKEN:
     print("❌ ERROR: BOT_TOKEN environment variable is not set!")
+
+# instrumentation: local Prometheus endpoint (unset = off) and periodic stats dump in seconds (0 = off)
+METRICS_PORT = int(os.getenv("METRICS_PORT")) if os.getenv("METRICS_PORT") else None
+STATS_DUMP_INTERVAL = float(os.getenv("STATS_DUMP_INTERVAL", "0"))
+
+# seconds between checkpoints of open sessions into the totals (bounds time lost on a crash);
+# at least 1 s, so 0 or a negative value can't turn the checkpoint loops into busy loops
+CHECKPOINT_INTERVAL = max(1.0, float(os.getenv("CHECKPOINT_INTERVAL", "60")))
+
+# retention, applied every PRUNE_INTERVAL seconds: raw session history older than
+# HISTORY_RETENTION_DAYS (already counted in the rollups) and hourly rollups older
+# than HOURLY_ROLLUP_RETENTION_DAYS (only the "hour" window reads them)
+HISTORY_RETENTION_DAYS = float(os.getenv("HISTORY_RETENTION_DAYS", "30"))
+HOURLY_ROLLUP_RETENTION_DAYS = float(os.getenv("HOURLY_ROLLUP_RETENTION_DAYS", "2"))
+PRUNE_INTERVAL = max(60.0, float(os.getenv("PRUNE_INTERVAL", "3600")))
+
+# storage: "sqlite", "json", "memory" or "auto" (sqlite when the sqlite3 module loads, json otherwise)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "auto")
+DB_PATH = os.getenv("DB_PATH", "/tmp/voice_tracker.db")
+# sqlite backend only: split guilds over DB_SHARDS files (guild_id % DB_SHARDS picks the file;
+# 1 keeps the single DB_PATH file). Writer and replicas must agree, so never change it on a live database
+DB_SHARDS = int(os.getenv("DB_SHARDS", "1"))
+# memory backend only: seconds between snapshots to disk (bounds what a crash loses)
+SNAPSHOT_INTERVAL = float(os.getenv("SNAPSHOT_INTERVAL", "30"))
+
+# seconds between leaderboard pre-renders (only boards whose top 5 changed are rebuilt)
+LEADERBOARD_REFRESH_INTERVAL = float(os.getenv("LEADERBOARD_REFRESH_INTERVAL", "15"))
+# per-channel command rate limit: COMMAND_RATE commands every COMMAND_RATE_PERIOD seconds
+COMMAND_RATE = int(os.getenv("COMMAND_RATE", "5"))
+COMMAND_RATE_PERIOD = float(os.getenv("COMMAND_RATE_PERIOD", "10"))
+
+# gateway processes: 1 runs everything in one process; N > 1 runs N shard processes
+# that send their events to one writer process over IPC_SOCKET (see ipc.py)
+GATEWAY_SHARDS = int(os.getenv("GATEWAY_SHARDS", "1"))
+IPC_SOCKET = os.getenv("IPC_SOCKET", "/tmp/voice_tracker.sock")
@@ -0,0 +1,140 @@
+# connection.py
+"""
+ConnectionManager
+- Keeps one long-lived sqlite3 connection per thread instead of opening and
+  closing a connection on every call.
+- Applies WAL journaling and a synchronous/pragma profile once, when a
+  connection is first opened.
+- If the database file cannot be opened, falls back to a single shared
+  in-memory database that lives for the whole process.
+- read_only=True opens every connection with connect_readonly() instead
+  (a read replica of a file another process writes) and never falls back.
+"""
+
+import os
+import threading
+from urllib.parse import quote
+
+import logs
+
+try:
+    import sqlite3
+except ImportError:
+    from pysqlite3 import dbapi2 as sqlite3
+
+log = logs.get_logger("connection")
+
+# Pragma profiles applied to every new file connection, in order.
+# - durable:  fsync on every commit, survives power loss
+# - balanced: WAL + synchronous=NORMAL, only the last commits can be lost on power loss
+# - fast:     no fsync at all, for benchmarks and throwaway databases
+PRAGMA_PROFILES = {
+    "durable": (
+        ("journal_mode", "WAL"),
+        ("synchronous", "FULL"),
+        ("temp_store", "MEMORY"),
+        ("busy_timeout", 5000),
+    ),
+    "balanced": (
+        ("journal_mode", "WAL"),
+        ("synchronous", "NORMAL"),
+        ("temp_store", "MEMORY"),
+        ("cache_size", -8000),
+        ("busy_timeout", 5000),
+    ),
+    "fast": (
+        ("journal_mode", "WAL"),
+        ("synchronous", "OFF"),
+        ("temp_store", "MEMORY"),
+        ("cache_size", -16000),
+        ("busy_timeout", 5000),
+    ),
+}
+
+
+class ConnectionManager:
+    def __init__(self, db_path, profile="balanced", on_memory_init=None, read_only=False, on_connect=None):
+        if profile not in PRAGMA_PROFILES:
+            raise ValueError(f"Unknown pragma profile: {profile}")
+        self.db_path = db_path
+        self.profile = profile
+        self.read_only = read_only
+        # called once with the in-memory connection so the owner can create its tables
+        self.on_memory_init = on_memory_init
+        # called with every new connection, file or in-memory (e.g. to register SQL functions)
+        self.on_connect = on_connect
+        self.memory_db = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+
+    def get(self):
+        """Return this thread's connection, opening it on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            return conn
+        if self.memory_db is not None:
+            return self.memory_db
+
+        if self.read_only:
+            # a replica that can't open the file must fail, not serve an empty in-memory db
+            conn = connect_readonly(self.db_path)
+        else:
+            conn = None
+            try:
+                conn = sqlite3.connect(self.db_path, check_same_thread=False)
+                self._apply_pragmas(conn)
+            except Exception:
+                if conn is not None:
+                    conn.close()
+                return self._get_memory_db()
+        if self.on_connect:
+            self.on_connect(conn)
+
+        self._local.conn = conn
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+
+    def _apply_pragmas(self, conn):
+        for name, value in PRAGMA_PROFILES[self.profile]:
+            conn.execute(f"PRAGMA {name}={value}")
+
+    def _get_memory_db(self):
+        # one in-memory database for the life of the process; closing it would lose all data
+        with self._lock:
+            if self.memory_db is None:
+                self.memory_db = sqlite3.connect(':memory:', check_same_thread=False)
+                if self.on_connect:
+                    self.on_connect(self.memory_db)
+                if self.on_memory_init:
+                    self.on_memory_init(self.memory_db)
+                log.warning("⚠️ Could not open database file — using in-memory SQLite")
+            return self.memory_db
+
+    @property
+    def using_memory(self):
+        return self.memory_db is not None
+
+    def close_all(self):
+        """Close every file connection (e.g. on shutdown). The in-memory fallback is kept."""
+        with self._lock:
+            for conn in self._connections:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+            self._connections = []
+        self._local = threading.local()
+
+
+def connect_readonly(db_path, busy_timeout=5000):
+    """
+    A separate read-only connection (exports, analytics). Under WAL it reads
+    a consistent snapshot per statement without blocking the writer.
+    """
+    uri = f"file:{quote(os.path.abspath(db_path))}?mode=ro"
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    conn.execute(f"PRAGMA busy_timeout={busy_timeout}")
+    conn.execute("PRAGMA query_only=ON")
+    return conn
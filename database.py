@@ -1,237 +1,462 @@
-try:
-    import sqlite3
-except ImportError:
-    from pysqlite3 import dbapi2 as sqlite3
-import os
-from datetime import datetime
+# database.py
+"""
+VoiceTrackerDatabase
+- Storage goes through a pluggable backend (storage.py): SQLite when
+  available, a JSON journal on hosts without libsqlite3, or a snapshotted
+  in-memory store for very high event rates.
+- All data is keyed by (guild_id, user_id); leaderboards are per guild and
+  kept in memory, loaded from the backend at startup.
+- Closed sessions are kept in session_history and rolled up per hour/day/week
+  for "this week" / "this month" leaderboards.
+- Times are stored as integer epoch milliseconds; the SQLite schema is
+  versioned and upgraded in place at startup, see migrations.py.
+- With several gateway processes one writer process owns the database and
+  the others hold read-only replicas fed by its committed totals (ipc.py):
+  read_only=True, shard=(shard_id, shard_count), apply_changes().
+"""
+
+import time
+import heapq
+
+from leaderboard import Leaderboard
+from cache import TTLCache
+from names import NameCache
+from distribution import DistributionCache
+from storage import (SESSION_COLUMNS, DEFAULT_GUILD, PartialBatchError, open_backend, epoch_ms,
+                     sqlite_available, gateway_shard)
+import rollups
+import logs
+import metrics
+
+log = logs.get_logger("database")
+
+# kept for callers that check which backend "auto" resolves to
+SQLITE_AVAILABLE = sqlite_available()
+
+# most time credited to a session found orphaned at startup (the user left
+# while the bot was down, and we can't know when)
+RECONCILE_STALE_CAP = 15 * 60
+
+# renamed members are written back once this many are waiting, or after this many seconds
+NAME_FLUSH_BATCH = 100
+NAME_FLUSH_INTERVAL = 30.0
+
+# seconds a guild's session length distribution may trail the leaderboard
+DISTRIBUTION_MAX_AGE = 60.0
 
 class VoiceTrackerDatabase:
-    def __init__(self, db_path: str = "voice_tracker.db"):
+    def __init__(self, db_path: str = "/tmp/voice_tracker.db", pragma_profile: str = "balanced",
+                 cache_ttl: float = 30.0, stats_cache_size: int = 10000, shards: int = 1,
+                 name_cache_size: int = 50000, backend: str = "auto", snapshot_interval: float = 30.0,
+                 distribution_max_age: float = DISTRIBUTION_MAX_AGE, read_only: bool = False,
+                 shard: tuple = None):
         self.db_path = db_path
-        self.memory_db = None
-        self.init_database()
-    
-    def get_connection(self):
+        # (shard_id, shard_count): only rank the guilds of this gateway shard
+        self.shard = shard
+        # display names seen on the gateway; renames are persisted in batches
+        self.names = NameCache(name_cache_size)
+        self._names_flushed = time.monotonic()
+        # read-through caches for !vt topvoice / topstreamers / mystats
+        self.top_cache = TTLCache(cache_ttl, max_entries=256)
+        self.stats_cache = TTLCache(cache_ttl, max_entries=stats_cache_size)
+
+        # guild_id -> session_type -> in-memory ranking, updated as sessions close
+        self.leaderboards = {}
+        # (guild_id, session_type) -> sorted average session lengths, for !vt mystats
+        self.session_lengths = DistributionCache(lambda key: self._board(*key).session_lengths(),
+                                                 lambda key: self._board(*key).version, distribution_max_age)
+        # called with every batch of committed totals, e.g. to feed replicas in other processes
+        self.change_listeners = []
+
+        # "sqlite", "json", "memory" or "auto" (sqlite when it loads, else json)
+        self.backend = open_backend(backend, db_path, self.display_name, pragma_profile=pragma_profile,
+                                    shards=shards, snapshot_interval=snapshot_interval, read_only=read_only)
+        if self.backend.kind == "json" and backend in (None, "auto"):
+            log.warning("⚠️ sqlite3 not available — using JSON fallback store")
+
+        self._load_leaderboards()
+
+    def get_connection(self, guild_id=DEFAULT_GUILD):
+        """SQLite connection of a guild's shard (sqlite backend only)."""
+        return self.backend.get_connection(guild_id)
+
+    def close(self):
+        """Persist pending names and close the backend (connections, journal, snapshot)."""
+        self._flush_names(force=True)
+        self.backend.close()
+
+    def _board(self, guild_id, session_type):
+        boards = self.leaderboards.get(guild_id)
+        if boards is None:
+            boards = self.leaderboards.setdefault(
+                guild_id, {kind: Leaderboard() for kind in SESSION_COLUMNS})
+        return boards[session_type]
+
+    def _load_leaderboards(self):
+        """Rebuild the per-guild rankings from stored totals (startup)."""
+        for session_type in SESSION_COLUMNS:
+            by_guild = {}
+            for guild_id, *row in self.backend.load_totals(session_type):
+                if self.shard is None or gateway_shard(guild_id, self.shard[1]) == self.shard[0]:
+                    by_guild.setdefault(guild_id, []).append(row)
+            for guild_id, rows in by_guild.items():
+                self._board(guild_id, session_type).load(rows)
+
+    # ----------------------------
+    # Batched writes (one transaction / one journal write per batch)
+    # ----------------------------
+    @metrics.timed("apply_batch")
+    def apply_batch(self, events):
+        """
+        Apply a list of (action, session_type, user_id, username, channel_id, at, guild_id)
+        events in order, in a single transaction per shard. action is "start",
+        "end", "move" (the user's sessions continue in channel_id),
+        "end_all" (close every session of the user, e.g. they disconnected)
+        or "end_channel" (close every session in channel_id), session_type
+        is "voice" or "stream", at is the epoch time the event happened and
+        guild_id may be omitted (DEFAULT_GUILD). A user has at most one open
+        session per session_type, and those run side by side.
+        Returns the result of each event (minutes recorded for "end", the
+        closed sessions for "end_all" and "end_channel"). When only part of
+        the batch was stored, the leaderboards still get its totals before
+        the PartialBatchError is raised.
+        """
+        now = time.time()
+        # events without a time happened now, in every backend
+        events = [event if event[5] is not None else event[:5] + (now,) + tuple(event[6:]) for event in events]
+        for event in events:
+            if event[3] and event[2] is not None:
+                self._observe_name(event[6] if len(event) > 6 else DEFAULT_GUILD, event[2], event[3])
+
         try:
-            return sqlite3.connect(self.db_path)
-        except:
-            if self.memory_db is None:
-                self.memory_db = sqlite3.connect(':memory:')
-                self._init_memory_tables(self.memory_db)
-            return self.memory_db
-    
-    def _init_memory_tables(self, conn):
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS streamers (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                total_stream_time INTEGER DEFAULT 0,
-                stream_sessions INTEGER DEFAULT 0,
-                last_streamed TIMESTAMP
-            )
-        ''')
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS voice_time (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                total_voice_time INTEGER DEFAULT 0,
-                voice_sessions INTEGER DEFAULT 0,
-                last_joined TIMESTAMP
-            )
-        ''')
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS active_sessions (
-                user_id INTEGER PRIMARY KEY,
-                session_type TEXT,
-                start_time TIMESTAMP,
-                channel_id INTEGER
-            )
-        ''')
-        conn.commit()
-    
-    def init_database(self):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS streamers (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                total_stream_time INTEGER DEFAULT 0,
-                stream_sessions INTEGER DEFAULT 0,
-                last_streamed TIMESTAMP
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS voice_time (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                total_voice_time INTEGER DEFAULT 0,
-                voice_sessions INTEGER DEFAULT 0,
-                last_joined TIMESTAMP
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS active_sessions (
-                user_id INTEGER PRIMARY KEY,
-                session_type TEXT,
-                start_time TIMESTAMP,
-                channel_id INTEGER
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
-        print("✅ Database initialized (File + Memory fallback)")
-    
-    def start_voice_session(self, user_id, username, channel_id):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT OR REPLACE INTO active_sessions 
-            (user_id, session_type, start_time, channel_id)
-            VALUES (?, 'voice', datetime('now'), ?)
-        ''', (user_id, channel_id))
-        
-        conn.commit()
-        conn.close()
-        print(f"🎧 Voice session started for {username}")
-    
-    def end_voice_session(self, user_id):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT start_time FROM active_sessions 
-            WHERE user_id = ? AND session_type = 'voice'
-        ''', (user_id,))
-        
-        result = cursor.fetchone()
-        if result:
-            start_time = datetime.fromisoformat(result[0])
-            duration = (datetime.now() - start_time).total_seconds()
-            
-            cursor.execute('SELECT total_voice_time FROM voice_time WHERE user_id = ?', (user_id,))
-            current_data = cursor.fetchone()
-            current_total = current_data[0] if current_data else 0
-            
-            cursor.execute('''
-                INSERT INTO voice_time (user_id, username, total_voice_time, voice_sessions, last_joined)
-                VALUES (?, ?, ?, 1, datetime('now'))
-                ON CONFLICT(user_id) 
-                DO UPDATE SET 
-                    total_voice_time = ?,
-                    voice_sessions = voice_sessions + 1,
-                    last_joined = datetime('now')
-            ''', (user_id, f"User_{user_id}", current_total + duration, current_total + duration))
-            
-            cursor.execute('DELETE FROM active_sessions WHERE user_id = ?', (user_id,))
-            
-            conn.commit()
-            conn.close()
-            print(f"⏱️ Recorded {duration/60:.1f} minutes voice time")
-            return duration / 60
-        
-        conn.close()
-        return 0
-    
-    def start_stream_session(self, user_id, username, channel_id):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT OR REPLACE INTO active_sessions 
-            (user_id, session_type, start_time, channel_id)
-            VALUES (?, 'stream', datetime('now'), ?)
-        ''', (user_id, channel_id))
-        
-        conn.commit()
-        conn.close()
-        print(f"🎬 Stream session started for {username}")
-    
-    def end_stream_session(self, user_id):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT start_time FROM active_sessions 
-            WHERE user_id = ? AND session_type = 'stream'
-        ''', (user_id,))
-        
-        result = cursor.fetchone()
-        if result:
-            start_time = datetime.fromisoformat(result[0])
-            duration = (datetime.now() - start_time).total_seconds()
-            
-            cursor.execute('SELECT total_stream_time FROM streamers WHERE user_id = ?', (user_id,))
-            current_data = cursor.fetchone()
-            current_total = current_data[0] if current_data else 0
-            
-            cursor.execute('''
-                INSERT INTO streamers (user_id, username, total_stream_time, stream_sessions, last_streamed)
-                VALUES (?, ?, ?, 1, datetime('now'))
-                ON CONFLICT(user_id) 
-                DO UPDATE SET 
-                    total_stream_time = ?,
-                    stream_sessions = stream_sessions + 1,
-                    last_streamed = datetime('now')
-            ''', (user_id, f"User_{user_id}", current_total + duration, current_total + duration))
-            
-            cursor.execute('DELETE FROM active_sessions WHERE user_id = ?', (user_id,))
-            
-            conn.commit()
-            conn.close()
-            print(f"⏱️ Recorded {duration/60:.1f} minutes stream time")
-            return duration / 60
-        
-        conn.close()
-        return 0
-    
-    def get_top_voice_users(self, limit=5):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT user_id, username, total_voice_time, voice_sessions
-            FROM voice_time 
-            ORDER BY total_voice_time DESC 
-            LIMIT ?
-        ''', (limit,))
-        
-        results = cursor.fetchall()
-        conn.close()
-        
-        return [{'user_id': row[0], 'username': row[1], 'total_voice_time': row[2], 'sessions': row[3]} for row in results]
-    
-    def get_top_streamers(self, limit=5):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT user_id, username, total_stream_time, stream_sessions
-            FROM streamers 
-            ORDER BY total_stream_time DESC 
-            LIMIT ?
-        ''', (limit,))
-        
-        results = cursor.fetchall()
-        conn.close()
-        
-        return [{'user_id': row[0], 'username': row[1], 'total_stream_time': row[2], 'sessions': row[3]} for row in results]
-    
-    def get_user_watch_stats(self, user_id):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT total_voice_time, voice_sessions FROM voice_time WHERE user_id = ?', (user_id,))
-        
-        result = cursor.fetchone()
-        conn.close()
-        
+            results, changed = self.backend.apply_batch(events)
+        except PartialBatchError as e:
+            self._apply_changes(e.changed)
+            self._flush_names()
+            raise
+        self._apply_changes(changed)
+        self._flush_names()
+        return results
+
+    # ----------------------------
+    # Display names
+    # ----------------------------
+    def _observe_name(self, guild_id, user_id, username):
+        current = self.names.get(guild_id, user_id)
+        if current == username:
+            return
+        stored = [row for row in (board.get(user_id) for board in self.leaderboards.get(guild_id, {}).values())
+                  if row is not None]
+        if current is None and stored:
+            # first sighting since startup: compare with the stored name
+            current = stored[0][0]
+        if current == username or not stored:
+            # nothing stored under another name (a new row is written with this one)
+            self.names.put(guild_id, user_id, username)
+            return
+        self.names.put(guild_id, user_id, username, dirty=True)
+        for board in self.leaderboards.get(guild_id, {}).values():
+            board.rename(user_id, username)
+        self.top_cache.invalidate_if(
+            lambda key, rows: key[0] == guild_id and any(row[0] == user_id for row in rows))
+
+    def display_name(self, user_id, guild_id=DEFAULT_GUILD):
+        """Best known name of a user, without asking Discord."""
+        name = self.names.get(guild_id, user_id)
+        if name is None:
+            for board in self.leaderboards.get(guild_id, {}).values():
+                row = board.get(user_id)
+                if row is not None:
+                    return row[0]
+        return name or f"User_{user_id}"
+
+    def _flush_names(self, force=False):
+        """Write renamed members back to the totals, one batch per flush."""
+        if not self.names.dirty:
+            return
+        if (not force and self.names.dirty < NAME_FLUSH_BATCH
+                and time.monotonic() - self._names_flushed < NAME_FLUSH_INTERVAL):
+            return
+        renamed = self.names.drain_dirty()
+        self._names_flushed = time.monotonic()
+        try:
+            self.backend.rename(renamed)
+        except Exception as e:
+            # keep them for the next flush
+            for guild_id, user_id, name in renamed:
+                self.names.put(guild_id, user_id, name, dirty=True)
+            log.error("❌ Failed to persist %d display names: %s", len(renamed), e)
+            return
+        log.debug("📝 Persisted %d display names", len(renamed))
+
+    def _apply_changes(self, changed):
+        # only committed totals make it into the rankings
+        for guild_id, session_type, user_id, username, total, sessions in changed:
+            known = self.names.get(guild_id, user_id)
+            if known is not None and known != username:
+                # row was stored with an older or placeholder name; the next name flush fixes it
+                self.names.put(guild_id, user_id, known, dirty=True)
+            self._board(guild_id, session_type).update(user_id, known or username, total, sessions)
+            self._invalidate_cached(guild_id, session_type, user_id, total)
+        if changed:
+            for listener in self.change_listeners:
+                listener(changed)
+
+    def apply_changes(self, changed):
+        """Rank totals committed by another process (a replica's change feed, see ipc.py)."""
+        self._apply_changes(changed)
+
+    def _invalidate_cached(self, guild_id, session_type, user_id, total):
+        """Drop only the cached results a new total can change."""
+        if session_type == "voice":
+            self.stats_cache.invalidate((guild_id, user_id))
+
+        def affected(key, rows):
+            if key[:2] != (guild_id, session_type):
+                return False
+            limit = key[2]
+            # a short list grows, a listed user moves, or the user climbs into the top
+            return (len(rows) < limit
+                    or any(row[0] == user_id for row in rows)
+                    or total >= rows[-1][2])
+
+        self.top_cache.invalidate_if(affected)
+
+    # ----------------------------
+    # Public API: start/end/queries
+    # ----------------------------
+    @metrics.timed("start_voice_session")
+    def start_voice_session(self, user_id, username, channel_id, at=None, guild_id=DEFAULT_GUILD):
+        self.apply_batch([("start", "voice", user_id, username, channel_id, at, guild_id)])
+        log.debug("🎧 Voice session started for %s", username)
+
+    @metrics.timed("end_voice_session")
+    def end_voice_session(self, user_id, at=None, guild_id=DEFAULT_GUILD):
+        duration = self.apply_batch([("end", "voice", user_id, None, None, at, guild_id)])[0]
+        if duration:
+            log.debug("⏱️ Recorded %.1f minutes voice time", duration)
+        return duration
+
+    @metrics.timed("start_stream_session")
+    def start_stream_session(self, user_id, username, channel_id, at=None, guild_id=DEFAULT_GUILD):
+        self.apply_batch([("start", "stream", user_id, username, channel_id, at, guild_id)])
+        log.debug("🎬 Stream session started for %s", username)
+
+    @metrics.timed("end_stream_session")
+    def end_stream_session(self, user_id, at=None, guild_id=DEFAULT_GUILD):
+        duration = self.apply_batch([("end", "stream", user_id, None, None, at, guild_id)])[0]
+        if duration:
+            log.debug("⏱️ Recorded %.1f minutes stream time", duration)
+        return duration
+
+    @metrics.timed("end_user_sessions")
+    def end_user_sessions(self, user_id, at=None, guild_id=DEFAULT_GUILD):
+        """Close all of a user's open sessions (voice, stream, ...) at once, e.g. on disconnect."""
+        closed = self.apply_batch([("end_all", None, user_id, None, None, at, guild_id)])[0]
+        for sess in closed:
+            log.debug("⏱️ Recorded %.1f minutes %s time", sess['minutes'], sess['session_type'])
+        return closed
+
+    @metrics.timed("end_channel_sessions")
+    def end_channel_sessions(self, channel_id, at=None, guild_id=DEFAULT_GUILD):
+        """Close every open session in a channel at once (e.g. the channel was deleted)."""
+        closed = self.apply_batch([("end_channel", None, None, None, channel_id, at, guild_id)])[0]
+        if closed:
+            log.info("⏱️ Closed %d sessions in deleted channel %s", len(closed), channel_id)
+        return closed
+
+    @metrics.timed("reconcile_sessions")
+    def reconcile_sessions(self, snapshot, at=None, stale_cap=RECONCILE_STALE_CAP, shard=None):
+        """
+        Startup reconciliation against the gateway's current voice states.
+        snapshot is {guild_id: [(user_id, session_type, channel_id[, username]), ...]}
+        for every guild the bot is in.
+        - Sessions of users who are no longer there are closed, crediting at
+          most `stale_cap` seconds since we can't know when they left.
+        - Users already in voice without a session get one starting now.
+        - Sessions that still match are left running.
+        - A bot in exactly one guild first adopts the rows stored before guild
+          support (DEFAULT_GUILD) into it, so an upgraded single-server
+          deployment keeps its stats and its open sessions aren't closed as stale.
+        shard=(shard_id, shard_count) limits the closing to that gateway
+        shard's guilds, for a process that only sees those.
+        One transaction per shard. Returns {'closed': n, 'opened': n, 'kept': n}.
+        """
+        if at is None:
+            at = time.time()
+        if shard is None and len(snapshot) == 1 and DEFAULT_GUILD not in snapshot:
+            self._adopt_default_guild(next(iter(snapshot)))
+        present = []
+        for guild_id, states in snapshot.items():
+            for state in states:
+                user_id, session_type, channel_id = state[:3]
+                if len(state) > 3 and state[3]:
+                    self._observe_name(guild_id, user_id, state[3])
+                present.append((guild_id, user_id, session_type, channel_id))
+        counts, changed = self.backend.reconcile(present, at, stale_cap, shard)
+        self._apply_changes(changed)
+        self._flush_names()
+        log.info("🔄 Reconciled active sessions: %d closed, %d opened, %d kept",
+                 counts['closed'], counts['opened'], counts['kept'])
+        return counts
+
+    def _adopt_default_guild(self, guild_id):
+        changed = self.backend.adopt_guild(guild_id)
+        if not changed:
+            return
+        self.leaderboards.pop(DEFAULT_GUILD, None)
+        self.top_cache.clear()
+        self.stats_cache.clear()
+        self._apply_changes(changed)
+        log.info("🏠 Moved %d totals from before guild support into guild %s", len(changed), guild_id)
+
+    @metrics.timed("checkpoint_sessions")
+    def checkpoint_sessions(self, at=None):
+        """
+        Move the time every open session has accumulated so far into the
+        totals and restart its clock (start_time = now), so a crash loses at
+        most one checkpoint interval. Returns the number of sessions
+        checkpointed.
+        """
+        # whole milliseconds, so the advanced start_time is exactly where the credited time ends
+        at = epoch_ms(at) / 1000
+        checkpointed, changed = self.backend.checkpoint(at)
+        self._apply_changes(changed)
+        log.debug("💾 Checkpointed %d open sessions", checkpointed)
+        return checkpointed
+
+    @metrics.timed("get_top_voice_users")
+    def get_top_voice_users(self, limit=5, live=False, guild_id=DEFAULT_GUILD):
+        """Top users by voice time in a guild. live=True also counts sessions that are still open."""
+        rows = self._get_top(guild_id, "voice", limit, live)
+        return [{'user_id': row[0], 'username': row[1], 'total_voice_time': row[2], 'sessions': row[3]} for row in rows]
+
+    @metrics.timed("get_top_streamers")
+    def get_top_streamers(self, limit=5, live=False, guild_id=DEFAULT_GUILD):
+        """Top users by stream time in a guild. live=True also counts streams that are still running."""
+        rows = self._get_top(guild_id, "stream", limit, live)
+        return [{'user_id': row[0], 'username': row[1], 'total_stream_time': row[2], 'sessions': row[3]} for row in rows]
+
+    def _get_top(self, guild_id, session_type, limit, live):
+        if live:
+            return self._get_live_top(guild_id, session_type, limit)
+        return self.top_cache.get_or_load(
+            (guild_id, session_type, limit), lambda: self._board(guild_id, session_type).top(limit))
+
+    def _get_live_top(self, guild_id, session_type, limit, at=None):
+        """
+        "As of now" top-K: stored totals plus the elapsed time of open sessions.
+        Only users with an open session can overtake the stored top-K, so the
+        candidates are the stored top-K plus every open session, and the work
+        is O(K + open sessions) rather than O(all users). SQLite answers it in
+        one query; the other backends merge their open sessions with the
+        in-memory leaderboard.
+        """
+        end_time = epoch_ms(at)
+        rows = self.backend.live_top(guild_id, session_type, limit, end_time)
+        if rows is not None:
+            # stored names can lag behind a rename until the next name flush
+            return [(user_id, self.display_name(user_id, guild_id), total, sessions)
+                    for user_id, _, total, sessions in rows]
+        board = self._board(guild_id, session_type)
+        candidates = {row[0]: row for row in board.top(limit)}
+        for user_id, start_time in self.backend.open_sessions(guild_id, session_type):
+            elapsed = max(0, (end_time - start_time) / 1000)
+            username, total, sessions = board.get(user_id) or (self.display_name(user_id, guild_id), 0, 0)
+            candidates[user_id] = (user_id, username, total + elapsed, sessions)
+        return heapq.nlargest(limit, candidates.values(), key=lambda row: row[2])
+
+    @metrics.timed("get_top_windowed")
+    def get_top_windowed(self, session_type="stream", window="week", limit=5, guild_id=DEFAULT_GUILD, at=None):
+        """
+        Top users by time closed in the current hour/day/week/month, read from
+        the rollups rather than raw sessions.
+        """
+        if at is None:
+            at = time.time()
+        granularity, start, end = rollups.window_range(window, at)
+        rows = self.top_cache.get_or_load(
+            (guild_id, session_type, limit, window, rollups.bucket_start(granularity, at)),
+            lambda: [(user_id, self.display_name(user_id, guild_id), total, sessions)
+                     for user_id, total, sessions in self.backend.windowed_top(
+                         guild_id, session_type, granularity, start, end, limit)])
+        total_col = SESSION_COLUMNS[session_type][1]
+        return [{'user_id': row[0], 'username': row[1], total_col: row[2], 'sessions': row[3]} for row in rows]
+
+    @metrics.timed("prune_history")
+    def prune_history(self, keep_days=30, keep_hourly_days=None, at=None):
+        """
+        Retention: drop raw session_history rows older than keep_days (they
+        are already in the rollups) and, optionally, hourly rollups older than
+        keep_hourly_days. Returns the number of raw rows removed.
+        """
+        if at is None:
+            at = time.time()
+        cutoff = at - keep_days * rollups.DAY
+        hourly_cutoff = at - keep_hourly_days * rollups.DAY if keep_hourly_days is not None else None
+        removed = self.backend.prune(epoch_ms(cutoff), hourly_cutoff)
+        if removed:
+            log.info("🧹 Pruned %d session history rows older than %d days", removed, keep_days)
+        return removed
+
+    @metrics.timed("get_user_rank")
+    def get_user_rank(self, user_id, session_type="voice", guild_id=DEFAULT_GUILD):
+        """1-based leaderboard position of a user in a guild, or None if they have no time recorded."""
+        return self._board(guild_id, session_type).rank(user_id)
+
+    @metrics.timed("get_user_watch_stats")
+    def get_user_watch_stats(self, user_id, guild_id=DEFAULT_GUILD):
+        return self.stats_cache.get_or_load(
+            (guild_id, user_id), lambda: self._load_user_watch_stats(user_id, guild_id))
+
+    def _load_user_watch_stats(self, user_id, guild_id):
+        result = self.backend.user_totals(guild_id, user_id, "voice")
         if result:
             return {'total_voice_time': result[0], 'sessions': result[1]}
         return None
+
+    @metrics.timed("get_user_stats")
+    def get_user_stats(self, user_id, guild_id=DEFAULT_GUILD):
+        """
+        What !vt mystats shows, per session type: total, sessions, rank out
+        of `ranked` members, percentile (share of ranked members at or below
+        the user), and average session length against the guild median.
+        None for a type with no time recorded. Served from the in-memory
+        leaderboards and distributions, never from storage.
+        """
+        stats = {}
+        for session_type in SESSION_COLUMNS:
+            board = self._board(guild_id, session_type)
+            row = board.get(user_id)
+            rank = board.rank(user_id)
+            if row is None or rank is None:
+                stats[session_type] = None
+                continue
+            _, total, sessions = row
+            ranked = len(board)
+            average = total / sessions if sessions else None
+            lengths = self.session_lengths.get((guild_id, session_type))
+            stats[session_type] = {
+                'total_time': total,
+                'sessions': sessions,
+                'rank': rank,
+                'ranked': ranked,
+                'percentile': 100.0 * (ranked - rank + 1) / ranked,
+                'average_session': average,
+                'median_session': lengths.median(),
+                'session_percentile': (100.0 * lengths.share_at_or_below(average)
+                                       if average is not None and len(lengths) else None),
+            }
+        return stats
+
+    def count_open_sessions(self):
+        """{session_type: number of sessions being tracked right now} across all guilds."""
+        return self.backend.count_open()
+
+    def leaderboard_version(self, guild_id, session_type):
+        """Changes whenever a total or name on the guild's leaderboard does (see render_cache.py)."""
+        return self._board(guild_id, session_type).version
+
+    def cache_stats(self):
+        """Hit/miss counters of the query caches."""
+        return {'top': self.top_cache.stats(), 'stats': self.stats_cache.stats()}
@@ -0,0 +1,61 @@
+# distribution.py
+"""
+Distribution
+- Sorted array of one value per user (e.g. average session length in a
+  guild), so the median is an index lookup and "where does this user
+  stand" is a bisect: O(log n) per !vt mystats however many members there are.
+- Built from the in-memory Leaderboard, never from a table scan, and only
+  rebuilt when the leaderboard changed and the last build is older than
+  `max_age` seconds (see DistributionCache).
+"""
+
+import threading
+import time
+from array import array
+from bisect import bisect_right
+
+
+class Distribution:
+    def __init__(self, values=()):
+        self.values = array("d", sorted(values))
+
+    def __len__(self):
+        return len(self.values)
+
+    def median(self):
+        n = len(self.values)
+        if not n:
+            return None
+        middle = n // 2
+        if n % 2:
+            return self.values[middle]
+        return (self.values[middle - 1] + self.values[middle]) / 2
+
+    def share_at_or_below(self, value):
+        """Fraction (0..1) of values <= value."""
+        if not self.values:
+            return None
+        return bisect_right(self.values, value) / len(self.values)
+
+
+class DistributionCache:
+    """key -> Distribution built by `build(key)`, refreshed when `version(key)` moved on and max_age passed."""
+
+    def __init__(self, build, version, max_age=60.0):
+        self.build = build
+        self.version = version
+        self.max_age = max_age
+        self._entries = {}  # key -> (built_at, version, Distribution)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        now = time.monotonic()
+        current = self.version(key)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and (entry[1] == current or now - entry[0] < self.max_age):
+            return entry[2]
+        distribution = Distribution(self.build(key))
+        with self._lock:
+            self._entries[key] = (now, current, distribution)
+        return distribution
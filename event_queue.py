@@ -0,0 +1,197 @@
+# event_queue.py
+"""
+WriteBehindQueue
+- Bounded asyncio queue between VoiceTimeTracker and VoiceTrackerDatabase.
+- A background writer drains it and applies events in batches, one
+  transaction per batch, every `flush_interval` seconds or as soon as
+  `batch_size` events are waiting.
+- The database work runs on a single writer thread so the event loop (and
+  the gateway heartbeat) never waits on a commit.
+- When the queue is full, `submit` waits for room (backpressure).
+- `call` runs arbitrary database work (e.g. startup reconciliation) on the
+  writer thread, ordered with the events around it.
+"""
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from storage import PartialBatchError
+import logs
+import metrics
+
+log = logs.get_logger("writer")
+
+_STOP = object()
+_CALL = object()
+
+
+class WriteBehindQueue:
+    def __init__(self, database, max_pending=10000, batch_size=200, flush_interval=0.05):
+        self.db = database
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = None
+        self._batch_ready = None
+        self._task = None
+        # a single thread keeps batches in submission order
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self.batches_written = 0
+        self.events_written = 0
+        self._batch_seconds = metrics.REGISTRY.histogram(
+            "voice_tracker_write_batch_seconds", "Time to write one batch of queued events")
+        self._batch_sizes = metrics.REGISTRY.histogram(
+            "voice_tracker_write_batch_size", "Events per written batch", buckets=(1, 5, 10, 25, 50, 100, 200, 500))
+        self._events_total = metrics.REGISTRY.counter(
+            "voice_tracker_events_written_total", "Queued events written to the database")
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    @property
+    def pending(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def start(self):
+        """Start the background writer on the running event loop."""
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_pending)
+        self._batch_ready = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def submit(self, action, session_type, user_id, username=None, channel_id=None, at=None, guild_id=0):
+        """
+        Queue one event and return as soon as it is accepted.
+        The returned future resolves to the database result once the batch is
+        written; callers don't need to await it.
+        """
+        if not self.running:
+            self.start()
+        if at is None:
+            at = time.time()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(((action, session_type, user_id, username, channel_id, at, guild_id), future))
+        if self._queue.qsize() >= self.batch_size:
+            self._batch_ready.set()
+        return future
+
+    async def call(self, fn, *args):
+        """
+        Run fn(*args) on the writer thread once every event submitted before
+        it has been written, and return its result.
+        """
+        if not self.running:
+            self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(((_CALL, fn, args), future))
+        self._batch_ready.set()
+        return await future
+
+    async def close(self):
+        """Flush everything still queued and stop the writer."""
+        if self.running:
+            await self._queue.put(_STOP)
+            self._batch_ready.set()
+            await self._task
+        self._task = None
+        self._executor.shutdown(wait=True)
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            batch = []
+            if item is _STOP:
+                stopping = True
+            else:
+                batch.append(item)
+                # give the batch up to flush_interval to fill, unless it is already full
+                try:
+                    await asyncio.wait_for(self._batch_ready.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._batch_ready.clear()
+
+            while len(batch) < self.batch_size and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            if batch:
+                await self._write(batch)
+
+        # anything queued behind the stop marker still gets written
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not _STOP:
+                await self._write([item])
+
+    async def _write(self, batch):
+        # calls split the batch so they see exactly the events queued before them
+        start = 0
+        for i, (event, future) in enumerate(batch):
+            if event[0] is _CALL:
+                if start < i:
+                    await self._write_events(batch[start:i])
+                await self._run_call(event, future)
+                start = i + 1
+        if start < len(batch):
+            await self._write_events(batch[start:])
+
+    async def _run_call(self, event, future):
+        _, fn, args = event
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(self._executor, fn, *args)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+            return
+        if not future.done():
+            future.set_result(result)
+
+    async def _write_events(self, batch):
+        events = [event for event, _ in batch]
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        try:
+            results = await loop.run_in_executor(self._executor, self.db.apply_batch, events)
+        except Exception as e:
+            # one bad event must not drop the rest of the batch: write them one by one
+            log.warning("⚠️ Failed to write %d queued events, retrying one by one: %s", len(events), e)
+            done = e.done if isinstance(e, PartialBatchError) else {}
+            results = []
+            for i, (event, future) in enumerate(batch):
+                if i in done:
+                    results.append(done[i])
+                    continue
+                try:
+                    results.append((await loop.run_in_executor(self._executor, self.db.apply_batch, [event]))[0])
+                except Exception as error:
+                    log.error("❌ Dropped queued %s event of user %s: %s", event[0], event[2], error)
+                    self._fail(future, error)
+                    results.append(None)
+
+        written = 0
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+                written += 1
+        self.batches_written += 1
+        self.events_written += written
+        self._batch_seconds.observe(time.perf_counter() - start)
+        self._batch_sizes.observe(len(events))
+        self._events_total.inc(written)
+
+    @staticmethod
+    def _fail(future, error):
+        if future.done():
+            return
+        future.set_exception(error)
+        # submit() callers rarely await their future; the error is logged already
+        future.exception()
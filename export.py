@@ -0,0 +1,264 @@
+# export.py
+"""
+Export
+- Streams streamers, voice_time and session_history out of storage in
+  chunks of `chunk_size` rows, so memory stays bounded by one chunk
+  whatever the table size.
+- SQLite is read with keyset pagination on a separate read-only
+  connection, one short read transaction per chunk, so live writes (WAL)
+  are never blocked by an export. JSON and in-memory backends copy one
+  chunk at a time under their lock.
+- Formats: csv, or "columns", a compact binary columnar file (typed
+  arrays per column per chunk, see write_columns / read_columns).
+- From the running bot: `await tracker.read(export.export_table, db.backend, ...)`.
+  From a shell, against a SQLite file (safe while the bot is running):
+
+    python export.py /tmp/voice_tracker.db --table session_history --format columns -o history.vtc
+"""
+
+import json
+import os
+import struct
+import sys
+from array import array
+
+# table -> ((column, type), ...); "int?" / "str?" columns can be NULL
+EXPORT_TABLES = {
+    "streamers": (("guild_id", "int"), ("user_id", "int"), ("username", "str?"),
+                  ("total_stream_time", "float"), ("stream_sessions", "int"), ("last_streamed", "int?")),
+    "voice_time": (("guild_id", "int"), ("user_id", "int"), ("username", "str?"),
+                   ("total_voice_time", "float"), ("voice_sessions", "int"), ("last_joined", "int?")),
+    "session_history": (("guild_id", "int"), ("user_id", "int"), ("session_type", "str"),
+                        ("channel_id", "int?"), ("start_time", "int"), ("end_time", "int"),
+                        ("duration", "float")),
+}
+
+# keyset order of each table in SQLite
+SQLITE_KEYS = {
+    "streamers": ("guild_id", "user_id"),
+    "voice_time": ("guild_id", "user_id"),
+    "session_history": ("id",),
+}
+
+FORMATS = ("csv", "columns")
+MAGIC = b"VTC1"
+DEFAULT_CHUNK_SIZE = 5000
+
+
+def columns_of(table):
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"Cannot export {table!r}, expected one of {', '.join(EXPORT_TABLES)}")
+    return [name for name, _ in EXPORT_TABLES[table]]
+
+
+# ----------------------------
+# SQLite reader
+# ----------------------------
+def iter_sqlite(conn, table, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yield lists of row tuples from one SQLite file, ordered by primary key.
+    Each chunk is a separate statement that resumes after the last key seen,
+    so no read transaction stays open between chunks.
+    """
+    columns = columns_of(table)
+    keys = SQLITE_KEYS[table]
+    selected = columns + [key for key in keys if key not in columns]
+    positions = [selected.index(key) for key in keys]
+    key_list = ", ".join(keys)
+    selected = ", ".join(selected)
+    after = None
+    while True:
+        if after is None:
+            rows = conn.execute(f'SELECT {selected} FROM {table} ORDER BY {key_list} LIMIT ?',
+                                (chunk_size,)).fetchall()
+        else:
+            placeholders = ", ".join("?" * len(keys))
+            rows = conn.execute(f'SELECT {selected} FROM {table} WHERE ({key_list}) > ({placeholders}) '
+                                f'ORDER BY {key_list} LIMIT ?', (*after, chunk_size)).fetchall()
+        if not rows:
+            return
+        after = tuple(rows[-1][position] for position in positions)
+        yield [row[:len(columns)] for row in rows]
+        if len(rows) < chunk_size:
+            return
+
+
+# ----------------------------
+# Writers
+# ----------------------------
+def write_csv(chunks, table, f):
+    import csv
+
+    writer = csv.writer(f)
+    writer.writerow(columns_of(table))
+    written = 0
+    for rows in chunks:
+        writer.writerows(rows)
+        written += len(rows)
+    return written
+
+
+# unsigned widths for frame-of-reference packed ints, narrowest first
+_UINT_TYPES = "BHIQ"
+
+
+def _encode_ints(values):
+    # frame of reference: block minimum + offsets in the narrowest width that fits
+    # (snowflake ids within a guild, millisecond times within a chunk stay small)
+    base = min(values)
+    span = max(values) - base
+    code = next(code for code in _UINT_TYPES if span < 1 << (8 * array(code).itemsize))
+    return struct.pack("<qc", base, code.encode()) + array(code, (value - base for value in values)).tobytes()
+
+
+def _decode_ints(f, count, swap):
+    base, code = struct.unpack("<qc", f.read(9))
+    return [base + value for value in _read_array(f, code.decode(), count, swap)]
+
+
+def _encode_floats(values):
+    # float32 when that loses nothing (whole or half seconds), float64 otherwise
+    narrow = array("f", values)
+    code = "f" if list(narrow) == list(values) else "d"
+    return code.encode() + (narrow if code == "f" else array("d", values)).tobytes()
+
+
+def _decode_floats(f, count, swap):
+    code = f.read(1).decode()
+    return list(_read_array(f, code, count, swap))
+
+
+def _encode_column(kind, values):
+    nullable = kind.endswith("?")
+    kind = kind.rstrip("?")
+    parts = []
+    if nullable:
+        parts.append(array("B", (value is None for value in values)).tobytes())
+    if kind == "str":
+        encoded = [(value or "").encode("utf-8") for value in values]
+        parts.append(_encode_ints([len(value) for value in encoded]))
+        parts.append(b"".join(encoded))
+    elif kind == "int":
+        parts.append(_encode_ints([0 if value is None else value for value in values]))
+    else:
+        parts.append(_encode_floats([0.0 if value is None else float(value) for value in values]))
+    return b"".join(parts)
+
+
+def write_columns(chunks, table, f):
+    """
+    Columnar file: MAGIC, a length-prefixed JSON header (table, columns,
+    byte order), then one block per chunk: the row count followed by each
+    column as a typed array. Ints are a base plus offsets in the narrowest
+    unsigned width, floats are float32 when lossless, strings are packed
+    lengths and one UTF-8 blob; nullable columns start with a null mask.
+    A zero row count ends the file.
+    """
+    schema = EXPORT_TABLES[table]
+    header = json.dumps({"table": table, "columns": schema, "byteorder": sys.byteorder}).encode()
+    f.write(MAGIC + struct.pack("<I", len(header)) + header)
+    written = 0
+    for rows in chunks:
+        if not rows:
+            continue
+        f.write(struct.pack("<I", len(rows)))
+        for i, (_, kind) in enumerate(schema):
+            f.write(_encode_column(kind, [row[i] for row in rows]))
+        written += len(rows)
+    f.write(struct.pack("<I", 0))
+    return written
+
+
+def _read_array(f, typecode, count, swap):
+    values = array(typecode)
+    values.frombytes(f.read(values.itemsize * count))
+    if swap:
+        values.byteswap()
+    return values
+
+
+def read_columns(f):
+    """Read a file written by write_columns: yields one {column: list} per chunk."""
+    if f.read(4) != MAGIC:
+        raise ValueError("Not a voice tracker columnar export")
+    (length,) = struct.unpack("<I", f.read(4))
+    header = json.loads(f.read(length))
+    swap = header["byteorder"] != sys.byteorder
+    while True:
+        (count,) = struct.unpack("<I", f.read(4))
+        if not count:
+            return
+        block = {}
+        for name, kind in header["columns"]:
+            nulls = list(_read_array(f, "B", count, False)) if kind.endswith("?") else None
+            base = kind.rstrip("?")
+            if base == "str":
+                lengths = _decode_ints(f, count, swap)
+                blob = f.read(sum(lengths))
+                values, offset = [], 0
+                for n in lengths:
+                    values.append(blob[offset:offset + n].decode("utf-8"))
+                    offset += n
+            elif base == "int":
+                values = _decode_ints(f, count, swap)
+            else:
+                values = _decode_floats(f, count, swap)
+            if nulls is not None:
+                values = [None if null else value for value, null in zip(values, nulls)]
+            block[name] = values
+        yield block
+
+
+WRITERS = {"csv": write_csv, "columns": write_columns}
+
+
+def export_table(source, table, path, fmt="csv", chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Write one table to `path`. source is a storage backend (anything with
+    iter_rows) or an open sqlite3 connection. Returns the number of rows.
+    """
+    columns_of(table)
+    if fmt not in WRITERS:
+        raise ValueError(f"Unknown export format {fmt!r}, expected one of {', '.join(FORMATS)}")
+    if hasattr(source, "iter_rows"):
+        chunks = source.iter_rows(table, chunk_size)
+    else:
+        chunks = iter_sqlite(source, table, chunk_size)
+    tmp_path = path + ".tmp"
+    mode, newline = ("w", "") if fmt == "csv" else ("wb", None)
+    with open(tmp_path, mode, newline=newline, **({"encoding": "utf-8"} if fmt == "csv" else {})) as f:
+        written = WRITERS[fmt](chunks, table, f)
+    os.replace(tmp_path, path)
+    return written
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export voice tracker tables in chunks")
+    parser.add_argument("db_path", help="SQLite database file (each shard file is exported separately)")
+    parser.add_argument("--table", nargs="+", choices=sorted(EXPORT_TABLES), default=list(EXPORT_TABLES))
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    parser.add_argument("-o", "--output", help="output file (one table) or directory (default: next to the database)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    from connection import connect_readonly
+
+    conn = connect_readonly(args.db_path)
+    suffix = "csv" if args.format == "csv" else "vtc"
+    try:
+        for table in args.table:
+            if args.output and len(args.table) == 1 and not os.path.isdir(args.output):
+                path = args.output
+            else:
+                directory = args.output or os.path.dirname(os.path.abspath(args.db_path))
+                path = os.path.join(directory, f"{table}.{suffix}")
+            written = export_table(conn, table, path, args.format, args.chunk_size)
+            print(f"📤 {table}: {written} rows -> {path}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
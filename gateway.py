@@ -0,0 +1,232 @@
+# gateway.py
+"""
+The bot (discord.py)
+- `!vt` commands: bot_help, topstreamers, topvoice, mystats. Leaderboards
+  are served pre-rendered (render_cache.py); other queries run on the
+  tracker's read pool, so storage never blocks the gateway. Each channel is
+  rate limited (ratelimit.py).
+- On ready: syncs sessions with who is in voice, starts metrics, the
+  session checkpointer, history pruning and the leaderboard pre-render, and
+  logs how long startup took (startup.py). On shutdown: flushes queued events and closes
+  storage.
+- `run()` is the whole bot in one process; `run((shard_id, shard_count), authkey)`
+  is one gateway shard of main.run_sharded(): events go to the writer process
+  (ipc.py) and commands are answered from a read-only replica.
+"""
+
+import discord
+from discord.ext import commands
+
+import config
+import logs
+import startup
+from database import VoiceTrackerDatabase
+from storage import resolve_backend
+from tracker import VoiceTimeTracker
+from render_cache import LeaderboardCache, WINDOWS, format_duration
+from ratelimit import RateLimiter
+
+log = logs.get_logger("bot")
+
+intents = discord.Intents.default()
+intents.voice_states = True
+intents.members = True
+intents.message_content = True
+
+bot = None       # built by run(), with the gateway shard it identifies as
+db = None        # where writes go: VoiceTrackerDatabase, or RemoteDatabase in a shard process
+reads = None     # where queries go: the same database, or a read-only replica
+tracker = None
+leaderboards = None
+shard = None     # (shard_id, shard_count) in a gateway shard process
+limiter = RateLimiter(config.COMMAND_RATE, config.COMMAND_RATE_PERIOD)
+_started = False
+
+
+# ----------------------------
+# Gateway events
+# ----------------------------
+async def on_ready():
+    global _started
+    log.info("✅ Logged in as %s (%d guilds)", bot.user, len(bot.guilds))
+    if shard is not None and identified_shard(bot) != shard:
+        # unsharded, this process would get (and write) every guild's events
+        log.error("❌ Identified as shard %s, expected %s; stopping", identified_shard(bot), shard)
+        await bot.close()
+        return
+    if not _started:
+        startup.mark("login")
+    # on every (re)connect: close sessions of members who left while we were away
+    await tracker.reconcile(bot.guilds, shard)
+    if not _started:
+        _started = True
+        startup.mark("reconcile")
+        if shard is None:
+            tracker.start_metrics(config.METRICS_PORT, config.STATS_DUMP_INTERVAL)
+            tracker.start_checkpointer(config.CHECKPOINT_INTERVAL)
+            tracker.start_pruner(config.PRUNE_INTERVAL, config.HISTORY_RETENTION_DAYS,
+                                 config.HOURLY_ROLLUP_RETENTION_DAYS)
+        else:
+            # the writer process serves metrics and runs the checkpoints and the pruning
+            tracker.start_metrics(None, config.STATS_DUMP_INTERVAL)
+        tracker.start_prerender(leaderboards, lambda: [guild.id for guild in bot.guilds],
+                                config.LEADERBOARD_REFRESH_INTERVAL)
+        startup.report(log)
+
+
+async def on_voice_state_update(member, before, after):
+    if member.bot:
+        return
+    await tracker.handle_voice_state_update(member, before, after)
+
+
+async def on_guild_remove(guild):
+    leaderboards.forget(guild.id)
+
+
+async def on_guild_channel_delete(channel):
+    if isinstance(channel, (discord.VoiceChannel, discord.StageChannel)):
+        await tracker.handle_channel_delete(channel)
+
+
+# ----------------------------
+# Commands
+# ----------------------------
+async def in_guild(ctx):
+    """Leaderboards and stats are per server; in a DM say so instead of failing."""
+    if ctx.guild is not None:
+        return True
+    await ctx.send("❌ This command only works in a server channel")
+    return False
+
+
+def allowed(ctx):
+    """Per-channel rate limit: spam past it is dropped without a reply."""
+    if limiter.allow(ctx.channel.id):
+        return True
+    log.debug("🚦 Rate limited %s in #%s", ctx.command, ctx.channel)
+    return False
+
+
+@commands.command(name="bot_help")
+async def bot_help(ctx):
+    if not allowed(ctx):
+        return
+    embed = discord.Embed(title="🎧 Voice Tracker commands", color=discord.Color.blurple())
+    embed.add_field(name="!vt topstreamers [day|week|month]", value="Top 5 streamers by total streaming time",
+                    inline=False)
+    embed.add_field(name="!vt topvoice [day|week|month]", value="Top 5 users by total voice channel time",
+                    inline=False)
+    embed.add_field(name="!vt mystats", value="Your own voice and streaming statistics", inline=False)
+    await ctx.send(embed=embed)
+
+
+async def send_leaderboard(ctx, session_type, window):
+    if not allowed(ctx) or not await in_guild(ctx):
+        return
+    if window not in WINDOWS:
+        await ctx.send(f"❌ Unknown period `{window}`, use one of: {', '.join(WINDOWS)}")
+        return
+    payload = leaderboards.get(ctx.guild.id, session_type, window)
+    if payload is None:  # not pre-rendered yet (new guild, or right after startup)
+        payload = await tracker.read(leaderboards.refresh, ctx.guild.id, session_type, window)
+    await ctx.send(embed=discord.Embed.from_dict(payload))
+
+
+@commands.command(name="topstreamers")
+async def topstreamers(ctx, window="all"):
+    await send_leaderboard(ctx, "stream", window)
+
+
+@commands.command(name="topvoice")
+async def topvoice(ctx, window="all"):
+    await send_leaderboard(ctx, "voice", window)
+
+
+def stats_field(stats):
+    line = (f"{format_duration(stats['total_time'])} · {stats['sessions']} sessions\n"
+            f"Rank #{stats['rank']} of {stats['ranked']} · percentile {stats['percentile']:.0f}")
+    if stats['average_session'] is not None and stats['median_session'] is not None:
+        line += (f"\nAvg session {format_duration(stats['average_session'])}"
+                 f" vs server median {format_duration(stats['median_session'])}")
+        if stats['session_percentile'] is not None:
+            line += f" · percentile {stats['session_percentile']:.0f}"
+    return line
+
+
+@commands.command(name="mystats")
+async def mystats(ctx):
+    if not allowed(ctx) or not await in_guild(ctx):
+        return
+    member = ctx.author
+    stats = await tracker.read(reads.get_user_stats, member.id, guild_id=ctx.guild.id)
+    embed = discord.Embed(title=f"📊 Stats for {member.display_name}", color=discord.Color.blue())
+    if not stats['voice'] and not stats['stream']:
+        embed.description = "No time recorded yet — join a voice channel!"
+        await ctx.send(embed=embed)
+        return
+    if stats['voice']:
+        embed.add_field(name="🎧 Voice", value=stats_field(stats['voice']), inline=False)
+    if stats['stream']:
+        embed.add_field(name="🎬 Streaming", value=stats_field(stats['stream']), inline=False)
+    await ctx.send(embed=embed)
+
+
+# ----------------------------
+# Startup / shutdown
+# ----------------------------
+EVENTS = (on_ready, on_voice_state_update, on_guild_remove, on_guild_channel_delete)
+COMMANDS = (bot_help, topstreamers, topvoice, mystats)
+
+
+def build_bot(gateway_shard=None):
+    """The bot with its events and commands; identifies as gateway_shard=(shard_id, shard_count) if given."""
+    shard_id, shard_count = gateway_shard if gateway_shard is not None else (None, None)
+    client = commands.Bot(command_prefix="!vt ", intents=intents, help_command=None,
+                          shard_id=shard_id, shard_count=shard_count)
+    for event in EVENTS:
+        client.event(event)
+    for command in COMMANDS:
+        client.add_command(command)
+    return client
+
+
+def identified_shard(client):
+    """(shard_id, shard_count) the gateway connection sent in IDENTIFY, None parts if unsharded."""
+    ws = client.ws
+    return (ws.shard_id, ws.shard_count) if ws is not None else (None, None)
+
+
+async def run(gateway_shard=None, authkey=None):
+    """The bot in this process: everything (default), or one gateway shard of main.run_sharded()."""
+    global bot, db, reads, tracker, leaderboards, shard
+    logs.configure()
+    startup.mark("imports")
+    shard = gateway_shard
+    bot = build_bot(shard)
+    replica = None
+    if shard is None:
+        db = reads = VoiceTrackerDatabase(config.DB_PATH, backend=config.STORAGE_BACKEND, shards=config.DB_SHARDS,
+                                          snapshot_interval=config.SNAPSHOT_INTERVAL)
+    else:
+        from ipc import RemoteDatabase
+
+        db = reads = RemoteDatabase(config.IPC_SOCKET, authkey)
+        if resolve_backend(config.STORAGE_BACKEND) == "sqlite":
+            # subscribe before loading, so no total committed in between is missed
+            db.subscribe(*shard)
+            replica = reads = VoiceTrackerDatabase(config.DB_PATH, backend="sqlite", shards=config.DB_SHARDS,
+                                                   read_only=True, shard=shard)
+            db.attach(replica.apply_changes)
+    tracker = VoiceTimeTracker(db)
+    leaderboards = LeaderboardCache(reads)
+    startup.mark("storage")
+    try:
+        async with bot:
+            await bot.start(config.BOT_TOKEN)
+    finally:
+        await tracker.close()
+        if replica is not None:
+            replica.close()
+        db.close()
+        print("👋 Voice tracker stopped")
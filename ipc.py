@@ -0,0 +1,394 @@
+# ipc.py
+"""
+One writer process, many gateway processes
+- WriterServer runs in the process that owns VoiceTrackerDatabase. Gateway
+  shard processes connect over a local Unix socket (multiprocessing.connection,
+  pickled tuples, authkey handshake) and send their batches of voice events.
+- Every write runs on one thread in arrival order; apply_batch requests
+  waiting together from several shards are merged into one apply_batch call,
+  so the SQLite file sees a single writer and one transaction per round.
+- RemoteDatabase is the gateway side: it stands in for VoiceTrackerDatabase
+  under VoiceTimeTracker / WriteBehindQueue (apply_batch, reconcile_sessions,
+  ...), one blocking round trip per call.
+- Committed totals are pushed back to subscribed shards (only rows of their
+  own guilds), so a read-only replica (VoiceTrackerDatabase(read_only=True))
+  keeps its leaderboards current without ever writing.
+"""
+
+import itertools
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from multiprocessing.connection import Client, Listener
+
+from storage import gateway_shard, PartialBatchError
+import logs
+import metrics
+
+log = logs.get_logger("ipc")
+
+# methods a gateway process may call; writes run in order on the writer thread
+WRITE_METHODS = {"apply_batch", "reconcile_sessions", "checkpoint_sessions", "prune_history"}
+READ_METHODS = {"get_top_voice_users", "get_top_streamers", "get_top_windowed", "get_user_stats",
+                "get_user_rank", "leaderboard_version", "count_open_sessions", "cache_stats"}
+
+# most events merged into one apply_batch call
+MAX_MERGED_EVENTS = 2000
+
+
+class _Peer:
+    """One connected gateway process."""
+
+    def __init__(self, conn, name):
+        self.conn = conn
+        self.name = name
+        self.shard = None  # (shard_id, shard_count) once subscribed to committed totals
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def send(self, message):
+        if self.closed:
+            return
+        try:
+            with self.lock:
+                self.conn.send(message)
+        except (OSError, EOFError, BrokenPipeError):
+            self.closed = True
+
+
+class WriterServer:
+    def __init__(self, database, address, authkey, read_workers=2):
+        self.db = database
+        self.address = address
+        if os.path.exists(address):
+            os.unlink(address)  # left behind by a writer that crashed
+        self.listener = Listener(address, family="AF_UNIX", authkey=authkey)
+        self._requests = queue.Queue()  # (peer, request_id, method, args, kwargs), or None to stop
+        self._readers = ThreadPoolExecutor(max_workers=read_workers, thread_name_prefix="ipc-reader")
+        self._peers = []
+        self._peers_lock = threading.Lock()
+        self._peer_ids = itertools.count(1)
+        self._writer = None
+        self._stopping = False
+        self.merged = metrics.REGISTRY.histogram(
+            "voice_tracker_ipc_merged_batches", "Shard batches merged into one write",
+            buckets=(1, 2, 4, 8, 16, 32))
+        database.change_listeners.append(self._publish)
+        print(f"✅ Writer listening on {address}")
+
+    def start(self):
+        threading.Thread(target=self._accept_loop, name="ipc-accept", daemon=True).start()
+        self._writer = threading.Thread(target=self._write_loop, name="ipc-writer", daemon=True)
+        self._writer.start()
+
+    def submit(self, method, *args, **kwargs):
+        """Run a write from this process (e.g. checkpoints) in order with the shards' writes."""
+        future = Future()
+        self._requests.put((future, None, method, args, kwargs))
+        return future
+
+    def drain(self, timeout):
+        """Wait up to `timeout` seconds for the gateway processes to flush and disconnect."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._peers_lock:
+                if not self._peers:
+                    return True
+            time.sleep(0.1)
+        return False
+
+    def close(self):
+        """Finish every queued write, then stop accepting and drop the connections."""
+        self._stopping = True
+        self._requests.put(None)
+        if self._writer is not None:
+            self._writer.join()
+        try:
+            self.listener.close()
+        except OSError:
+            pass
+        with self._peers_lock:
+            for peer in self._peers:
+                peer.closed = True
+                peer.conn.close()
+        self._readers.shutdown(wait=True)
+
+    # ----------------------------
+    # Connections
+    # ----------------------------
+    def _accept_loop(self):
+        while not self._stopping:
+            try:
+                conn = self.listener.accept()
+            except (OSError, EOFError) as e:
+                if not self._stopping:
+                    log.warning("⚠️ Rejected a connection: %s", e)
+                    continue
+                return
+            peer = _Peer(conn, f"peer-{next(self._peer_ids)}")
+            with self._peers_lock:
+                self._peers.append(peer)
+            threading.Thread(target=self._read_loop, args=(peer,), name=f"ipc-{peer.name}", daemon=True).start()
+
+    def _read_loop(self, peer):
+        while True:
+            try:
+                request_id, method, args, kwargs = peer.conn.recv()
+            except (OSError, EOFError):
+                break
+            if method == "close":
+                break
+            if method == "subscribe":
+                peer.shard = tuple(args)
+                peer.send((request_id, True, None))
+            elif method in WRITE_METHODS:
+                self._requests.put((peer, request_id, method, args, kwargs))
+            elif method in READ_METHODS:
+                self._readers.submit(self._run_read, peer, request_id, method, args, kwargs)
+            else:
+                peer.send((request_id, False, f"unknown method {method!r}"))
+        peer.closed = True
+        peer.conn.close()
+        with self._peers_lock:
+            self._peers.remove(peer)
+        log.info("🔌 %s disconnected", peer.name)
+
+    def _run_read(self, peer, request_id, method, args, kwargs):
+        try:
+            peer.send((request_id, True, getattr(self.db, method)(*args, **kwargs)))
+        except Exception as e:
+            peer.send((request_id, False, repr(e)))
+
+    def _publish(self, changed):
+        # runs on the writer thread right after a commit, so shards see totals in commit order
+        with self._peers_lock:
+            peers = [peer for peer in self._peers if peer.shard is not None]
+        for peer in peers:
+            shard_id, shard_count = peer.shard
+            rows = [row for row in changed if gateway_shard(row[0], shard_count) == shard_id]
+            if rows:
+                peer.send((None, True, rows))
+
+    # ----------------------------
+    # Writes
+    # ----------------------------
+    def _write_loop(self):
+        backlog = []  # a request taken off the queue while merging, handled next
+        while True:
+            request = backlog.pop() if backlog else self._requests.get()
+            if request is None:
+                return
+            if request[2] != "apply_batch":
+                self._run_write(request)
+                continue
+            # merge every apply_batch already waiting behind this one
+            batch = [request]
+            events = len(request[3][0])
+            while events < MAX_MERGED_EVENTS:
+                try:
+                    following = self._requests.get_nowait()
+                except queue.Empty:
+                    break
+                if following is None or following[2] != "apply_batch":
+                    backlog.append(following)
+                    break
+                batch.append(following)
+                events += len(following[3][0])
+            self._write_merged(batch)
+
+    def _write_merged(self, batch):
+        self.merged.observe(len(batch))
+        if len(batch) == 1:
+            self._finish_batch(batch[0], {})
+            return
+        events = [event for request in batch for event in request[3][0]]
+        try:
+            done = dict(enumerate(self.db.apply_batch(events)))
+        except PartialBatchError as e:
+            log.error("❌ Merged write of %d events partly failed, retrying the rest per shard: %s", len(events), e)
+            done = e.done
+        except Exception as e:
+            log.error("❌ Merged write of %d events failed, retrying per shard: %s", len(events), e)
+            done = {}
+        start = 0
+        for request in batch:
+            count = len(request[3][0])
+            self._finish_batch(request, {i - start: result for i, result in done.items()
+                                         if start <= i < start + count})
+            start += count
+
+    def _finish_batch(self, request, done):
+        """Reply to an apply_batch request, writing the events not already stored (index -> result in done)."""
+        events = request[3][0]
+        rest = [i for i in range(len(events)) if i not in done]
+        if rest:
+            try:
+                results = self.db.apply_batch([events[i] for i in rest])
+            except Exception as e:
+                if isinstance(e, PartialBatchError):
+                    done.update((rest[i], result) for i, result in e.done.items())
+                    e = e.error
+                log.error("❌ apply_batch failed: %s", e)
+                self._reply(request, False, PartialBatchError(e, done) if done else e)
+                return
+            done.update(zip(rest, results))
+        self._reply(request, True, [done[i] for i in range(len(events))])
+
+    def _run_write(self, request):
+        _, _, method, args, kwargs = request
+        try:
+            result = getattr(self.db, method)(*args, **kwargs)
+        except Exception as e:
+            log.error("❌ %s failed: %s", method, e)
+            self._reply(request, False, e)
+            return
+        self._reply(request, True, result)
+
+    @staticmethod
+    def _reply(request, ok, value):
+        target, request_id = request[0], request[1]
+        if isinstance(target, Future):  # submitted in this process
+            if ok:
+                target.set_result(value)
+            else:
+                target.set_exception(value)
+            return
+        if ok:
+            target.send((request_id, True, value))
+        elif isinstance(value, PartialBatchError):
+            # the shard must know which events were stored, or its retry counts them twice
+            target.send((request_id, False, PartialBatchError(repr(value.error), value.done)))
+        else:
+            target.send((request_id, False, repr(value)))
+
+
+class RemoteDatabase:
+    """VoiceTrackerDatabase calls forwarded to a WriterServer, for gateway shard processes."""
+
+    def __init__(self, address, authkey, connect_timeout=30.0, call_timeout=60.0):
+        self.address = address
+        self.authkey = authkey
+        self.call_timeout = call_timeout
+        self._pending = {}  # request_id -> Future
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        # committed totals arrive before the replica exists; they wait here until attach()
+        self._on_change = None
+        self._buffered = []
+        self._feed_lock = threading.Lock()
+        self._closing = False
+        self.conn = self._connect(connect_timeout)
+        self._receiver = threading.Thread(target=self._receive_loop, name="ipc-receiver", daemon=True)
+        self._receiver.start()
+
+    def _connect(self, timeout):
+        # the writer may still be starting (creating or migrating the database)
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                return Client(self.address, family="AF_UNIX", authkey=self.authkey)
+            except (FileNotFoundError, ConnectionRefusedError):
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(0.2)
+
+    def _receive_loop(self):
+        while True:
+            try:
+                request_id, ok, value = self.conn.recv()
+            except (OSError, EOFError):
+                break
+            if request_id is None:
+                self._feed(value)
+                continue
+            with self._lock:
+                future = self._pending.pop(request_id, None)
+            if future is not None:
+                if ok:
+                    future.set_result(value)
+                elif isinstance(value, PartialBatchError):
+                    future.set_exception(value)
+                else:
+                    future.set_exception(RuntimeError(f"writer: {value}"))
+        if not self._closing:
+            log.error("❌ Lost the connection to the writer at %s", self.address)
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            future.set_exception(ConnectionError("writer process went away"))
+
+    def _feed(self, changed):
+        with self._feed_lock:
+            if self._on_change is None:
+                self._buffered.extend(changed)
+                return
+            self._on_change(changed)
+
+    def call(self, method, *args, **kwargs):
+        future = Future()
+        with self._lock:
+            self._next_id += 1
+            request_id = self._next_id
+            self._pending[request_id] = future
+        with self._send_lock:
+            self.conn.send((request_id, method, args, kwargs))
+        return future.result(self.call_timeout)
+
+    # ----------------------------
+    # Change feed
+    # ----------------------------
+    def subscribe(self, shard_id, shard_count):
+        """Start receiving committed totals of this gateway shard's guilds (buffered until attach)."""
+        return self.call("subscribe", shard_id, shard_count)
+
+    def attach(self, on_change):
+        """Deliver the buffered and all further committed totals to on_change (e.g. replica.apply_changes)."""
+        with self._feed_lock:
+            if self._buffered:
+                on_change(self._buffered)
+                self._buffered = []
+            self._on_change = on_change
+
+    # ----------------------------
+    # VoiceTrackerDatabase API
+    # ----------------------------
+    def apply_batch(self, events):
+        return self.call("apply_batch", events)
+
+    def reconcile_sessions(self, snapshot, at=None, shard=None):
+        return self.call("reconcile_sessions", snapshot, at, shard=shard)
+
+    def checkpoint_sessions(self, at=None):
+        return self.call("checkpoint_sessions", at)
+
+    def count_open_sessions(self):
+        return self.call("count_open_sessions")
+
+    def leaderboard_version(self, guild_id, session_type):
+        return self.call("leaderboard_version", guild_id, session_type)
+
+    def get_top_voice_users(self, limit=5, live=False, guild_id=0):
+        return self.call("get_top_voice_users", limit, live, guild_id=guild_id)
+
+    def get_top_streamers(self, limit=5, live=False, guild_id=0):
+        return self.call("get_top_streamers", limit, live, guild_id=guild_id)
+
+    def get_top_windowed(self, session_type="stream", window="week", limit=5, guild_id=0, at=None):
+        return self.call("get_top_windowed", session_type, window, limit, guild_id=guild_id, at=at)
+
+    def get_user_stats(self, user_id, guild_id=0):
+        return self.call("get_user_stats", user_id, guild_id=guild_id)
+
+    def close(self):
+        """Tell the writer we're leaving (it closes its end), then close ours."""
+        self._closing = True
+        try:
+            with self._send_lock:
+                self.conn.send((None, "close", (), {}))
+        except OSError:
+            pass
+        self._receiver.join(5)
+        self.conn.close()
@@ -0,0 +1,401 @@
+# json_backend.py
+"""
+JsonBackend
+- Fallback for hosts where sqlite3 or the system sqlite library is missing.
+- Rows live in dicts keyed "guild:user" (see JournalStore in json_store.py);
+  each batch of changes is appended to a journal in one write.
+- Per-user totals (streamers, voice_time) are kept column-wise in
+  StatsColumns (stats_columns.py), a few dozen bytes per user instead of a
+  dict row, with a binary snapshot that loads in one pass.
+- Open sessions are keyed "guild:user:session_type", one per type, so a
+  streamer's voice session stays open next to the stream.
+"""
+
+import heapq
+import threading
+
+from json_store import JournalStore
+from stats_columns import StatsColumns
+from storage import StorageBackend, SESSION_COLUMNS, DEFAULT_GUILD, epoch_ms, gateway_shard, apply_in_order
+import rollups
+import migrations
+import export
+
+
+class JsonBackend(StorageBackend):
+    kind = "json"
+
+    def __init__(self, json_path, name_of):
+        super().__init__(json_path, name_of)
+        self.lock = threading.Lock()
+        # store structure: { "streamers": {"guild:user": {...}}, "voice_time": {...}, "active_sessions": {...} }
+        # kept in memory; changes go to an append-only journal, see json_store.py
+        self.store = JournalStore(json_path)
+        self._migrate_keys()
+        migrations.migrate_json(self.store)
+        # session_type -> StatsColumns; after this the totals tables are no longer in store.data
+        self.totals = {session_type: StatsColumns(total_col, sessions_col, last_col)
+                       for session_type, (_, total_col, sessions_col, last_col) in SESSION_COLUMNS.items()}
+        self.store.attach_columns({SESSION_COLUMNS[session_type][0]: columns
+                                   for session_type, columns in self.totals.items()})
+        print("✅ JSON fallback store initialized")
+
+    def close(self):
+        with self.lock:
+            self.store.close()
+
+    @staticmethod
+    def _key(guild_id, user_id):
+        return f"{guild_id or DEFAULT_GUILD}:{user_id}"
+
+    @staticmethod
+    def _session_key(guild_id, user_id, session_type):
+        return f"{guild_id or DEFAULT_GUILD}:{user_id}:{session_type}"
+
+    def _add_total(self, changed, guild_id, user_id, session_type, seconds, sessions, at_ms):
+        """
+        Add to a user's totals (creating the row), journal it and record the
+        change. at_ms=None (checkpoints) keeps the stored last_joined/last_streamed.
+        """
+        table, total_col, sessions_col, last_col = SESSION_COLUMNS[session_type]
+        current = self.totals[session_type].get(guild_id, user_id)
+        if current is None:
+            username, total, count, last_seen = self.name_of(user_id, guild_id), 0, 0, None
+        else:
+            username, total, count, last_seen = current
+        total += seconds
+        count += sessions
+        self.store.set(table, self._key(guild_id, user_id), {
+            "guild_id": guild_id,
+            "user_id": user_id,
+            "username": username,
+            total_col: total,
+            sessions_col: count,
+            last_col: at_ms if at_ms is not None else last_seen
+        })
+        changed.append((guild_id, session_type, user_id, username, total, count))
+
+    def _migrate_keys(self):
+        """Re-key entries from before guild support ("user") as "0:user"."""
+        with self.lock:
+            for table, rows in self.store.data.items():
+                if table == "meta":
+                    continue
+                for key in [k for k in rows if ":" not in k]:
+                    row = dict(rows[key], guild_id=DEFAULT_GUILD)
+                    self.store.delete(table, key)
+                    self.store.set(table, self._key(DEFAULT_GUILD, key), row)
+            self.store.commit()
+
+    # ----------------------------
+    # Session events
+    # ----------------------------
+    def apply_batch(self, events):
+        changed = []
+        with self.lock:
+            try:
+                results = apply_in_order(self._apply, changed, events)
+            finally:
+                # events before a failing one are already in the dicts; journal them too
+                self.store.commit()
+        return results, changed
+
+    def _apply(self, changed, action, session_type, user_id, username, channel_id, at,
+               guild_id=DEFAULT_GUILD):
+        if action == "start":
+            self.store.set("active_sessions", self._session_key(guild_id, user_id, session_type), {
+                "guild_id": guild_id,
+                "user_id": user_id,
+                "session_type": session_type,
+                "start_time": epoch_ms(at),
+                "channel_id": channel_id
+            })
+            return None
+        if action == "move":
+            for key, sess in self._user_sessions(guild_id, user_id).items():
+                self.store.set("active_sessions", key, dict(sess, channel_id=channel_id))
+            return None
+        if action == "end_channel":
+            prefix = self._key(guild_id, "")
+            return self._end_sessions(
+                changed, lambda key, sess: key.startswith(prefix) and sess.get("channel_id") == channel_id, at)
+        if action == "end_all":
+            return self._end_sessions(changed, lambda k, _: True, at, self._user_sessions(guild_id, user_id))
+
+        key = self._session_key(guild_id, user_id, session_type)
+        sess = self.store.data["active_sessions"].get(key)
+        if not sess:
+            return 0
+        closed = self._end_sessions(changed, lambda k, _: k == key, at, {key: sess})
+        return closed[0]["minutes"] if closed else 0
+
+    def _user_sessions(self, guild_id, user_id):
+        """{key: session} of every session type the user has open, by key lookup."""
+        active = self.store.data["active_sessions"]
+        keys = (self._session_key(guild_id, user_id, session_type) for session_type in SESSION_COLUMNS)
+        return {key: active[key] for key in keys if key in active}
+
+    def _end_sessions(self, changed, match, at, candidates=None):
+        end_time = epoch_ms(at)
+        closed = []
+        if candidates is None:
+            candidates = dict(self.store.data["active_sessions"])
+        for key, sess in candidates.items():
+            if not match(key, sess) or sess.get("session_type") not in SESSION_COLUMNS:
+                continue
+            guild_id, uid = sess["guild_id"], sess["user_id"]
+            duration = max(0, (end_time - sess["start_time"]) / 1000)
+            credited = sess.get("checkpointed", 0)
+
+            self._add_total(changed, guild_id, uid, sess["session_type"], duration, 1, end_time)
+            self._record_history(guild_id, uid, sess, duration, at, credited)
+
+            # remove active session
+            self.store.delete("active_sessions", key)
+            closed.append({'guild_id': guild_id, 'user_id': uid, 'session_type': sess["session_type"],
+                           'minutes': (credited + duration) / 60})
+        return closed
+
+    def _record_history(self, guild_id, user_id, sess, duration, at, credited=0):
+        session_type = sess["session_type"]
+        self.store.set("session_history", f"{guild_id}:{user_id}:{session_type}:{at}", {
+            "guild_id": guild_id,
+            "user_id": user_id,
+            "session_type": session_type,
+            "channel_id": sess.get("channel_id"),
+            "start_time": epoch_ms(at - credited - duration),
+            "end_time": epoch_ms(at),
+            "duration": credited + duration
+        })
+        self._add_rollups(guild_id, user_id, session_type, at - duration, at)
+
+    def _add_rollups(self, guild_id, user_id, session_type, start, end, sessions=1):
+        rollup_data = self.store.data["session_rollups"]
+        for granularity, bucket, _, _, _, seconds, sessions in rollups.rollup_rows(
+                guild_id, user_id, session_type, start, end, sessions):
+            key = f"{granularity}:{guild_id}:{session_type}:{bucket}:{user_id}"
+            row = rollup_data.get(key, {"total_time": 0, "sessions": 0})
+            self.store.set("session_rollups", key, {
+                "total_time": row["total_time"] + seconds,
+                "sessions": row["sessions"] + sessions
+            })
+
+    # ----------------------------
+    # Reconciliation and checkpoints
+    # ----------------------------
+    def reconcile(self, present, at, stale_cap, shard=None):
+        counts = {'closed': 0, 'opened': 0, 'kept': 0}
+        changed = []
+        wanted = {self._session_key(guild_id, user_id, session_type): (guild_id, user_id, session_type, channel_id)
+                  for guild_id, user_id, session_type, channel_id in present}
+        earliest = epoch_ms(at - stale_cap)
+        with self.lock:
+            stale = {}
+            for key, sess in self.store.data["active_sessions"].items():
+                if shard is not None and gateway_shard(sess["guild_id"], shard[1]) != shard[0]:
+                    continue
+                if key not in wanted:
+                    stale[key] = dict(sess, start_time=max(sess["start_time"], earliest))
+            counts['closed'] += len(self._end_sessions(changed, lambda key, sess: True, at, stale))
+
+            active = self.store.data["active_sessions"]
+            for key, (guild_id, user_id, session_type, channel_id) in wanted.items():
+                if key in active:
+                    counts['kept'] += 1
+                    continue
+                self.store.set("active_sessions", key, {
+                    "guild_id": guild_id,
+                    "user_id": user_id,
+                    "session_type": session_type,
+                    "start_time": epoch_ms(at),
+                    "channel_id": channel_id
+                })
+                counts['opened'] += 1
+            self.store.commit()
+        return counts, changed
+
+    def checkpoint(self, at):
+        changed = []
+        with self.lock:
+            checkpointed = self._checkpoint(changed, at)
+            self.store.commit()
+        return checkpointed, changed
+
+    def _checkpoint(self, changed, at):
+        now = epoch_ms(at)
+        checkpointed = 0
+        for key, sess in list(self.store.data["active_sessions"].items()):
+            session_type = sess.get("session_type")
+            if session_type not in SESSION_COLUMNS:
+                continue
+            elapsed = max(0, (now - sess["start_time"]) / 1000)
+            if elapsed <= 0:
+                continue
+            guild_id, uid = sess["guild_id"], sess["user_id"]
+            self._add_total(changed, guild_id, uid, session_type, elapsed, 0, None)
+            self.store.set("active_sessions", key, dict(
+                sess, start_time=now, checkpointed=sess.get("checkpointed", 0) + elapsed))
+            self._add_rollups(guild_id, uid, session_type, at - elapsed, at, sessions=0)
+            checkpointed += 1
+        return checkpointed
+
+    def adopt_guild(self, guild_id):
+        changed = []
+        with self.lock:
+            active = self.store.data["active_sessions"]
+            prefix = self._key(DEFAULT_GUILD, "")
+            open_keys = [key for key in active if key.startswith(prefix)]
+            if not open_keys and not any(DEFAULT_GUILD in columns.slots for columns in self.totals.values()):
+                return changed
+
+            for session_type, columns in self.totals.items():
+                table, total_col, sessions_col, last_col = SESSION_COLUMNS[session_type]
+                for user_id in list(columns.slots.get(DEFAULT_GUILD, ())):
+                    username, total, sessions, last_seen = columns.get(DEFAULT_GUILD, user_id)
+                    current = columns.get(guild_id, user_id)
+                    if current is not None:
+                        username = current[0]
+                        total += current[1]
+                        sessions += current[2]
+                        last_seen = max((t for t in (last_seen, current[3]) if t is not None), default=None)
+                    self.store.delete(table, self._key(DEFAULT_GUILD, user_id))
+                    self.store.set(table, self._key(guild_id, user_id), {
+                        "guild_id": guild_id,
+                        "user_id": user_id,
+                        "username": username,
+                        total_col: total,
+                        sessions_col: sessions,
+                        last_col: last_seen
+                    })
+                    changed.append((guild_id, session_type, user_id, username, total, sessions))
+
+            for key in open_keys:
+                sess = active[key]
+                self.store.delete("active_sessions", key)
+                moved = self._session_key(guild_id, sess["user_id"], sess["session_type"])
+                if moved not in active:
+                    self.store.set("active_sessions", moved, dict(sess, guild_id=guild_id))
+
+            history = self.store.data["session_history"]
+            for key in [key for key in history if key.startswith(prefix)]:
+                row = history[key]
+                self.store.delete("session_history", key)
+                self.store.set("session_history", f"{guild_id}:{key[len(prefix):]}", dict(row, guild_id=guild_id))
+
+            rollup_data = self.store.data["session_rollups"]
+            for key in list(rollup_data):
+                granularity, row_guild, rest = key.split(":", 2)
+                if int(row_guild) != DEFAULT_GUILD:
+                    continue
+                row = rollup_data[key]
+                self.store.delete("session_rollups", key)
+                moved = f"{granularity}:{guild_id}:{rest}"
+                current = rollup_data.get(moved, {"total_time": 0, "sessions": 0})
+                self.store.set("session_rollups", moved, {
+                    "total_time": current["total_time"] + row["total_time"],
+                    "sessions": current["sessions"] + row["sessions"]
+                })
+            self.store.commit()
+        return changed
+
+    # ----------------------------
+    # Reads
+    # ----------------------------
+    def load_totals(self, session_type):
+        with self.lock:
+            rows = list(self.totals[session_type].rows())
+        for guild_id, user_id, username, total, sessions, _ in rows:
+            yield guild_id, user_id, username, total, sessions
+
+    def user_totals(self, guild_id, user_id, session_type):
+        with self.lock:
+            row = self.totals[session_type].get(guild_id or DEFAULT_GUILD, user_id)
+        if row:
+            return row[1], row[2]
+        return None
+
+    def open_sessions(self, guild_id, session_type):
+        prefix = self._key(guild_id, "")
+        with self.lock:
+            return [(sess["user_id"], sess["start_time"])
+                    for key, sess in self.store.data["active_sessions"].items()
+                    if key.startswith(prefix) and sess.get("session_type") == session_type]
+
+    def windowed_top(self, guild_id, session_type, granularity, start, end, limit):
+        prefix = f"{granularity}:{guild_id}:{session_type}:"
+        totals = {}
+        with self.lock:
+            for key, row in self.store.data["session_rollups"].items():
+                if not key.startswith(prefix):
+                    continue
+                bucket, user_id = (int(part) for part in key[len(prefix):].split(":"))
+                if start <= bucket < end:
+                    total, sessions = totals.get(user_id, (0, 0))
+                    totals[user_id] = (total + row["total_time"], sessions + row["sessions"])
+        top = heapq.nlargest(limit, totals.items(), key=lambda item: item[1][0])
+        return [(user_id, total, sessions) for user_id, (total, sessions) in top]
+
+    def prune(self, history_before, hourly_before=None):
+        removed = 0
+        with self.lock:
+            for key, row in list(self.store.data["session_history"].items()):
+                if row["end_time"] < history_before:
+                    self.store.delete("session_history", key)
+                    removed += 1
+            if hourly_before is not None:
+                for key in list(self.store.data["session_rollups"]):
+                    granularity, _, _, bucket, _ = key.split(":")
+                    if granularity == "hour" and int(bucket) < hourly_before:
+                        self.store.delete("session_rollups", key)
+            self.store.commit()
+        return removed
+
+    def iter_rows(self, table, chunk_size):
+        columns = export.columns_of(table)
+        totals = next((self.totals[session_type] for session_type, spec in SESSION_COLUMNS.items()
+                       if spec[0] == table), None)
+        if totals is not None:
+            yield from self._iter_totals(totals, columns, chunk_size)
+            return
+        with self.lock:
+            keys = list(self.store.data[table])
+        for start in range(0, len(keys), chunk_size):
+            rows = []
+            with self.lock:
+                data = self.store.data[table]
+                for key in keys[start:start + chunk_size]:
+                    row = data.get(key)
+                    if row is None:
+                        continue  # deleted since the export started
+                    rows.append(tuple(row.get(column) for column in columns))
+            yield rows
+
+    def _iter_totals(self, totals, columns, chunk_size):
+        with self.lock:
+            keys = list(zip(totals.guild_ids, totals.user_ids))
+        for start in range(0, len(keys), chunk_size):
+            rows = []
+            with self.lock:
+                for guild_id, user_id in keys[start:start + chunk_size]:
+                    row = totals.row_dict(guild_id, user_id)
+                    if row is not None:
+                        rows.append(tuple(row[column] for column in columns))
+            yield rows
+
+    def rename(self, renamed):
+        with self.lock:
+            for guild_id, user_id, name in renamed:
+                for session_type, columns in self.totals.items():
+                    row = columns.row_dict(guild_id or DEFAULT_GUILD, user_id)
+                    if row is not None and row["username"] != name:
+                        self.store.set(SESSION_COLUMNS[session_type][0], self._key(guild_id, user_id),
+                                       dict(row, username=name))
+            self.store.commit()
+
+    def count_open(self):
+        counts = {}
+        with self.lock:
+            for sess in self.store.data["active_sessions"].values():
+                session_type = sess.get("session_type")
+                counts[session_type] = counts.get(session_type, 0) + 1
+        return counts
@@ -0,0 +1,151 @@
+# json_store.py
+"""
+JournalStore
+- In-memory dicts are the source of truth for the JSON fallback.
+- Every change is appended to a line-delimited journal (`<path>.journal`)
+  instead of rewriting the whole file, so a write costs O(changed rows).
+- The journal is compacted into a snapshot (`<path>`, same layout as the old
+  JSON file) every `compact_every` records or once it grows past
+  `compact_bytes`. Snapshots are written to a temp file and renamed into place.
+- On startup the snapshot is loaded and the journal replayed on top of it.
+  Journal records are full row images, so replaying one twice is harmless.
+- Tables handed to `attach_columns` (the per-user totals) move out of the
+  dicts into StatsColumns (stats_columns.py) and are snapshotted to their own
+  binary file (`<path>.<table>.cols`); their journal records stay the same.
+"""
+
+import json
+import os
+
+TABLES = ("streamers", "voice_time", "active_sessions", "session_history", "session_rollups", "meta")
+
+
+class JournalStore:
+    def __init__(self, path, compact_every=5000, compact_bytes=4 * 1024 * 1024, fsync=False):
+        self.path = path
+        self.journal_path = path + ".journal"
+        self.compact_every = compact_every
+        self.compact_bytes = compact_bytes
+        self.fsync = fsync
+        self.data = {table: {} for table in TABLES}
+        self._pending = []
+        self._journal = None
+        self._journal_records = 0
+        self.columns = {}  # table -> StatsColumns, see attach_columns
+
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._load()
+
+    # ----------------------------
+    # Recovery
+    # ----------------------------
+    def _load(self):
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+            for table in TABLES:
+                self.data[table] = snapshot.get(table, {})
+
+        replayed = 0
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # torn last line from a crash mid-append
+                        break
+                    self._apply(record)
+                    replayed += 1
+        self._journal_records = replayed
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+        if replayed:
+            print(f"♻️ Replayed {replayed} journal records")
+            self.compact()
+
+    def _apply(self, record):
+        table, key = record["t"], record["k"]
+        if "v" in record:
+            self._put(table, key, record["v"])
+        else:
+            self._remove(table, key)
+
+    def _columns_path(self, table):
+        return f"{self.path}.{table}.cols"
+
+    def attach_columns(self, columns):
+        """
+        Keep the tables in `columns` ({table: StatsColumns}) column-wise from now on:
+        load their binary snapshots, then move the rows still in the dicts (legacy
+        snapshots, journal replay) on top.
+        """
+        moved = 0
+        for table, store in columns.items():
+            store.load(self._columns_path(table))
+            rows = self.data.pop(table)
+            for key, row in rows.items():
+                store.put_row(key, row)
+            moved += len(rows)
+            self.columns[table] = store
+        if moved:
+            self.compact()
+
+    def _put(self, table, key, value):
+        if table in self.columns:
+            self.columns[table].put_row(key, value)
+        else:
+            self.data[table][key] = value
+
+    def _remove(self, table, key):
+        if table in self.columns:
+            self.columns[table].remove_row(key)
+        else:
+            self.data[table].pop(key, None)
+
+    # ----------------------------
+    # Changes
+    # ----------------------------
+    def set(self, table, key, value):
+        self._put(table, key, value)
+        self._pending.append(json.dumps({"t": table, "k": key, "v": value}, ensure_ascii=False))
+
+    def delete(self, table, key):
+        self._remove(table, key)
+        self._pending.append(json.dumps({"t": table, "k": key}))
+
+    def commit(self):
+        """Append pending changes to the journal in one write, compacting if it got too big."""
+        if not self._pending:
+            return
+        self._journal.write("\n".join(self._pending) + "\n")
+        self._journal.flush()
+        if self.fsync:
+            os.fsync(self._journal.fileno())
+        self._journal_records += len(self._pending)
+        self._pending = []
+
+        if (self._journal_records >= self.compact_every
+                or self._journal.tell() >= self.compact_bytes):
+            self.compact()
+
+    def compact(self):
+        """Write a full snapshot atomically and start a fresh journal."""
+        for table, store in self.columns.items():
+            store.save(self._columns_path(table))
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, ensure_ascii=False, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+        # only now is it safe to drop the journal
+        self._journal.close()
+        self._journal = open(self.journal_path, "w", encoding="utf-8")
+        self._journal_records = 0
+
+    def close(self):
+        self.commit()
+        self.compact()
+        self._journal.close()
@@ -0,0 +1,178 @@
+# leaderboard.py
+"""
+Leaderboard
+- In-memory ranking of users by total time, kept up to date as sessions
+  close instead of sorting every user on each !vt topvoice / !vt topstreamers.
+- Backed by an indexable skip list: update and "what rank am I" are
+  O(log n), top-K is O(K).
+- Rebuilt from the database at startup.
+"""
+
+import random
+import threading
+
+MAX_LEVELS = 24  # comfortably covers millions of users with p = 1/2
+
+
+class _Node:
+    __slots__ = ("key", "next", "width")
+
+    def __init__(self, key, levels):
+        self.key = key
+        self.next = [None] * levels
+        self.width = [1] * levels
+
+
+class RankedIndex:
+    """
+    Indexable skip list of unique, sortable keys (ascending).
+    Each link stores how many elements it skips, which makes rank lookups
+    logarithmic.
+    """
+
+    def __init__(self):
+        self._nil = _Node((float("inf"),), 0)
+        self._head = _Node(None, MAX_LEVELS)
+        self._head.next = [self._nil] * MAX_LEVELS
+        self._size = 0
+        # levels above this are unused (head links straight to nil); skipping
+        # them keeps small indexes cheap
+        self._levels = 1
+
+    def __len__(self):
+        return self._size
+
+    def _random_level(self):
+        level = 1
+        while level < MAX_LEVELS and random.random() < 0.5:
+            level += 1
+        return level
+
+    def insert(self, key):
+        levels = self._random_level()
+        if levels > self._levels:
+            for level in range(self._levels, levels):
+                self._head.width[level] = self._size + 1
+            self._levels = levels
+
+        chain = [None] * self._levels
+        steps_at_level = [0] * self._levels
+        node = self._head
+        for level in reversed(range(self._levels)):
+            while node.next[level].key < key:
+                steps_at_level[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+
+        new = _Node(key, levels)
+        steps = 0
+        for level in range(levels):
+            prev = chain[level]
+            new.next[level] = prev.next[level]
+            prev.next[level] = new
+            new.width[level] = prev.width[level] - steps
+            prev.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(levels, self._levels):
+            chain[level].width[level] += 1
+        self._size += 1
+
+    def remove(self, key):
+        chain = [None] * self._levels
+        node = self._head
+        for level in reversed(range(self._levels)):
+            while node.next[level].key < key:
+                node = node.next[level]
+            chain[level] = node
+
+        target = chain[0].next[0]
+        if target.key != key:
+            raise KeyError(key)
+        for level in range(len(target.next)):
+            prev = chain[level]
+            prev.width[level] += target.width[level] - 1
+            prev.next[level] = target.next[level]
+        for level in range(len(target.next), self._levels):
+            chain[level].width[level] -= 1
+        self._size -= 1
+
+    def rank(self, key):
+        """0-based position of key, or None if it isn't in the index."""
+        node = self._head
+        position = 0
+        for level in reversed(range(self._levels)):
+            while node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+        if node.next[0].key != key:
+            return None
+        return position
+
+    def first(self, count):
+        keys = []
+        node = self._head.next[0]
+        while node is not self._nil and len(keys) < count:
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+
+class Leaderboard:
+    """Users ranked by total time (highest first), with their name and session count."""
+
+    def __init__(self):
+        self._index = RankedIndex()
+        self._rows = {}  # user_id -> (username, total, sessions)
+        self._lock = threading.Lock()
+        # bumped on every change to a total or name, so derived views know when to rebuild
+        self.version = 0
+
+    def __len__(self):
+        return len(self._rows)
+
+    def update(self, user_id, username, total, sessions):
+        with self._lock:
+            old = self._rows.get(user_id)
+            if old is not None:
+                self._index.remove((-old[1], user_id))
+            self._index.insert((-total, user_id))
+            self._rows[user_id] = (username, total, sessions)
+            self.version += 1
+
+    def rename(self, user_id, username):
+        """Change a user's display name without touching their position."""
+        with self._lock:
+            row = self._rows.get(user_id)
+            if row is not None and row[0] != username:
+                self._rows[user_id] = (username,) + row[1:]
+                self.version += 1
+
+    def load(self, rows):
+        """Replace the contents with (user_id, username, total, sessions) rows."""
+        with self._lock:
+            self._index = RankedIndex()
+            self._rows = {}
+        for user_id, username, total, sessions in rows:
+            self.update(user_id, username, total or 0, sessions or 0)
+
+    def get(self, user_id):
+        """(username, total, sessions) of a user, or None."""
+        return self._rows.get(user_id)
+
+    def top(self, count):
+        """Highest `count` users as (user_id, username, total, sessions)."""
+        with self._lock:
+            return [(user_id,) + self._rows[user_id] for _, user_id in self._index.first(count)]
+
+    def rank(self, user_id):
+        """1-based rank of a user, or None if they have no time recorded."""
+        with self._lock:
+            row = self._rows.get(user_id)
+            if row is None:
+                return None
+            return self._index.rank((-row[1], user_id)) + 1
+
+    def session_lengths(self):
+        """Average session length (total / sessions) of every user with a closed session."""
+        with self._lock:
+            return [total / sessions for _, total, sessions in self._rows.values() if sessions]
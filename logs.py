@@ -0,0 +1,70 @@
+# logs.py
+"""
+Logging
+- Leveled logging for the bot in place of per-event print() calls.
+- Per-event messages are DEBUG/INFO with %-style arguments, so a disabled
+  level costs one cached level check and no string formatting.
+- A rate limit per message template keeps voice event floods (raids, mass
+  stream starts) from flooding the log; suppressed counts are reported.
+- Level and rate come from LOG_LEVEL / LOG_RATE_LIMIT, see configure().
+"""
+
+import logging
+import os
+import threading
+import time
+
+ROOT = "voice_tracker"
+
+
+class RateLimitFilter(logging.Filter):
+    """Let through at most `rate` records per message template every `per` seconds."""
+
+    def __init__(self, rate=20, per=1.0):
+        super().__init__()
+        self.rate = rate
+        self.per = per
+        self._windows = {}  # (logger, template) -> [window start, emitted, suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.per:
+                suppressed = window[2] if window else 0
+                self._windows[key] = [now, 1, 0]
+                if suppressed:
+                    record.msg = f"{record.msg} (+{suppressed} similar messages suppressed)"
+                return True
+            if window[1] < self.rate:
+                window[1] += 1
+                return True
+            window[2] += 1
+            return False
+
+
+def get_logger(name):
+    return logging.getLogger(f"{ROOT}.{name}")
+
+
+def configure(level=None, rate=None, per=1.0):
+    """
+    Set up the voice_tracker loggers once at startup. level defaults to
+    $LOG_LEVEL (INFO), rate to $LOG_RATE_LIMIT messages per template per
+    second (20, 0 disables the limit).
+    """
+    level = level or os.getenv("LOG_LEVEL", "INFO")
+    rate = rate if rate is not None else int(os.getenv("LOG_RATE_LIMIT", "20"))
+    logger = logging.getLogger(ROOT)
+    logger.setLevel(level.upper() if isinstance(level, str) else level)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    if rate > 0:
+        handler.addFilter(RateLimitFilter(rate, per))
+    logger.addHandler(handler)
+    logger.propagate = False
+    return logger
@@ -1,403 +1,155 @@
-# database.py
+# main.py
 """
-VoiceTrackerDatabase
-- Uses sqlite3 when available.
-- Falls back to a JSON-backed in-memory store if sqlite3 or system sqlite library is missing.
-This makes the bot resilient when running on hosts without libsqlite3.
+Worker entrypoint (Procfile: `worker: python3 main.py`)
+- GATEWAY_SHARDS = 1 (config.py): the bot (gateway.py) and its
+  VoiceTrackerDatabase, on the storage backend chosen in config.py, all in
+  this process.
+- GATEWAY_SHARDS > 1: this process only supervises. One writer process owns
+  the database; each of the N gateway shard processes runs the bot for its
+  shard, sends events to the writer (ipc.py) and answers commands from a
+  read-only replica.
+- Modules are imported by the mode that needs them, so the supervisor and
+  the writer never load discord.py. Each process logs how long its startup
+  took, step by step (startup.py).
 """
 
+import startup  # first, so its clock covers every import below
+
+import asyncio
 import os
-from datetime import datetime
+import signal
 import time
-import threading
-import json
-
-# Try to import sqlite3; if it fails (ImportError for libsqlite), fall back.
-try:
-    import sqlite3
-    SQLITE_AVAILABLE = True
-except Exception:
-    sqlite3 = None
-    SQLITE_AVAILABLE = False
-
-class VoiceTrackerDatabase:
-    def __init__(self, db_path: str = "/tmp/voice_tracker.db"):
-        self.db_path = db_path
-        self.lock = threading.Lock()
-
-        if SQLITE_AVAILABLE:
-            self.memory_db = None
-            self._init_sqlite()
-        else:
-            # fallback json store file path
-            self.json_path = self.db_path + ".json"
-            self._init_json_store()
-            print("⚠️ sqlite3 not available — using JSON fallback store")
-
-    # ----------------------------
-    # SQLite implementation
-    # ----------------------------
-    def _init_sqlite(self):
-        # Ensure directory exists
-        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
-        conn = self.get_connection()
-        cursor = conn.cursor()
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS streamers (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                total_stream_time REAL DEFAULT 0,
-                stream_sessions INTEGER DEFAULT 0,
-                last_streamed TEXT
-            )
-        ''')
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS voice_time (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                total_voice_time REAL DEFAULT 0,
-                voice_sessions INTEGER DEFAULT 0,
-                last_joined TEXT
-            )
-        ''')
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS active_sessions (
-                user_id INTEGER PRIMARY KEY,
-                session_type TEXT,
-                start_time TEXT,
-                channel_id INTEGER
-            )
-        ''')
-
-        conn.commit()
-        conn.close()
-        print("✅ Database initialized (SQLite)")
-
-    def get_connection(self):
-        # try file connection; if it fails, create memory fallback
-        try:
-            return sqlite3.connect(self.db_path, check_same_thread=False)
-        except Exception:
-            if getattr(self, "memory_db", None) is None:
-                self.memory_db = sqlite3.connect(':memory:', check_same_thread=False)
-                self._init_memory_tables(self.memory_db)
-            return self.memory_db
-
-    def _init_memory_tables(self, conn):
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS streamers (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                total_stream_time REAL DEFAULT 0,
-                stream_sessions INTEGER DEFAULT 0,
-                last_streamed TEXT
-            )
-        ''')
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS voice_time (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                total_voice_time REAL DEFAULT 0,
-                voice_sessions INTEGER DEFAULT 0,
-                last_joined TEXT
-            )
-        ''')
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS active_sessions (
-                user_id INTEGER PRIMARY KEY,
-                session_type TEXT,
-                start_time TEXT,
-                channel_id INTEGER
-            )
-        ''')
-        conn.commit()
 
-    # ----------------------------
-    # JSON fallback implementation
-    # ----------------------------
-    def _init_json_store(self):
-        # store structure: { "streamers": {id: {...}}, "voice_time": {id: {...}}, "active_sessions": {id: {...}} }
-        if not os.path.exists(self.json_path):
-            data = {
-                "streamers": {},
-                "voice_time": {},
-                "active_sessions": {}
-            }
-            self._write_json(data)
-        print("✅ JSON fallback store initialized")
-
-    def _read_json(self):
-        with self.lock:
-            with open(self.json_path, "r", encoding="utf-8") as f:
-                return json.load(f)
-
-    def _write_json(self, data):
-        # ensure directory exists
-        os.makedirs(os.path.dirname(self.json_path), exist_ok=True)
-        with self.lock:
-            with open(self.json_path, "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-
-    # ----------------------------
-    # Common helper: now iso
-    # ----------------------------
-    def _now_iso(self):
-        # use ISO-like string compatible with datetime.fromisoformat
-        return datetime.now().replace(microsecond=0).isoformat(sep=' ')
-
-    # ----------------------------
-    # Public API: start/end/queries
-    # ----------------------------
-    def start_voice_session(self, user_id, username, channel_id):
-        if SQLITE_AVAILABLE:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT OR REPLACE INTO active_sessions
-                (user_id, session_type, start_time, channel_id)
-                VALUES (?, 'voice', datetime('now'), ?)
-            ''', (user_id, channel_id))
-            conn.commit()
-            conn.close()
-        else:
-            data = self._read_json()
-            data["active_sessions"][str(user_id)] = {
-                "session_type": "voice",
-                "start_time": self._now_iso(),
-                "channel_id": channel_id
-            }
-            self._write_json(data)
-        print(f"🎧 Voice session started for {username}")
-
-    def end_voice_session(self, user_id):
-        if SQLITE_AVAILABLE:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-
-            cursor.execute('''
-                SELECT start_time FROM active_sessions
-                WHERE user_id = ? AND session_type = 'voice'
-            ''', (user_id,))
-            result = cursor.fetchone()
-
-            if result:
-                start_time_str = result[0]
+import config
+import logs
+
+log = logs.get_logger("main")
+
+
+# ----------------------------
+# Sharded deployment: one writer, GATEWAY_SHARDS gateway processes
+# ----------------------------
+def _stop_on_sigterm(on_stop=None):
+    """
+    In a child: the first SIGTERM stops it cleanly (KeyboardInterrupt, or
+    on_stop() when given), repeats are ignored; Ctrl-C is the supervisor's.
+    """
+    def stop(signum, frame):
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        if on_stop is not None:
+            on_stop()
+            return
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, stop)
+
+
+def run_writer(authkey, ready, drain_timeout=30.0):
+    """Writer process: owns the database, applies every shard's events, runs the checkpoints and pruning."""
+    import threading
+
+    stopping = threading.Event()
+    _stop_on_sigterm(stopping.set)
+    logs.configure()
+    from database import VoiceTrackerDatabase
+    from ipc import WriterServer
+    import metrics
+
+    startup.mark("imports")
+    database = VoiceTrackerDatabase(config.DB_PATH, backend=config.STORAGE_BACKEND, shards=config.DB_SHARDS,
+                                    snapshot_interval=config.SNAPSHOT_INTERVAL)
+    startup.mark("storage")
+    server = WriterServer(database, config.IPC_SOCKET, authkey)
+    server.start()
+    ready.set()
+    startup.mark("listen")
+    startup.report(log, "Writer ready")
+    metrics_server = metrics.serve(config.METRICS_PORT) if config.METRICS_PORT is not None else None
+    next_prune = time.monotonic()
+    try:
+        while True:
+            if time.monotonic() >= next_prune:
+                next_prune = time.monotonic() + config.PRUNE_INTERVAL
                 try:
-                    start_time = datetime.fromisoformat(start_time_str)
-                except Exception:
-                    # If format mismatch, fallback to parsing common formats
-                    start_time = datetime.strptime(start_time_str, "%Y-%m-%d %H:%M:%S")
-
-                duration = (datetime.now() - start_time).total_seconds()
-
-                cursor.execute('SELECT total_voice_time FROM voice_time WHERE user_id = ?', (user_id,))
-                current_data = cursor.fetchone()
-                current_total = current_data[0] if current_data else 0
-
-                new_total = current_total + duration
-
-                cursor.execute('''
-                    INSERT INTO voice_time (user_id, username, total_voice_time, voice_sessions, last_joined)
-                    VALUES (?, ?, ?, 1, datetime('now'))
-                    ON CONFLICT(user_id)
-                    DO UPDATE SET
-                        total_voice_time = ?,
-                        voice_sessions = voice_sessions + 1,
-                        last_joined = datetime('now')
-                ''', (user_id, f"User_{user_id}", new_total, new_total))
-
-                cursor.execute('DELETE FROM active_sessions WHERE user_id = ?', (user_id,))
-
-                conn.commit()
-                conn.close()
-                print(f"⏱️ Recorded {duration/60:.1f} minutes voice time")
-                return duration / 60
-
-            conn.close()
-            return 0
-        else:
-            data = self._read_json()
-            sess = data["active_sessions"].get(str(user_id))
-            if not sess or sess.get("session_type") != "voice":
-                return 0
-            start_time = datetime.fromisoformat(sess["start_time"])
-            duration = (datetime.now() - start_time).total_seconds()
-
-            vt = data["voice_time"].get(str(user_id), {
-                "user_id": user_id,
-                "username": f"User_{user_id}",
-                "total_voice_time": 0,
-                "voice_sessions": 0,
-                "last_joined": None
-            })
-            vt["total_voice_time"] = vt.get("total_voice_time", 0) + duration
-            vt["voice_sessions"] = vt.get("voice_sessions", 0) + 1
-            vt["last_joined"] = self._now_iso()
-            data["voice_time"][str(user_id)] = vt
-
-            # remove active session
-            del data["active_sessions"][str(user_id)]
-            self._write_json(data)
-
-            print(f"⏱️ Recorded {duration/60:.1f} minutes voice time (JSON fallback)")
-            return duration / 60
-
-    def start_stream_session(self, user_id, username, channel_id):
-        if SQLITE_AVAILABLE:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT OR REPLACE INTO active_sessions
-                (user_id, session_type, start_time, channel_id)
-                VALUES (?, 'stream', datetime('now'), ?)
-            ''', (user_id, channel_id))
-            conn.commit()
-            conn.close()
+                    server.submit("prune_history", config.HISTORY_RETENTION_DAYS,
+                                  config.HOURLY_ROLLUP_RETENTION_DAYS).result()
+                except Exception as e:
+                    log.error("❌ History pruning failed: %s", e)
+            # SIGTERM sets it: stop at once instead of after the current interval
+            if stopping.wait(config.CHECKPOINT_INTERVAL):
+                break
+            try:
+                server.submit("checkpoint_sessions").result()
+            except Exception as e:
+                log.error("❌ Checkpoint failed: %s", e)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # gateways flush their queued events on the way out; wait for them
+        if not server.drain(drain_timeout):
+            log.warning("⚠️ Gateway processes still connected after %.0fs, closing anyway", drain_timeout)
+        server.close()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+        database.close()
+        print("👋 Writer stopped")
+
+
+def run_gateway(shard_id, shard_count, authkey):
+    """Gateway process: the bot for one shard, writing through the writer process."""
+    _stop_on_sigterm()
+    import gateway
+
+    try:
+        asyncio.run(gateway.run((shard_id, shard_count), authkey))
+    except KeyboardInterrupt:
+        pass
+
+
+def run_sharded(shard_count, start_timeout=120.0):
+    """Supervise one writer and `shard_count` gateway processes until one of them exits or we're stopped."""
+    import multiprocessing.connection
+
+    logs.configure()
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    context = multiprocessing.get_context("spawn")
+    authkey = os.urandom(32)
+    ready = context.Event()
+    writer = context.Process(target=run_writer, args=(authkey, ready), name="writer")
+    writer.start()
+    if not ready.wait(start_timeout):
+        writer.terminate()
+        raise RuntimeError("Writer process did not start")
+    gateways = [context.Process(target=run_gateway, args=(i, shard_count, authkey), name=f"gateway-{i}")
+                for i in range(shard_count)]
+    for process in gateways:
+        process.start()
+    log.info("🚀 Running %d gateway shards with one writer (pid %d)", shard_count, writer.pid)
+    try:
+        multiprocessing.connection.wait([process.sentinel for process in gateways + [writer]])
+        log.error("❌ A process exited, stopping the others")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # gateways first, so their last events still reach the writer
+        for processes in (gateways, [writer]):
+            for process in processes:
+                if process.is_alive():
+                    os.kill(process.pid, signal.SIGTERM)
+            for process in processes:
+                process.join(60)
+                if process.is_alive():
+                    process.terminate()
+        print("👋 Voice tracker stopped")
+
+
+if __name__ == "__main__":
+    try:
+        if config.GATEWAY_SHARDS > 1:
+            run_sharded(config.GATEWAY_SHARDS)
         else:
-            data = self._read_json()
-            data["active_sessions"][str(user_id)] = {
-                "session_type": "stream",
-                "start_time": self._now_iso(),
-                "channel_id": channel_id
-            }
-            self._write_json(data)
-        print(f"🎬 Stream session started for {username}")
-
-    def end_stream_session(self, user_id):
-        if SQLITE_AVAILABLE:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT start_time FROM active_sessions
-                WHERE user_id = ? AND session_type = 'stream'
-            ''', (user_id,))
-            result = cursor.fetchone()
-            if result:
-                start_time_str = result[0]
-                try:
-                    start_time = datetime.fromisoformat(start_time_str)
-                except Exception:
-                    start_time = datetime.strptime(start_time_str, "%Y-%m-%d %H:%M:%S")
-                duration = (datetime.now() - start_time).total_seconds()
-
-                cursor.execute('SELECT total_stream_time FROM streamers WHERE user_id = ?', (user_id,))
-                current_data = cursor.fetchone()
-                current_total = current_data[0] if current_data else 0
-                new_total = current_total + duration
-
-                cursor.execute('''
-                    INSERT INTO streamers (user_id, username, total_stream_time, stream_sessions, last_streamed)
-                    VALUES (?, ?, ?, 1, datetime('now'))
-                    ON CONFLICT(user_id)
-                    DO UPDATE SET
-                        total_stream_time = ?,
-                        stream_sessions = stream_sessions + 1,
-                        last_streamed = datetime('now')
-                ''', (user_id, f"User_{user_id}", new_total, new_total))
+            import gateway
 
-                cursor.execute('DELETE FROM active_sessions WHERE user_id = ?', (user_id,))
-                conn.commit()
-                conn.close()
-                print(f"⏱️ Recorded {duration/60:.1f} minutes stream time")
-                return duration / 60
-
-            conn.close()
-            return 0
-        else:
-            data = self._read_json()
-            sess = data["active_sessions"].get(str(user_id))
-            if not sess or sess.get("session_type") != "stream":
-                return 0
-            start_time = datetime.fromisoformat(sess["start_time"])
-            duration = (datetime.now() - start_time).total_seconds()
-
-            st = data["streamers"].get(str(user_id), {
-                "user_id": user_id,
-                "username": f"User_{user_id}",
-                "total_stream_time": 0,
-                "stream_sessions": 0,
-                "last_streamed": None
-            })
-            st["total_stream_time"] = st.get("total_stream_time", 0) + duration
-            st["stream_sessions"] = st.get("stream_sessions", 0) + 1
-            st["last_streamed"] = self._now_iso()
-            data["streamers"][str(user_id)] = st
-
-            del data["active_sessions"][str(user_id)]
-            self._write_json(data)
-
-            print(f"⏱️ Recorded {duration/60:.1f} minutes stream time (JSON fallback)")
-            return duration / 60
-
-    def get_top_voice_users(self, limit=5):
-        if SQLITE_AVAILABLE:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT user_id, username, total_voice_time, voice_sessions
-                FROM voice_time
-                ORDER BY total_voice_time DESC
-                LIMIT ?
-            ''', (limit,))
-            results = cursor.fetchall()
-            conn.close()
-            return [{'user_id': row[0], 'username': row[1], 'total_voice_time': row[2], 'sessions': row[3]} for row in results]
-        else:
-            data = self._read_json()
-            items = []
-            for k, v in data["voice_time"].items():
-                items.append({
-                    "user_id": int(k),
-                    "username": v.get("username"),
-                    "total_voice_time": v.get("total_voice_time", 0),
-                    "sessions": v.get("voice_sessions", 0)
-                })
-            items.sort(key=lambda x: x["total_voice_time"], reverse=True)
-            return items[:limit]
-
-    def get_top_streamers(self, limit=5):
-        if SQLITE_AVAILABLE:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT user_id, username, total_stream_time, stream_sessions
-                FROM streamers
-                ORDER BY total_stream_time DESC
-                LIMIT ?
-            ''', (limit,))
-            results = cursor.fetchall()
-            conn.close()
-            return [{'user_id': row[0], 'username': row[1], 'total_stream_time': row[2], 'sessions': row[3]} for row in results]
-        else:
-            data = self._read_json()
-            items = []
-            for k, v in data["streamers"].items():
-                items.append({
-                    "user_id": int(k),
-                    "username": v.get("username"),
-                    "total_stream_time": v.get("total_stream_time", 0),
-                    "sessions": v.get("stream_sessions", 0)
-                })
-            items.sort(key=lambda x: x["total_stream_time"], reverse=True)
-            return items[:limit]
-
-    def get_user_watch_stats(self, user_id):
-        if SQLITE_AVAILABLE:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('SELECT total_voice_time, voice_sessions FROM voice_time WHERE user_id = ?', (user_id,))
-            result = cursor.fetchone()
-            conn.close()
-            if result:
-                return {'total_voice_time': result[0], 'sessions': result[1]}
-            return None
-        else:
-            data = self._read_json()
-            v = data["voice_time"].get(str(user_id))
-            if v:
-                return {'total_voice_time': v.get("total_voice_time", 0), 'sessions': v.get("voice_sessions", 0)}
-            return None
+            asyncio.run(gateway.run())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,422 @@
+# memory_backend.py
+"""
+MemoryBackend
+- Everything lives in process memory: __slots__ records (no per-row dict)
+  behind dict indexes by guild, user and channel, so every event is a few
+  dict operations and no I/O.
+- Each user has one record of open sessions by session_type, so voice and
+  stream run side by side and a disconnect pops the whole record.
+- The whole state is snapshotted to `<db_path>.snapshot` every
+  `snapshot_interval` seconds (and on close) with a write-to-temp and
+  rename; a crash loses at most one interval of changes. Snapshots run on
+  their own thread: writers only wait for the copy of the state, never for
+  the pickling or the disk. session_history is bounded by prune().
+- Meant for very high event rates where that trade-off is acceptable; the
+  sqlite backend stays the durable default.
+"""
+
+import heapq
+import os
+import pickle
+import threading
+
+from storage import StorageBackend, SESSION_COLUMNS, DEFAULT_GUILD, epoch_ms, gateway_shard, apply_in_order
+import rollups
+import export
+import logs
+
+log = logs.get_logger("memory")
+
+SNAPSHOT_VERSION = 1
+
+
+class Totals:
+    __slots__ = ("username", "total", "sessions", "last_seen")
+
+    def __init__(self, username, total=0.0, sessions=0, last_seen=None):
+        self.username = username
+        self.total = total
+        self.sessions = sessions
+        self.last_seen = last_seen
+
+
+class OpenSession:
+    __slots__ = ("session_type", "start_time", "channel_id", "checkpointed")
+
+    def __init__(self, session_type, start_time, channel_id, checkpointed=0.0):
+        self.session_type = session_type
+        self.start_time = start_time
+        self.channel_id = channel_id
+        self.checkpointed = checkpointed
+
+
+class MemoryBackend(StorageBackend):
+    kind = "memory"
+
+    def __init__(self, snapshot_path, name_of, snapshot_interval=30.0):
+        super().__init__(snapshot_path, name_of)
+        self.snapshot_interval = snapshot_interval
+        self.lock = threading.Lock()
+        self.totals = {session_type: {} for session_type in SESSION_COLUMNS}  # type -> (guild, user) -> Totals
+        self.active = {}      # guild_id -> user_id -> session_type -> OpenSession
+        self.by_channel = {}  # (guild_id, channel_id) -> {(user_id, session_type)}
+        self.history = []     # (guild_id, user_id, session_type, channel_id, start_ms, end_ms, duration)
+        self.rollups = {}     # (granularity, guild_id, session_type) -> (bucket, user_id) -> (total, sessions)
+        self._dirty = False
+        self._closing = threading.Event()
+        self._snapshotter = None
+
+        if os.path.dirname(snapshot_path):
+            os.makedirs(os.path.dirname(snapshot_path), exist_ok=True)
+        self._load()
+        if snapshot_interval > 0:
+            self._snapshotter = threading.Thread(target=self._snapshot_loop, name="memory-snapshot", daemon=True)
+            self._snapshotter.start()
+        print("✅ In-memory store initialized")
+
+    def close(self):
+        self._closing.set()
+        if self._snapshotter is not None:
+            self._snapshotter.join()
+        self.snapshot()
+
+    # ----------------------------
+    # Snapshots
+    # ----------------------------
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            state = pickle.load(f)
+        if state.get("version") != SNAPSHOT_VERSION:
+            raise ValueError(f"{self.path}: unsupported snapshot version {state.get('version')}")
+        for session_type, rows in state["totals"].items():
+            table = self.totals.setdefault(session_type, {})
+            for guild_id, user_id, username, total, sessions, last_seen in rows:
+                table[(guild_id, user_id)] = Totals(username, total, sessions, last_seen)
+        for guild_id, user_id, session_type, start_time, channel_id, checkpointed in state["active"]:
+            self._open(guild_id, user_id, OpenSession(session_type, start_time, channel_id, checkpointed))
+        self.history = state["history"]
+        for granularity, guild_id, session_type, bucket, user_id, total, sessions in state["rollups"]:
+            self.rollups.setdefault((granularity, guild_id, session_type), {})[(bucket, user_id)] = (total, sessions)
+        print(f"♻️ Loaded in-memory snapshot ({sum(len(t) for t in self.totals.values())} totals)")
+
+    def snapshot(self):
+        """Write the whole state to disk atomically. Returns False if nothing changed."""
+        with self.lock:
+            if not self._dirty:
+                return False
+            # history only ever grows in place (prune() swaps in a new list), so
+            # remembering its length is enough; it is copied after the lock is released
+            history, history_end = self.history, len(self.history)
+            state = {
+                "version": SNAPSHOT_VERSION,
+                "totals": {session_type: [(guild_id, user_id, t.username, t.total, t.sessions, t.last_seen)
+                                          for (guild_id, user_id), t in table.items()]
+                           for session_type, table in self.totals.items()},
+                "active": [(guild_id, user_id, s.session_type, s.start_time, s.channel_id, s.checkpointed)
+                           for guild_id, user_id, s in self._iter_open()],
+                "rollups": {key: dict(buckets) for key, buckets in self.rollups.items()},
+            }
+            self._dirty = False
+        # serialized outside the lock so event writes keep going
+        state["history"] = history[:history_end]
+        state["rollups"] = [(granularity, guild_id, session_type, bucket, user_id, total, sessions)
+                            for (granularity, guild_id, session_type), buckets in state["rollups"].items()
+                            for (bucket, user_id), (total, sessions) in buckets.items()]
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        return True
+
+    def _snapshot_loop(self):
+        while not self._closing.wait(self.snapshot_interval):
+            try:
+                self.snapshot()
+            except Exception as e:
+                log.error("❌ In-memory snapshot failed: %s", e)
+
+    # ----------------------------
+    # Indexes
+    # ----------------------------
+    def _open(self, guild_id, user_id, sess):
+        sessions = self.active.setdefault(guild_id, {}).setdefault(user_id, {})
+        previous = sessions.get(sess.session_type)
+        if previous is not None:
+            self._unindex_channel(guild_id, user_id, previous)
+        sessions[sess.session_type] = sess
+        self.by_channel.setdefault((guild_id, sess.channel_id), set()).add((user_id, sess.session_type))
+
+    def _close(self, guild_id, user_id, session_type):
+        users = self.active.get(guild_id)
+        sessions = users.get(user_id) if users else None
+        sess = sessions.pop(session_type, None) if sessions else None
+        if sess is not None:
+            self._unindex_channel(guild_id, user_id, sess)
+            if not sessions:
+                del users[user_id]
+                if not users:
+                    del self.active[guild_id]
+        return sess
+
+    def _sessions_of(self, guild_id, user_id):
+        return self.active.get(guild_id, {}).get(user_id, {})
+
+    def _iter_open(self):
+        for guild_id, users in self.active.items():
+            for user_id, sessions in users.items():
+                for sess in sessions.values():
+                    yield guild_id, user_id, sess
+
+    def _unindex_channel(self, guild_id, user_id, sess):
+        members = self.by_channel.get((guild_id, sess.channel_id))
+        if members is not None:
+            members.discard((user_id, sess.session_type))
+            if not members:
+                del self.by_channel[(guild_id, sess.channel_id)]
+
+    # ----------------------------
+    # Session events
+    # ----------------------------
+    def apply_batch(self, events):
+        changed = []
+        with self.lock:
+            self._dirty = True
+            results = apply_in_order(self._apply, changed, events)
+        return results, changed
+
+    def _apply(self, changed, action, session_type, user_id, username, channel_id, at,
+               guild_id=DEFAULT_GUILD):
+        if action == "start":
+            self._open(guild_id, user_id, OpenSession(session_type, epoch_ms(at), channel_id))
+            return None
+        if action == "move":
+            for sess in self._sessions_of(guild_id, user_id).values():
+                self._unindex_channel(guild_id, user_id, sess)
+                sess.channel_id = channel_id
+                self.by_channel.setdefault((guild_id, channel_id), set()).add((user_id, sess.session_type))
+            return None
+        if action == "end_channel":
+            members = list(self.by_channel.get((guild_id, channel_id), ()))
+            return self._end_sessions(changed, guild_id, members, at)
+        if action == "end_all":
+            members = [(user_id, kind) for kind in self._sessions_of(guild_id, user_id)]
+            return self._end_sessions(changed, guild_id, members, at)
+
+        if session_type not in self._sessions_of(guild_id, user_id):
+            return 0
+        closed = self._end_sessions(changed, guild_id, [(user_id, session_type)], at)
+        return closed[0]["minutes"] if closed else 0
+
+    def _end_sessions(self, changed, guild_id, members, at):
+        end_time = epoch_ms(at)
+        closed = []
+        for uid, session_type in members:
+            sess = self._close(guild_id, uid, session_type)
+            if sess is None or sess.session_type not in SESSION_COLUMNS:
+                continue
+            duration = max(0, (end_time - sess.start_time) / 1000)
+            totals = self._totals(guild_id, uid, sess.session_type)
+            totals.total += duration
+            totals.sessions += 1
+            totals.last_seen = end_time
+            self.history.append((guild_id, uid, sess.session_type, sess.channel_id,
+                                 epoch_ms(at - sess.checkpointed - duration), end_time,
+                                 sess.checkpointed + duration))
+            self._add_rollups(guild_id, uid, sess.session_type, at - duration, at)
+            changed.append((guild_id, sess.session_type, uid, totals.username, totals.total, totals.sessions))
+            closed.append({'guild_id': guild_id, 'user_id': uid, 'session_type': sess.session_type,
+                           'minutes': (sess.checkpointed + duration) / 60})
+        return closed
+
+    def _totals(self, guild_id, user_id, session_type):
+        table = self.totals[session_type]
+        totals = table.get((guild_id, user_id))
+        if totals is None:
+            totals = table[(guild_id, user_id)] = Totals(self.name_of(user_id, guild_id))
+        return totals
+
+    def _add_rollups(self, guild_id, user_id, session_type, start, end, sessions=1):
+        for granularity, bucket, _, _, _, seconds, sessions in rollups.rollup_rows(
+                guild_id, user_id, session_type, start, end, sessions):
+            buckets = self.rollups.setdefault((granularity, guild_id, session_type), {})
+            # replaced, never changed in place, so snapshot() can copy the dicts shallowly
+            total, count = buckets.get((bucket, user_id), (0, 0))
+            buckets[(bucket, user_id)] = (total + seconds, count + sessions)
+
+    # ----------------------------
+    # Reconciliation and checkpoints
+    # ----------------------------
+    def reconcile(self, present, at, stale_cap, shard=None):
+        counts = {'closed': 0, 'opened': 0, 'kept': 0}
+        changed = []
+        wanted = {(guild_id, user_id, session_type): channel_id
+                  for guild_id, user_id, session_type, channel_id in present}
+        earliest = epoch_ms(at - stale_cap)
+        with self.lock:
+            for guild_id, users in list(self.active.items()):
+                if shard is not None and gateway_shard(guild_id, shard[1]) != shard[0]:
+                    continue
+                stale = []
+                for user_id, sessions in users.items():
+                    for session_type, sess in sessions.items():
+                        if (guild_id, user_id, session_type) not in wanted:
+                            sess.start_time = max(sess.start_time, earliest)
+                            stale.append((user_id, session_type))
+                counts['closed'] += len(self._end_sessions(changed, guild_id, stale, at))
+
+            for (guild_id, user_id, session_type), channel_id in wanted.items():
+                if session_type in self._sessions_of(guild_id, user_id):
+                    counts['kept'] += 1
+                    continue
+                self._open(guild_id, user_id, OpenSession(session_type, epoch_ms(at), channel_id))
+                counts['opened'] += 1
+            self._dirty = True
+        return counts, changed
+
+    def checkpoint(self, at):
+        changed = []
+        now = epoch_ms(at)
+        checkpointed = 0
+        with self.lock:
+            for guild_id, user_id, sess in self._iter_open():
+                if sess.session_type not in SESSION_COLUMNS:
+                    continue
+                elapsed = max(0, (now - sess.start_time) / 1000)
+                if elapsed <= 0:
+                    continue
+                totals = self._totals(guild_id, user_id, sess.session_type)
+                totals.total += elapsed
+                sess.start_time = now
+                sess.checkpointed += elapsed
+                self._add_rollups(guild_id, user_id, sess.session_type, at - elapsed, at, sessions=0)
+                changed.append((guild_id, sess.session_type, user_id, totals.username,
+                                totals.total, totals.sessions))
+                checkpointed += 1
+            self._dirty = self._dirty or checkpointed > 0
+        return checkpointed, changed
+
+    def adopt_guild(self, guild_id):
+        changed = []
+        with self.lock:
+            adopted = {session_type: [key for key in table if key[0] == DEFAULT_GUILD]
+                       for session_type, table in self.totals.items()}
+            if DEFAULT_GUILD not in self.active and not any(adopted.values()):
+                return changed
+
+            for session_type, keys in adopted.items():
+                table = self.totals[session_type]
+                for key in keys:
+                    old = table.pop(key)
+                    user_id = key[1]
+                    totals = table.get((guild_id, user_id))
+                    if totals is None:
+                        totals = table[(guild_id, user_id)] = old
+                    else:
+                        totals.total += old.total
+                        totals.sessions += old.sessions
+                        if old.last_seen is not None and (totals.last_seen is None
+                                                          or old.last_seen > totals.last_seen):
+                            totals.last_seen = old.last_seen
+                    changed.append((guild_id, session_type, user_id, totals.username,
+                                    totals.total, totals.sessions))
+
+            for user_id, sessions in list(self.active.get(DEFAULT_GUILD, {}).items()):
+                for session_type in list(sessions):
+                    sess = self._close(DEFAULT_GUILD, user_id, session_type)
+                    if session_type not in self._sessions_of(guild_id, user_id):
+                        self._open(guild_id, user_id, sess)
+
+            # a new list, like prune(): exports reading the old one are unaffected
+            self.history = [(guild_id,) + row[1:] if row[0] == DEFAULT_GUILD else row for row in self.history]
+
+            for granularity, row_guild, session_type in [key for key in self.rollups if key[1] == DEFAULT_GUILD]:
+                buckets = self.rollups.setdefault((granularity, guild_id, session_type), {})
+                for key, (total, sessions) in self.rollups.pop((granularity, row_guild, session_type)).items():
+                    current = buckets.get(key, (0, 0))
+                    buckets[key] = (current[0] + total, current[1] + sessions)
+            self._dirty = True
+        return changed
+
+    # ----------------------------
+    # Reads
+    # ----------------------------
+    def load_totals(self, session_type):
+        with self.lock:
+            return [(guild_id, user_id, t.username, t.total, t.sessions)
+                    for (guild_id, user_id), t in self.totals[session_type].items()]
+
+    def user_totals(self, guild_id, user_id, session_type):
+        totals = self.totals[session_type].get((guild_id, user_id))
+        return (totals.total, totals.sessions) if totals is not None else None
+
+    def open_sessions(self, guild_id, session_type):
+        with self.lock:
+            return [(user_id, sessions[session_type].start_time)
+                    for user_id, sessions in self.active.get(guild_id, {}).items() if session_type in sessions]
+
+    def windowed_top(self, guild_id, session_type, granularity, start, end, limit):
+        totals = {}
+        with self.lock:
+            for (bucket, user_id), (total, sessions) in self.rollups.get((granularity, guild_id, session_type),
+                                                                         {}).items():
+                if start <= bucket < end:
+                    previous = totals.get(user_id, (0, 0))
+                    totals[user_id] = (previous[0] + total, previous[1] + sessions)
+        top = heapq.nlargest(limit, totals.items(), key=lambda item: item[1][0])
+        return [(user_id, total, sessions) for user_id, (total, sessions) in top]
+
+    def prune(self, history_before, hourly_before=None):
+        with self.lock:
+            kept = [row for row in self.history if row[5] >= history_before]
+            removed = len(self.history) - len(kept)
+            self.history = kept
+            if hourly_before is not None:
+                for (granularity, _, _), buckets in self.rollups.items():
+                    if granularity == "hour":
+                        for key in [key for key in buckets if key[0] < hourly_before]:
+                            del buckets[key]
+            self._dirty = True
+        return removed
+
+    def iter_rows(self, table, chunk_size):
+        export.columns_of(table)
+        if table == "session_history":
+            # prune() swaps in a new list, so this one only ever grows
+            with self.lock:
+                history = self.history
+                end = len(history)
+            for start in range(0, end, chunk_size):
+                with self.lock:
+                    rows = history[start:min(start + chunk_size, end)]
+                yield rows
+            return
+        session_type = next(kind for kind, columns in SESSION_COLUMNS.items() if columns[0] == table)
+        totals = self.totals[session_type]
+        with self.lock:
+            keys = list(totals)
+        for start in range(0, len(keys), chunk_size):
+            with self.lock:
+                rows = [(guild_id, user_id, t.username, t.total, t.sessions, t.last_seen)
+                        for guild_id, user_id in keys[start:start + chunk_size]
+                        for t in (totals.get((guild_id, user_id)),) if t is not None]
+            yield rows
+
+    def rename(self, renamed):
+        with self.lock:
+            for guild_id, user_id, name in renamed:
+                for table in self.totals.values():
+                    totals = table.get((guild_id, user_id))
+                    if totals is not None:
+                        totals.username = name
+            self._dirty = True
+
+    def count_open(self):
+        counts = {}
+        with self.lock:
+            for _, _, sess in self._iter_open():
+                counts[sess.session_type] = counts.get(sess.session_type, 0) + 1
+        return counts
@@ -0,0 +1,239 @@
+# metrics.py
+"""
+Metrics
+- Counters, latency histograms and gauges for the tracking hot path, kept in
+  a process-wide REGISTRY.
+- `timed(name)` wraps a function or coroutine with a call-latency histogram
+  and an error counter; recording costs two perf_counter() calls and a bisect.
+- Gauges can be callbacks (queue depth, open sessions), evaluated only when
+  the metrics are read.
+- `serve(port)` exposes the Prometheus text format on a local HTTP endpoint;
+  `dump_periodically(interval)` logs the same text instead.
+"""
+
+import asyncio
+import functools
+import threading
+import time
+from bisect import bisect_left
+
+import logs
+
+log = logs.get_logger("metrics")
+
+# seconds; covers sub-millisecond cache hits up to slow commits
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self, name, labels):
+        yield f"{name}{_format_labels(labels)} {self.value}"
+
+
+class Gauge:
+    def __init__(self, fn=None):
+        self.value = 0
+        self.fn = fn
+
+    def set(self, value):
+        self.value = value
+
+    def read(self):
+        if self.fn is None:
+            return self.value
+        try:
+            return self.fn()
+        except Exception as e:
+            log.warning("⚠️ Gauge callback failed: %s", e)
+            return float("nan")
+
+    def samples(self, name, labels):
+        yield f"{name}{_format_labels(labels)} {self.read()}"
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        slot = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[slot] += 1
+            self.sum += value
+            self.count += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile (0 <= q <= 1)."""
+        with self._lock:
+            counts, total = list(self.counts), self.count
+        if not total:
+            return 0.0
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            seen += count
+            if seen >= q * total:
+                return bound
+        return float("inf")
+
+    def samples(self, name, labels):
+        with self._lock:
+            counts, total, value_sum = list(self.counts), self.count, self.sum
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            yield f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}"
+        yield f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {total}"
+        yield f"{name}_sum{_format_labels(labels)} {value_sum}"
+        yield f"{name}_count{_format_labels(labels)} {total}"
+
+
+class Registry:
+    def __init__(self):
+        self._families = {}  # name -> (kind, help, {labels: metric})
+        self._lock = threading.Lock()
+
+    def _get(self, kind, name, help_text, labels, make):
+        key = tuple(sorted((labels or {}).items()))
+        with self._lock:
+            family = self._families.setdefault(name, (kind, help_text, {}))
+            if family[0] != kind:
+                raise ValueError(f"Metric {name} is already registered as a {family[0]}")
+            metric = family[2].get(key)
+            if metric is None:
+                metric = family[2][key] = make()
+            return metric
+
+    def counter(self, name, help_text="", labels=None):
+        return self._get("counter", name, help_text, labels, Counter)
+
+    def histogram(self, name, help_text="", labels=None, buckets=DEFAULT_BUCKETS):
+        return self._get("histogram", name, help_text, labels, lambda: Histogram(buckets))
+
+    def gauge(self, name, help_text="", labels=None, fn=None):
+        gauge = self._get("gauge", name, help_text, labels, lambda: Gauge(fn))
+        if fn is not None:
+            gauge.fn = fn
+        return gauge
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        with self._lock:
+            families = [(name, kind, help_text, list(metrics.items()))
+                        for name, (kind, help_text, metrics) in sorted(self._families.items())]
+        lines = []
+        for name, kind, help_text, metrics in families:
+            if help_text:
+                lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, metric in metrics:
+                lines.extend(metric.samples(name, labels))
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def timed(name, registry=REGISTRY):
+    """Decorator: record call latency and failures of a function as method=name."""
+    def decorator(fn):
+        latency = registry.histogram("voice_tracker_call_seconds", "Latency of tracker and database calls",
+                                     {"method": name})
+        errors = registry.counter("voice_tracker_call_errors_total", "Tracker and database calls that raised",
+                                  {"method": name})
+
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                except Exception:
+                    errors.inc()
+                    raise
+                finally:
+                    latency.observe(time.perf_counter() - start)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                errors.inc()
+                raise
+            finally:
+                latency.observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+# ----------------------------
+# Exposition
+# ----------------------------
+def serve(port, host="127.0.0.1", registry=REGISTRY):
+    """Serve GET /metrics on a daemon thread; returns the server (call shutdown() to stop)."""
+    # http.server pulls in email/html/mimetypes; only pay for it when metrics are served
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    log.info("📈 Metrics available at http://%s:%s/metrics", host, server.server_port)
+    return server
+
+
+async def dump_periodically(interval=60.0, registry=REGISTRY):
+    """Log every metric each `interval` seconds, for hosts where nothing can scrape."""
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval)
+        # gauge callbacks may query the database; keep them off the event loop
+        text = await loop.run_in_executor(None, registry.render)
+        log.info("📈 Stats dump\n%s", text)
+
+
+async def watch_loop_lag(interval=0.5, registry=REGISTRY):
+    """Keep voice_tracker_event_loop_lag_seconds up to date: how late a short sleep wakes up."""
+    lag = registry.gauge("voice_tracker_event_loop_lag_seconds", "How late the event loop ran a scheduled wakeup")
+    lags = registry.histogram("voice_tracker_event_loop_lag", "Distribution of event loop lag in seconds")
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        late = max(0.0, loop.time() - expected)
+        lag.set(late)
+        lags.observe(late)
@@ -0,0 +1,513 @@
+# migrations.py
+"""
+Schema migrations for VoiceTrackerDatabase
+- The schema version lives in PRAGMA user_version (SQLite) or the "meta"
+  table (JSON store). Each step upgrades one version; all pending steps run
+  in one BEGIN IMMEDIATE transaction, so a file is either fully migrated or
+  untouched, even with other processes connected.
+- New databases are created at the latest version directly. A file that is
+  already current costs one PRAGMA user_version read at startup: no DDL and
+  no write lock.
+- Version 1: guild-aware tables with TEXT datetimes (migrates the original
+  single-guild tables).
+- Version 2: integer epoch milliseconds instead of TEXT datetimes (no
+  julianday()/fromisoformat parsing, no UTC vs local time mix-up), WITHOUT
+  ROWID for the tables keyed by (guild_id, user_id), NOT NULL counters.
+- Version 3: active_sessions keyed by (guild_id, user_id, session_type), so
+  a user's voice and stream sessions are tracked side by side.
+
+Report the savings for an existing file (measured on a copy), or migrate it:
+
+    python migrations.py /tmp/voice_tracker.db [--apply]
+    python migrations.py --synthetic 200000
+"""
+
+import os
+import time
+from datetime import datetime
+
+try:
+    import sqlite3
+except ImportError:
+    try:
+        from pysqlite3 import dbapi2 as sqlite3
+    except ImportError:
+        sqlite3 = None  # JSON fallback only needs migrate_json()
+
+LATEST_VERSION = 3
+
+# guild used for rows from before guild support
+DEFAULT_GUILD = 0
+
+# TEXT datetime (UTC, as written by SQLite's datetime('now')) -> epoch milliseconds
+def _epoch_ms_sql(column):
+    return f"CAST(ROUND((julianday({column}) - 2440587.5) * 86400000.0) AS INTEGER)"
+
+
+# ----------------------------
+# Latest schema
+# ----------------------------
+# times are epoch milliseconds; durations and totals stay in seconds
+TABLES = {
+    "streamers": '''
+        CREATE TABLE IF NOT EXISTS streamers (
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            username TEXT,
+            total_stream_time REAL NOT NULL DEFAULT 0,
+            stream_sessions INTEGER NOT NULL DEFAULT 0,
+            last_streamed INTEGER,
+            PRIMARY KEY (guild_id, user_id)
+        ) WITHOUT ROWID
+    ''',
+    "voice_time": '''
+        CREATE TABLE IF NOT EXISTS voice_time (
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            username TEXT,
+            total_voice_time REAL NOT NULL DEFAULT 0,
+            voice_sessions INTEGER NOT NULL DEFAULT 0,
+            last_joined INTEGER,
+            PRIMARY KEY (guild_id, user_id)
+        ) WITHOUT ROWID
+    ''',
+    # checkpointed: seconds already moved into the totals by checkpoint_sessions();
+    # start_time then marks the last checkpoint rather than the start of the session
+    "active_sessions": '''
+        CREATE TABLE IF NOT EXISTS active_sessions (
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            session_type TEXT NOT NULL,
+            start_time INTEGER NOT NULL,
+            channel_id INTEGER,
+            checkpointed REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (guild_id, user_id, session_type)
+        ) WITHOUT ROWID
+    ''',
+    # append-only log of closed sessions; keeps its rowid since rows only ever go at the end
+    "session_history": '''
+        CREATE TABLE IF NOT EXISTS session_history (
+            id INTEGER PRIMARY KEY,
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            session_type TEXT NOT NULL,
+            channel_id INTEGER,
+            start_time INTEGER NOT NULL,
+            end_time INTEGER NOT NULL,
+            duration REAL NOT NULL
+        )
+    ''',
+    # closed time per hour/day/week bucket (bucket_start in epoch seconds)
+    "session_rollups": '''
+        CREATE TABLE IF NOT EXISTS session_rollups (
+            granularity TEXT NOT NULL,
+            bucket_start INTEGER NOT NULL,
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            session_type TEXT NOT NULL,
+            total_time REAL NOT NULL DEFAULT 0,
+            sessions INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (granularity, guild_id, session_type, bucket_start, user_id)
+        ) WITHOUT ROWID
+    ''',
+}
+
+# per-guild leaderboard ordering, bulk channel close and history retention
+INDEXES = (
+    'CREATE INDEX IF NOT EXISTS idx_streamers_guild_total ON streamers (guild_id, total_stream_time DESC)',
+    'CREATE INDEX IF NOT EXISTS idx_voice_time_guild_total ON voice_time (guild_id, total_voice_time DESC)',
+    'CREATE INDEX IF NOT EXISTS idx_active_sessions_channel ON active_sessions (channel_id)',
+    'CREATE INDEX IF NOT EXISTS idx_session_history_end ON session_history (end_time)',
+)
+
+
+def _create_latest(cursor):
+    for create in TABLES.values():
+        cursor.execute(create)
+    for create in INDEXES:
+        cursor.execute(create)
+
+
+# ----------------------------
+# Version 1: guild-aware tables, TEXT datetimes
+# ----------------------------
+# tables from before guild support, keyed by user_id only -> columns to carry over
+LEGACY_COLUMNS = {
+    "streamers": "user_id, username, total_stream_time, stream_sessions, last_streamed",
+    "voice_time": "user_id, username, total_voice_time, voice_sessions, last_joined",
+    "active_sessions": "user_id, session_type, start_time, channel_id",
+}
+
+V1_TABLES = {
+    "streamers": '''
+        CREATE TABLE IF NOT EXISTS streamers (
+            guild_id INTEGER NOT NULL DEFAULT 0,
+            user_id INTEGER NOT NULL,
+            username TEXT,
+            total_stream_time REAL DEFAULT 0,
+            stream_sessions INTEGER DEFAULT 0,
+            last_streamed TEXT,
+            PRIMARY KEY (guild_id, user_id)
+        )
+    ''',
+    "voice_time": '''
+        CREATE TABLE IF NOT EXISTS voice_time (
+            guild_id INTEGER NOT NULL DEFAULT 0,
+            user_id INTEGER NOT NULL,
+            username TEXT,
+            total_voice_time REAL DEFAULT 0,
+            voice_sessions INTEGER DEFAULT 0,
+            last_joined TEXT,
+            PRIMARY KEY (guild_id, user_id)
+        )
+    ''',
+    "active_sessions": '''
+        CREATE TABLE IF NOT EXISTS active_sessions (
+            guild_id INTEGER NOT NULL DEFAULT 0,
+            user_id INTEGER NOT NULL,
+            session_type TEXT,
+            start_time TEXT,
+            channel_id INTEGER,
+            checkpointed REAL DEFAULT 0,
+            PRIMARY KEY (guild_id, user_id)
+        )
+    ''',
+    "session_history": '''
+        CREATE TABLE IF NOT EXISTS session_history (
+            id INTEGER PRIMARY KEY,
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            session_type TEXT NOT NULL,
+            channel_id INTEGER,
+            start_time TEXT NOT NULL,
+            end_time TEXT NOT NULL,
+            duration REAL NOT NULL
+        )
+    ''',
+    "session_rollups": TABLES["session_rollups"],
+}
+
+
+def _to_v1(cursor):
+    legacy = []
+    for table in LEGACY_COLUMNS:
+        cursor.execute(f'PRAGMA table_info({table})')
+        existing = [row[1] for row in cursor.fetchall()]
+        if existing and "guild_id" not in existing:
+            # its old indexes move (and are later dropped) with it
+            cursor.execute(f'ALTER TABLE {table} RENAME TO {table}_legacy')
+            legacy.append(table)
+
+    for create in V1_TABLES.values():
+        cursor.execute(create)
+    cursor.execute('PRAGMA table_info(active_sessions)')
+    if "checkpointed" not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute('ALTER TABLE active_sessions ADD COLUMN checkpointed REAL DEFAULT 0')
+    for create in INDEXES:
+        cursor.execute(create)
+
+    # move pre-guild rows into the new tables under DEFAULT_GUILD
+    for table in legacy:
+        columns = LEGACY_COLUMNS[table]
+        cursor.execute(f'''
+            INSERT INTO {table} (guild_id, {columns})
+            SELECT {DEFAULT_GUILD}, {columns} FROM {table}_legacy
+        ''')
+        cursor.execute(f'DROP TABLE {table}_legacy')
+        print(f"🔁 Migrated {table} to guild-aware keys")
+
+
+# ----------------------------
+# Version 2: epoch milliseconds, WITHOUT ROWID
+# ----------------------------
+# table -> SELECT list producing the version 2 columns from the version 1 table
+V2_COPY = {
+    "streamers": f"guild_id, user_id, username, COALESCE(total_stream_time, 0), COALESCE(stream_sessions, 0), "
+                 f"{_epoch_ms_sql('last_streamed')}",
+    "voice_time": f"guild_id, user_id, username, COALESCE(total_voice_time, 0), COALESCE(voice_sessions, 0), "
+                  f"{_epoch_ms_sql('last_joined')}",
+    "active_sessions": f"guild_id, user_id, COALESCE(session_type, 'voice'), "
+                       f"COALESCE({_epoch_ms_sql('start_time')}, CAST(strftime('%s', 'now') AS INTEGER) * 1000), "
+                       f"channel_id, COALESCE(checkpointed, 0)",
+    "session_history": f"id, guild_id, user_id, session_type, channel_id, "
+                       f"{_epoch_ms_sql('start_time')}, {_epoch_ms_sql('end_time')}, duration",
+}
+
+
+def _to_v2(cursor):
+    for table, columns in V2_COPY.items():
+        cursor.execute(f'ALTER TABLE {table} RENAME TO {table}_v1')
+        cursor.execute(TABLES[table])
+        cursor.execute(f'INSERT INTO {table} SELECT {columns} FROM {table}_v1')
+        # drops the old indexes with it
+        cursor.execute(f'DROP TABLE {table}_v1')
+    for create in INDEXES:
+        cursor.execute(create)
+
+
+# ----------------------------
+# Version 3: one active session per (user, session_type)
+# ----------------------------
+def _to_v3(cursor):
+    cursor.execute('ALTER TABLE active_sessions RENAME TO active_sessions_v2')
+    cursor.execute(TABLES["active_sessions"])
+    cursor.execute('''
+        INSERT OR IGNORE INTO active_sessions
+        SELECT guild_id, user_id, session_type, start_time, channel_id, checkpointed FROM active_sessions_v2
+    ''')
+    cursor.execute('DROP TABLE active_sessions_v2')
+    for create in INDEXES:
+        cursor.execute(create)
+
+
+STEPS = {
+    1: ("guild-aware tables", _to_v1),
+    2: ("epoch millisecond timestamps, WITHOUT ROWID tables", _to_v2),
+    3: ("active sessions keyed by session type", _to_v3),
+}
+
+
+def schema_version(cursor):
+    cursor.execute('PRAGMA user_version')
+    return cursor.fetchone()[0]
+
+
+def migrate(cursor, target=LATEST_VERSION):
+    """
+    Bring the database behind `cursor` to `target`, creating it from scratch
+    if it has no tables. Leaves the transaction open for the caller to commit.
+    Returns the version it started from.
+    """
+    conn = cursor.connection
+    version = schema_version(cursor)
+    if version >= target:
+        # the usual startup: nothing to create or upgrade
+        return version
+    if not conn.in_transaction:
+        # take the write lock before changing anything so two processes can't both migrate;
+        # the version is read again under it in case another process just did
+        cursor.execute('BEGIN IMMEDIATE')
+        version = schema_version(cursor)
+        if version >= target:
+            return version
+
+    cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")
+    if cursor.fetchone()[0] == 0 and target == LATEST_VERSION:
+        _create_latest(cursor)
+    else:
+        for step in range(version + 1, target + 1):
+            description, upgrade = STEPS[step]
+            started = time.perf_counter()
+            upgrade(cursor)
+            print(f"🔁 Schema v{step}: {description} ({(time.perf_counter() - started) * 1000:.0f} ms)")
+    cursor.execute(f'PRAGMA user_version = {int(target)}')
+    return version
+
+
+# ----------------------------
+# JSON fallback store
+# ----------------------------
+# table -> fields holding times
+JSON_TIME_FIELDS = {
+    "streamers": ("last_streamed",),
+    "voice_time": ("last_joined",),
+    "active_sessions": ("start_time",),
+    "session_history": ("start_time", "end_time"),
+}
+
+
+def _json_epoch_ms(value):
+    if value is None:
+        return None
+    if isinstance(value, str):
+        # version 1 wrote local-time ISO strings
+        return int(round(datetime.fromisoformat(value).timestamp() * 1000))
+    # version 1 session_history end_time: epoch seconds
+    return int(round(value * 1000))
+
+
+def migrate_json(store):
+    """
+    Bring a JournalStore to LATEST_VERSION: version 2 converts times to epoch
+    milliseconds, version 3 keys active sessions "guild:user:session_type".
+    """
+    meta = store.data["meta"]
+    if "schema_version" not in meta and not any(store.data[table] for table in JSON_TIME_FIELDS):
+        # new store: nothing to convert
+        store.set("meta", "schema_version", LATEST_VERSION)
+        store.commit()
+        return 0
+    version = meta.get("schema_version", 1)
+    if version >= LATEST_VERSION:
+        return version
+    if version < 2:
+        for table, fields in JSON_TIME_FIELDS.items():
+            for key, row in list(store.data[table].items()):
+                converted = {field: _json_epoch_ms(row.get(field)) for field in fields if field in row}
+                if converted:
+                    store.set(table, key, dict(row, **converted))
+    if version < 3:
+        for key, row in list(store.data["active_sessions"].items()):
+            guild_id, user_id = key.split(":")
+            session_type = row.get("session_type", "voice")
+            store.delete("active_sessions", key)
+            store.set("active_sessions", f"{guild_id}:{user_id}:{session_type}",
+                      dict(row, user_id=int(user_id), session_type=session_type))
+    store.set("meta", "schema_version", LATEST_VERSION)
+    store.commit()
+    print(f"🔁 JSON store: v{version} -> v{LATEST_VERSION}")
+    return version
+
+
+# ----------------------------
+# Savings report
+# ----------------------------
+def _vacuumed_size(path):
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode=DELETE')
+    conn.execute('VACUUM')
+    conn.close()
+    return os.path.getsize(path)
+
+
+# stored times of every schema version (session_history only exists from v1)
+TIME_COLUMNS = (
+    ("session_history", "start_time"),
+    ("session_history", "end_time"),
+    ("active_sessions", "start_time"),
+    ("voice_time", "last_joined"),
+    ("streamers", "last_streamed"),
+)
+
+
+def _time_reads(path, version):
+    """Seconds spent reading every stored time as epoch seconds, in SQL and in Python."""
+    conn = sqlite3.connect(path)
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    columns = [(table, column) for table, column in TIME_COLUMNS if table in tables]
+    if version >= 2:
+        to_seconds_sql = "{} / 1000.0"
+    else:
+        to_seconds_sql = "(julianday({}) - 2440587.5) * 86400.0"
+    in_sql = 0.0
+    values = []
+    for table, column in columns:
+        started = time.perf_counter()
+        conn.execute(f'SELECT SUM({to_seconds_sql.format(column)}) FROM {table}').fetchone()
+        in_sql += time.perf_counter() - started
+        values.extend(row[0] for row in conn.execute(f'SELECT {column} FROM {table} WHERE {column} IS NOT NULL'))
+
+    started = time.perf_counter()
+    if version >= 2:
+        sum(value / 1000.0 for value in values)
+    else:
+        parse = datetime.fromisoformat
+        sum(parse(value).timestamp() for value in values)
+    in_python = time.perf_counter() - started
+    conn.close()
+    return in_sql, in_python, len(values)
+
+
+def report(db_path):
+    """Migrate a copy of db_path and print size and parse-time before/after."""
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp:
+        before = os.path.join(tmp, "before.db")
+        after = os.path.join(tmp, "after.db")
+        source = sqlite3.connect(db_path)
+        for path in (before, after):
+            copy = sqlite3.connect(path)
+            source.backup(copy)
+            copy.close()
+        source.close()
+
+        conn = sqlite3.connect(after)
+        version = migrate(conn.cursor())
+        conn.commit()
+        conn.close()
+        if version >= LATEST_VERSION:
+            print(f"✅ {db_path} is already at schema v{LATEST_VERSION}")
+            return
+
+        size_before, size_after = _vacuumed_size(before), _vacuumed_size(after)
+        sql_before, py_before, values = _time_reads(before, version)
+        sql_after, py_after, _ = _time_reads(after, LATEST_VERSION)
+
+    print(f"📊 Schema v{version} -> v{LATEST_VERSION} for {db_path} ({values} stored times)")
+    print(f"   file size (vacuumed): {size_before / 1024:.0f} KiB -> {size_after / 1024:.0f} KiB "
+          f"({(1 - size_after / size_before) * 100:.1f}% smaller)")
+    print(f"   times in SQL:         {sql_before * 1000:.1f} ms -> {sql_after * 1000:.1f} ms")
+    print(f"   times in Python:      {py_before * 1000:.1f} ms -> {py_after * 1000:.1f} ms")
+
+
+def build_synthetic(path, sessions, users=5000, seed=1):
+    """A version 1 database with `sessions` closed sessions, for trying the report."""
+    import random
+
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    cursor = conn.cursor()
+    migrate(cursor, target=1)
+    now = time.time()
+    fmt = lambda t: datetime.utcfromtimestamp(t).strftime("%Y-%m-%d %H:%M:%S")
+    history = []
+    for _ in range(sessions):
+        end = now - rng.uniform(0, 30 * 86400)
+        duration = rng.uniform(60, 4 * 3600)
+        history.append((1, rng.randrange(users), rng.choice(("voice", "stream")), rng.randrange(20),
+                        fmt(end - duration), fmt(end), duration))
+    cursor.executemany('''
+        INSERT INTO session_history (guild_id, user_id, session_type, channel_id, start_time, end_time, duration)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', history)
+    for table, total_col, sessions_col, last_col in (("streamers", "total_stream_time", "stream_sessions", "last_streamed"),
+                                                     ("voice_time", "total_voice_time", "voice_sessions", "last_joined")):
+        cursor.execute(f'''
+            INSERT INTO {table} (guild_id, user_id, username, {total_col}, {sessions_col}, {last_col})
+            SELECT guild_id, user_id, 'User_' || user_id, SUM(duration), COUNT(*), MAX(end_time)
+            FROM session_history GROUP BY guild_id, user_id
+        ''')
+    conn.commit()
+    conn.close()
+
+
+def main():
+    # command-line only: the bot imports this module for migrate() at every start
+    import argparse
+    import tempfile
+
+    parser = argparse.ArgumentParser(description="VoiceTrackerDatabase schema migrations")
+    parser.add_argument("db_path", nargs="?", default="/tmp/voice_tracker.db")
+    parser.add_argument("--apply", action="store_true", help="migrate db_path in place, then report on the backup")
+    parser.add_argument("--synthetic", type=int, metavar="SESSIONS",
+                        help="report on a generated v1 database instead of db_path")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "synthetic.db")
+            build_synthetic(path, args.synthetic)
+            report(path)
+        return
+
+    if not os.path.exists(args.db_path):
+        parser.error(f"{args.db_path} does not exist")
+    if not args.apply:
+        report(args.db_path)
+        return
+    # migrate first: the report only measures, it must never stand in the way
+    backup = args.db_path + ".bak"
+    conn = sqlite3.connect(args.db_path, timeout=30)
+    copy = sqlite3.connect(backup)
+    conn.backup(copy)
+    copy.close()
+    migrate(conn.cursor())
+    conn.commit()
+    conn.close()
+    print(f"✅ Migrated {args.db_path} (backup at {backup})")
+    report(backup)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+# names.py
+"""
+NameCache
+- Bounded LRU of display names keyed by (guild_id, user_id), filled from
+  gateway events (joins, leaves, moves, startup sync).
+- Names that changed are remembered as dirty until the owner persists them
+  in one batch (see VoiceTrackerDatabase._flush_names), so a rename costs
+  one UPDATE per flush instead of one per session write.
+- Dirty names are kept apart from the LRU so eviction never loses a rename.
+"""
+
+import threading
+from collections import OrderedDict
+
+
+class NameCache:
+    def __init__(self, max_entries=50000):
+        self.max_entries = max_entries
+        self._names = OrderedDict()  # (guild_id, user_id) -> name
+        self._dirty = {}             # (guild_id, user_id) -> name not yet persisted
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._names)
+
+    @property
+    def dirty(self):
+        return len(self._dirty)
+
+    def get(self, guild_id, user_id):
+        key = (guild_id, user_id)
+        with self._lock:
+            name = self._dirty.get(key) or self._names.get(key)
+            if name is not None and key in self._names:
+                self._names.move_to_end(key)
+            return name
+
+    def put(self, guild_id, user_id, name, dirty=False):
+        key = (guild_id, user_id)
+        with self._lock:
+            self._names[key] = name
+            self._names.move_to_end(key)
+            if dirty:
+                self._dirty[key] = name
+            while len(self._names) > self.max_entries:
+                self._names.popitem(last=False)
+
+    def drain_dirty(self):
+        """Return and forget the renamed entries as (guild_id, user_id, name)."""
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+        return [(guild_id, user_id, name) for (guild_id, user_id), name in dirty.items()]
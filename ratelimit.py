@@ -0,0 +1,41 @@
+# ratelimit.py
+"""
+RateLimiter
+- Token bucket per key (a channel id for `!vt` commands): `rate` commands
+  per `per` seconds, refilled continuously, so a burst of command spam in one
+  channel is dropped before it reaches the caches or storage.
+- Only the `max_keys` most recently used channels are remembered; a channel
+  that was evicted simply starts again with a full bucket.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+
+class RateLimiter:
+    def __init__(self, rate=5, per=10.0, max_keys=10000):
+        self.rate = rate
+        self.per = per
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+        self.limited = metrics.REGISTRY.counter("voice_tracker_commands_rate_limited_total",
+                                                "Commands dropped by the per-channel rate limiter")
+
+    def allow(self, key, now=None):
+        """Take one token from `key`'s bucket. False when it is empty."""
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(key, (self.rate, now))
+            tokens = min(self.rate, tokens + (now - updated_at) * self.rate / self.per)
+            allowed = tokens >= 1
+            self._buckets[key] = (tokens - 1 if allowed else tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        if not allowed:
+            self.limited.inc()
+        return allowed
@@ -0,0 +1,128 @@
+# render_cache.py
+"""
+Pre-rendered leaderboards
+- `!vt topstreamers` / `!vt topvoice` are answered from LeaderboardCache:
+  one dict lookup for a ready-made embed payload per (guild, board, window),
+  with no query, formatting or name lookups on the command path.
+- A background refresh (VoiceTimeTracker.start_prerender) re-renders a
+  payload only when it could have changed: the guild's leaderboard version
+  or the window's start moved on, and then only if the top-K rows as shown
+  (names, whole minutes, session counts) differ from the cached ones.
+- Payloads are plain embed dicts (discord.Embed.from_dict), so this module
+  doesn't need discord.py.
+"""
+
+import threading
+import time
+
+import rollups
+import metrics
+
+# session_type -> (title, total column, embed color: discord.Color.green() / .purple())
+BOARDS = {
+    "voice": ("🎧 Top Voice Users", "total_voice_time", 0x2ecc71),
+    "stream": ("🎬 Top Streamers", "total_stream_time", 0x9b59b6),
+}
+
+# "all" is the all-time total; the others are rollup windows (rollups.WINDOWS)
+WINDOWS = {"all": "", "day": " — today", "week": " — this week", "month": " — this month"}
+
+MEDALS = ["🥇", "🥈", "🥉"]
+
+
+def format_duration(seconds):
+    minutes = int(seconds // 60)
+    if minutes < 60:
+        return f"{minutes}m"
+    return f"{minutes // 60}h {minutes % 60:02d}m"
+
+
+def render_leaderboard(title, rows, total_key, color):
+    """Embed payload (a dict for discord.Embed.from_dict) for top-K rows."""
+    if not rows:
+        return {"title": title, "color": color, "description": "No time recorded yet."}
+    return {"title": title, "color": color, "description": "\n".join(
+        f"{MEDALS[i] if i < len(MEDALS) else f'**{i + 1}.**'} {row['username']} — "
+        f"{format_duration(row[total_key])} ({row['sessions']} sessions)"
+        for i, row in enumerate(rows))}
+
+
+class LeaderboardCache:
+    """(guild_id, session_type, window) -> rendered payload, refreshed off the command path."""
+
+    def __init__(self, database, limit=5, windows=tuple(WINDOWS)):
+        self.db = database
+        self.limit = limit
+        self.windows = windows
+        # key -> (stamp, signature, payload); stamp is what the payload was built from
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.renders = metrics.REGISTRY.counter("voice_tracker_leaderboard_renders_total",
+                                                "Leaderboard payloads re-rendered")
+        self.skipped = metrics.REGISTRY.counter("voice_tracker_leaderboard_render_skips_total",
+                                                "Leaderboard refreshes that found the top-K unchanged")
+
+    def get(self, guild_id, session_type, window="all"):
+        """The cached payload, or None if it was never rendered."""
+        entry = self._entries.get((guild_id, session_type, window))
+        return entry[2] if entry is not None else None
+
+    def _stamp(self, guild_id, session_type, window, at):
+        version = self.db.leaderboard_version(guild_id, session_type)
+        if window == "all":
+            return version, None
+        return version, rollups.window_range(window, at)[1]
+
+    def _rows(self, guild_id, session_type, window, at):
+        if window == "all":
+            if session_type == "voice":
+                return self.db.get_top_voice_users(self.limit, guild_id=guild_id)
+            return self.db.get_top_streamers(self.limit, guild_id=guild_id)
+        return self.db.get_top_windowed(session_type, window, self.limit, guild_id=guild_id, at=at)
+
+    def refresh(self, guild_id, session_type, window="all", at=None):
+        """
+        Re-render one payload if its top-K changed. Returns the payload.
+        Runs queries: call it on the tracker's read pool.
+        """
+        if at is None:
+            at = time.time()
+        key = (guild_id, session_type, window)
+        stamp = self._stamp(guild_id, session_type, window, at)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == stamp:
+            return entry[2]
+
+        title, total_key, color = BOARDS[session_type]
+        rows = self._rows(guild_id, session_type, window, at)
+        # what the embed shows: a total moving by seconds doesn't change it
+        signature = tuple((row['user_id'], row['username'], int(row[total_key] // 60), row['sessions'])
+                          for row in rows)
+        if entry is not None and entry[1] == signature:
+            payload = entry[2]
+            self.skipped.inc()
+        else:
+            payload = render_leaderboard(title + WINDOWS[window], rows, total_key, color)
+            self.renders.inc()
+        with self._lock:
+            self._entries[key] = (stamp, signature, payload)
+        return payload
+
+    def refresh_guilds(self, guild_ids, at=None):
+        """Refresh every board and window of these guilds. Returns how many payloads changed."""
+        if at is None:
+            at = time.time()
+        changed = 0
+        for guild_id in guild_ids:
+            for session_type in BOARDS:
+                for window in self.windows:
+                    before = self.get(guild_id, session_type, window)
+                    if self.refresh(guild_id, session_type, window, at) is not before:
+                        changed += 1
+        return changed
+
+    def forget(self, guild_id):
+        """Drop a guild's payloads (the bot left it)."""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == guild_id]:
+                del self._entries[key]
@@ -0,0 +1,70 @@
+# rollups.py
+"""
+Time buckets for session history rollups.
+- Every closed session is split across the hourly, daily and weekly buckets
+  it overlaps, so windowed leaderboards ("this week", "this month") only sum
+  a handful of pre-aggregated rows instead of scanning raw sessions.
+- Buckets are UTC; weeks start on Monday.
+"""
+
+import calendar
+from datetime import datetime
+
+HOUR = 3600
+DAY = 24 * HOUR
+WEEK = 7 * DAY
+# 1970-01-01 was a Thursday; Monday 1970-01-05 anchors the weekly buckets
+WEEK_OFFSET = 4 * DAY
+
+GRANULARITIES = {"hour": HOUR, "day": DAY, "week": WEEK}
+
+# window name -> rollup granularity used to answer it
+WINDOWS = {"hour": "hour", "day": "day", "week": "week", "month": "day"}
+
+
+def bucket_start(granularity, t):
+    size = GRANULARITIES[granularity]
+    offset = WEEK_OFFSET if granularity == "week" else 0
+    return int((t - offset) // size * size + offset)
+
+
+def split_into_buckets(granularity, start, end):
+    """[(bucket_start, seconds)] for the part of [start, end) falling in each bucket."""
+    size = GRANULARITIES[granularity]
+    parts = []
+    bucket = bucket_start(granularity, start)
+    while bucket < end:
+        seconds = min(end, bucket + size) - max(start, bucket)
+        if seconds > 0:
+            parts.append((bucket, seconds))
+        bucket += size
+    return parts
+
+
+def window_range(window, at):
+    """(granularity, first bucket, end) covering the current hour/day/week/month up to `at`."""
+    if window not in WINDOWS:
+        raise ValueError(f"Unknown window: {window} (expected one of {', '.join(WINDOWS)})")
+    granularity = WINDOWS[window]
+    if window == "month":
+        now = datetime.utcfromtimestamp(at)
+        start = calendar.timegm((now.year, now.month, 1, 0, 0, 0))
+    else:
+        start = bucket_start(granularity, at)
+    return granularity, start, at + 1
+
+
+def rollup_rows(guild_id, user_id, session_type, start, end, sessions=1):
+    """
+    (granularity, bucket_start, guild_id, user_id, session_type, seconds, sessions)
+    rows for one closed session; the session itself counts in the bucket it ended in.
+    Checkpointed stretches of a session that is still open pass sessions=0.
+    """
+    rows = []
+    for granularity in GRANULARITIES:
+        parts = split_into_buckets(granularity, start, end) or [(bucket_start(granularity, end), 0)]
+        last = len(parts) - 1
+        for i, (bucket, seconds) in enumerate(parts):
+            rows.append((granularity, bucket, guild_id, user_id, session_type, seconds,
+                         sessions if i == last else 0))
+    return rows
@@ -0,0 +1,492 @@
+# sqlite_backend.py
+"""
+SQLiteBackend
+- Long-lived WAL connections per thread (connection.py), one transaction
+  per batch of events.
+- Optionally partitions guilds across several SQLite files (shards) so write
+  contention and file size stay bounded as the bot joins more servers.
+- Durations are computed inside SQLite by DELETE ... RETURNING, and totals
+  are accumulated with upserts, so nothing is read-modify-written in Python.
+- active_sessions is keyed (guild_id, user_id, session_type): every start,
+  move or end hits the primary key, and "end_all" closes all of a user's
+  sessions with one DELETE.
+- read_only=True is a read replica for processes that don't own the file
+  (see ipc.py): read-only connections, no schema changes, no writes.
+"""
+
+import os
+
+from connection import ConnectionManager, connect_readonly
+from storage import StorageBackend, SESSION_COLUMNS, DEFAULT_GUILD, epoch_ms, PartialBatchError
+import rollups
+import migrations
+import export
+
+
+class SQLiteBackend(StorageBackend):
+    kind = "sqlite"
+
+    def __init__(self, db_path, name_of, pragma_profile="balanced", shards=1, read_only=False):
+        super().__init__(db_path, name_of)
+        self.read_only = read_only
+        # guild_id % shards picks the file; a single shard keeps the plain db_path
+        self.shard_paths = self._shard_paths(db_path, shards)
+        self.shards = [ConnectionManager(path, pragma_profile, on_memory_init=self._init_memory_tables,
+                                         read_only=read_only, on_connect=self._on_connect)
+                       for path in self.shard_paths]
+        if read_only:
+            for path, shard in zip(self.shard_paths, self.shards):
+                version = migrations.schema_version(shard.get().cursor())
+                if version != migrations.LATEST_VERSION:
+                    raise RuntimeError(f"{path} is at schema v{version}, expected "
+                                       f"v{migrations.LATEST_VERSION}: start the writer first")
+            print(f"✅ Database replica opened (SQLite, read-only, {len(self.shards)} file(s))")
+            return
+        # Ensure directory exists
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        for shard in self.shards:
+            conn = shard.get()
+            self._create_schema(conn.cursor())
+            conn.commit()
+        print(f"✅ Database initialized (SQLite, {len(self.shards)} file(s))")
+
+    @staticmethod
+    def _shard_paths(db_path, shards):
+        if shards <= 1:
+            return [db_path]
+        root, ext = os.path.splitext(db_path)
+        return [f"{root}.shard{i}{ext or '.db'}" for i in range(shards)]
+
+    def _shard_index(self, guild_id):
+        return (guild_id or DEFAULT_GUILD) % len(self.shards)
+
+    def get_connection(self, guild_id=DEFAULT_GUILD):
+        # long-lived per-thread connection to the guild's shard; falls back to one shared in-memory db
+        return self.shards[self._shard_index(guild_id)].get()
+
+    @property
+    def memory_db(self):
+        return self.shards[0].memory_db
+
+    def close(self):
+        for shard in self.shards:
+            shard.close_all()
+
+    def _on_connect(self, conn):
+        # set-based upserts name the rows they create with display_name(user_id, guild_id)
+        conn.create_function("display_name", 2, self.name_of)
+
+    def _init_memory_tables(self, conn):
+        self._create_schema(conn.cursor())
+        conn.commit()
+
+    def _create_schema(self, cursor):
+        # versioned: creates a new file at the latest schema or upgrades an old one
+        migrations.migrate(cursor)
+
+    # ----------------------------
+    # Session events
+    # ----------------------------
+    def apply_batch(self, events):
+        results = [None] * len(events)
+        changed = []
+        by_shard = {}
+        for i, event in enumerate(events):
+            guild_id = event[6] if len(event) > 6 else DEFAULT_GUILD
+            by_shard.setdefault(self._shard_index(guild_id), []).append(i)
+        done = []
+        for shard, indexes in by_shard.items():
+            shard_changed = []
+            conn = self.shards[shard].get()
+            try:
+                with conn:
+                    cursor = conn.cursor()
+                    for i in indexes:
+                        results[i] = self._apply(cursor, shard_changed, *events[i])
+            except Exception as e:
+                # this shard rolled back; the ones before it stay committed
+                if not done:
+                    raise
+                raise PartialBatchError(e, {i: results[i] for i in done}, changed) from e
+            # only committed totals are reported
+            changed.extend(shard_changed)
+            done.extend(indexes)
+        return results, changed
+
+    def _apply(self, cursor, changed, action, session_type, user_id, username, channel_id, at,
+               guild_id=DEFAULT_GUILD):
+        if action == "start":
+            cursor.execute('''
+                INSERT OR REPLACE INTO active_sessions
+                (guild_id, user_id, session_type, start_time, channel_id)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (guild_id, user_id, session_type, epoch_ms(at), channel_id))
+            return None
+        if action == "move":
+            cursor.execute('UPDATE active_sessions SET channel_id = ? WHERE guild_id = ? AND user_id = ?',
+                           (channel_id, guild_id, user_id))
+            return None
+        if action == "end_channel":
+            return self._end_sessions(
+                cursor, changed, "guild_id = ? AND channel_id = ?", (guild_id, channel_id), at)
+        if action == "end_all":
+            return self._end_sessions(
+                cursor, changed, "guild_id = ? AND user_id = ?", (guild_id, user_id), at)
+
+        # only this type's totals can change
+        session_types = [session_type] if session_type in SESSION_COLUMNS else []
+        closed = self._end_sessions(
+            cursor, changed, "guild_id = ? AND user_id = ? AND session_type = ?",
+            (guild_id, user_id, session_type), at, session_types)
+        return closed[0]["minutes"] if closed else 0
+
+    def _end_sessions(self, cursor, changed, where, params, at, session_types=SESSION_COLUMNS):
+        """
+        Close every active session matching `where`, set-based: one upsert
+        per session type adds the elapsed time of all of them to the totals
+        (`total = total + excluded.total`, no Python read-modify-write), then
+        one DELETE ... RETURNING removes them. Both run in the caller's
+        transaction, so a session is credited exactly once. New totals are
+        appended to `changed`; each closed session is also logged to
+        session_history and added to the hourly/daily/weekly rollups.
+        """
+        now = epoch_ms(at)
+        for session_type in session_types:
+            table, total_col, sessions_col, last_col = SESSION_COLUMNS[session_type]
+            cursor.execute(f'''
+                INSERT INTO {table} (guild_id, user_id, username, {total_col}, {sessions_col}, {last_col})
+                SELECT guild_id, user_id, display_name(user_id, guild_id), MAX(0, (? - start_time) / 1000.0), 1, ?
+                FROM active_sessions
+                WHERE ({where}) AND session_type = ?
+                ON CONFLICT(guild_id, user_id)
+                DO UPDATE SET
+                    {total_col} = {total_col} + excluded.{total_col},
+                    {sessions_col} = {sessions_col} + 1,
+                    {last_col} = excluded.{last_col}
+                RETURNING guild_id, user_id, username, {total_col}, {sessions_col}
+            ''', (now, now, *params, session_type))
+            for guild_id, uid, username, total, sessions in cursor.fetchall():
+                changed.append((guild_id, session_type, uid, username, total, sessions))
+
+        cursor.execute(f'''
+            DELETE FROM active_sessions
+            WHERE {where}
+            RETURNING guild_id, user_id, session_type, channel_id, checkpointed,
+                MAX(0, (? - start_time) / 1000.0)
+        ''', (*params, now))
+        closed = [row for row in cursor.fetchall() if row[2] in SESSION_COLUMNS]
+
+        history = []
+        rollup_rows = []
+        for guild_id, uid, session_type, channel_id, credited, duration in closed:
+            # only the time since the last checkpoint is new; history gets the whole session
+            history.append((guild_id, uid, session_type, channel_id,
+                            epoch_ms(at - credited - duration), now, credited + duration))
+            rollup_rows.extend(rollups.rollup_rows(guild_id, uid, session_type, at - duration, at))
+        self._record_history(cursor, history, rollup_rows)
+
+        return [{'guild_id': guild_id, 'user_id': uid, 'session_type': kind,
+                 'minutes': (credited + duration) / 60}
+                for guild_id, uid, kind, _, credited, duration in closed]
+
+    def _record_history(self, cursor, history, rollup_rows):
+        if history:
+            cursor.executemany('''
+                INSERT INTO session_history
+                (guild_id, user_id, session_type, channel_id, start_time, end_time, duration)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', history)
+        if not rollup_rows:
+            return
+        cursor.executemany('''
+            INSERT INTO session_rollups
+            (granularity, bucket_start, guild_id, user_id, session_type, total_time, sessions)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(granularity, guild_id, session_type, bucket_start, user_id)
+            DO UPDATE SET
+                total_time = total_time + excluded.total_time,
+                sessions = sessions + excluded.sessions
+        ''', rollup_rows)
+
+    # ----------------------------
+    # Reconciliation and checkpoints
+    # ----------------------------
+    def reconcile(self, present, at, stale_cap, shard=None):
+        counts = {'closed': 0, 'opened': 0, 'kept': 0}
+        changed = []
+        by_shard = [[] for _ in self.shards]
+        for row in present:
+            by_shard[self._shard_index(row[0])].append(row)
+        for manager, rows in zip(self.shards, by_shard):
+            shard_changed = []
+            conn = manager.get()
+            with conn:
+                self._reconcile(conn.cursor(), shard_changed, rows, at, stale_cap, counts, shard)
+            changed.extend(shard_changed)
+        return counts, changed
+
+    def _reconcile(self, cursor, changed, rows, at, stale_cap, counts, shard=None):
+        cursor.execute('''
+            CREATE TEMP TABLE IF NOT EXISTS present_voice (
+                guild_id INTEGER,
+                user_id INTEGER,
+                session_type TEXT,
+                channel_id INTEGER,
+                PRIMARY KEY (guild_id, user_id, session_type)
+            )
+        ''')
+        cursor.execute('DELETE FROM present_voice')
+        cursor.executemany('INSERT OR REPLACE INTO present_voice VALUES (?, ?, ?, ?)', rows)
+
+        stale = '''NOT EXISTS (
+            SELECT 1 FROM present_voice p
+            WHERE p.guild_id = active_sessions.guild_id
+              AND p.user_id = active_sessions.user_id
+              AND p.session_type = active_sessions.session_type
+        )'''
+        params = ()
+        if shard is not None:
+            # other gateway shards reconcile their own guilds (storage.gateway_shard)
+            stale += ' AND (guild_id >> 22) % ? = ?'
+            params = (shard[1], shard[0])
+        cursor.execute(f'UPDATE active_sessions SET start_time = MAX(start_time, ?) WHERE {stale}',
+                       (epoch_ms(at - stale_cap), *params))
+        counts['closed'] += len(self._end_sessions(cursor, changed, stale, params, at))
+
+        cursor.execute('''
+            INSERT INTO active_sessions (guild_id, user_id, session_type, start_time, channel_id)
+            SELECT guild_id, user_id, session_type, ?, channel_id FROM present_voice p
+            WHERE NOT EXISTS (
+                SELECT 1 FROM active_sessions a
+                WHERE a.guild_id = p.guild_id AND a.user_id = p.user_id
+                  AND a.session_type = p.session_type
+            )
+        ''', (epoch_ms(at),))
+        counts['opened'] += cursor.rowcount
+        counts['kept'] += len(rows) - cursor.rowcount
+
+    def checkpoint(self, at):
+        checkpointed = 0
+        changed = []
+        for shard in self.shards:
+            shard_changed = []
+            conn = shard.get()
+            with conn:
+                checkpointed += self._checkpoint(conn.cursor(), shard_changed, at)
+            changed.extend(shard_changed)
+        return checkpointed, changed
+
+    def _checkpoint(self, cursor, changed, at):
+        """
+        Set-based: one upsert per session type and one UPDATE of active_sessions,
+        all limited to sessions that have run since their last checkpoint.
+        last_joined / last_streamed are left to the real session events.
+        """
+        now = epoch_ms(at)
+        cursor.execute('''
+            SELECT guild_id, user_id, session_type, (? - start_time) / 1000.0
+            FROM active_sessions
+            WHERE start_time < ?
+        ''', (now, now))
+        elapsed = [row for row in cursor.fetchall() if row[2] in SESSION_COLUMNS]
+        if not elapsed:
+            return 0
+
+        for session_type, (table, total_col, sessions_col, _) in SESSION_COLUMNS.items():
+            cursor.execute(f'''
+                INSERT INTO {table} (guild_id, user_id, username, {total_col}, {sessions_col})
+                SELECT guild_id, user_id, display_name(user_id, guild_id), (? - start_time) / 1000.0, 0
+                FROM active_sessions
+                WHERE session_type = ? AND start_time < ?
+                ON CONFLICT(guild_id, user_id)
+                DO UPDATE SET {total_col} = {total_col} + excluded.{total_col}
+                RETURNING guild_id, user_id, username, {total_col}, {sessions_col}
+            ''', (now, session_type, now))
+            for guild_id, user_id, username, total, sessions in cursor.fetchall():
+                changed.append((guild_id, session_type, user_id, username, total, sessions))
+        cursor.execute('''
+            UPDATE active_sessions
+            SET checkpointed = checkpointed + (? - start_time) / 1000.0, start_time = ?
+            WHERE start_time < ?
+        ''', (now, now, now))
+
+        rollup_rows = []
+        for guild_id, uid, session_type, seconds in elapsed:
+            rollup_rows.extend(rollups.rollup_rows(guild_id, uid, session_type, at - seconds, at, sessions=0))
+        self._record_history(cursor, [], rollup_rows)
+        return len(elapsed)
+
+    def adopt_guild(self, guild_id):
+        source = self.shards[self._shard_index(DEFAULT_GUILD)]
+        target = self.shards[self._shard_index(guild_id)]
+        if source is target:
+            conn = target.get()
+            with conn:
+                return self._adopt(conn.cursor(), "main", guild_id)
+        if source.using_memory or target.using_memory:
+            raise RuntimeError("Cannot move rows between the in-memory fallback and a shard file")
+        # the pre-guild rows live in another shard file: one transaction over both
+        conn = target.get()
+        conn.execute('ATTACH DATABASE ? AS adopted', (source.db_path,))
+        try:
+            with conn:
+                return self._adopt(conn.cursor(), "adopted", guild_id)
+        finally:
+            conn.execute('DETACH DATABASE adopted')
+
+    def _adopt(self, cursor, source, guild_id):
+        """Move the DEFAULT_GUILD rows of schema `source` into guild_id of this (main) file."""
+        cursor.execute(f'''
+            SELECT EXISTS (SELECT 1 FROM {source}.streamers WHERE guild_id = ?)
+                OR EXISTS (SELECT 1 FROM {source}.voice_time WHERE guild_id = ?)
+                OR EXISTS (SELECT 1 FROM {source}.active_sessions WHERE guild_id = ?)
+        ''', (DEFAULT_GUILD,) * 3)
+        if not cursor.fetchone()[0]:
+            return []
+
+        changed = []
+        for session_type, (table, total_col, sessions_col, last_col) in SESSION_COLUMNS.items():
+            cursor.execute(f'''
+                INSERT INTO main.{table} (guild_id, user_id, username, {total_col}, {sessions_col}, {last_col})
+                SELECT ?, user_id, username, {total_col}, {sessions_col}, {last_col}
+                FROM {source}.{table} WHERE guild_id = ?
+                ON CONFLICT(guild_id, user_id)
+                DO UPDATE SET
+                    {total_col} = {total_col} + excluded.{total_col},
+                    {sessions_col} = {sessions_col} + excluded.{sessions_col},
+                    {last_col} = COALESCE(MAX({last_col}, excluded.{last_col}), {last_col}, excluded.{last_col})
+                RETURNING user_id, username, {total_col}, {sessions_col}
+            ''', (guild_id, DEFAULT_GUILD))
+            for user_id, username, total, sessions in cursor.fetchall():
+                changed.append((guild_id, session_type, user_id, username, total, sessions))
+        # a session already open in the guild wins over its pre-guild twin
+        cursor.execute(f'''
+            INSERT OR IGNORE INTO main.active_sessions
+            (guild_id, user_id, session_type, start_time, channel_id, checkpointed)
+            SELECT ?, user_id, session_type, start_time, channel_id, checkpointed
+            FROM {source}.active_sessions WHERE guild_id = ?
+        ''', (guild_id, DEFAULT_GUILD))
+        cursor.execute(f'''
+            INSERT INTO main.session_history
+            (guild_id, user_id, session_type, channel_id, start_time, end_time, duration)
+            SELECT ?, user_id, session_type, channel_id, start_time, end_time, duration
+            FROM {source}.session_history WHERE guild_id = ?
+        ''', (guild_id, DEFAULT_GUILD))
+        cursor.execute(f'''
+            INSERT INTO main.session_rollups
+            (granularity, bucket_start, guild_id, user_id, session_type, total_time, sessions)
+            SELECT granularity, bucket_start, ?, user_id, session_type, total_time, sessions
+            FROM {source}.session_rollups WHERE guild_id = ?
+            ON CONFLICT(granularity, guild_id, session_type, bucket_start, user_id)
+            DO UPDATE SET
+                total_time = total_time + excluded.total_time,
+                sessions = sessions + excluded.sessions
+        ''', (guild_id, DEFAULT_GUILD))
+        for table in ("streamers", "voice_time", "active_sessions", "session_history", "session_rollups"):
+            cursor.execute(f'DELETE FROM {source}.{table} WHERE guild_id = ?', (DEFAULT_GUILD,))
+        return changed
+
+    # ----------------------------
+    # Reads
+    # ----------------------------
+    def load_totals(self, session_type):
+        table, total_col, sessions_col, _ = SESSION_COLUMNS[session_type]
+        for shard in self.shards:
+            cursor = shard.get().execute(f'SELECT guild_id, user_id, username, {total_col}, {sessions_col} FROM {table}')
+            yield from cursor.fetchall()
+
+    def user_totals(self, guild_id, user_id, session_type):
+        table, total_col, sessions_col, _ = SESSION_COLUMNS[session_type]
+        cursor = self.get_connection(guild_id).execute(
+            f'SELECT {total_col}, {sessions_col} FROM {table} WHERE guild_id = ? AND user_id = ?',
+            (guild_id, user_id))
+        return cursor.fetchone()
+
+    def open_sessions(self, guild_id, session_type):
+        cursor = self.get_connection(guild_id).execute(
+            'SELECT user_id, start_time FROM active_sessions WHERE guild_id = ? AND session_type = ?',
+            (guild_id, session_type))
+        return cursor.fetchall()
+
+    def live_top(self, guild_id, session_type, limit, at):
+        # open sessions joined to their totals, plus the index-ordered stored top-K
+        table, total_col, sessions_col, _ = SESSION_COLUMNS[session_type]
+        cursor = self.get_connection(guild_id).execute(f'''
+            SELECT user_id, username, MAX(total) AS total, sessions
+            FROM (
+                SELECT a.user_id,
+                       t.username,
+                       COALESCE(t.{total_col}, 0) + MAX(0, ? - a.start_time) / 1000.0 AS total,
+                       COALESCE(t.{sessions_col}, 0) AS sessions
+                FROM active_sessions a
+                LEFT JOIN {table} t ON t.guild_id = a.guild_id AND t.user_id = a.user_id
+                WHERE a.guild_id = ? AND a.session_type = ?
+                UNION ALL
+                SELECT * FROM (
+                    SELECT user_id, username, {total_col}, {sessions_col}
+                    FROM {table}
+                    WHERE guild_id = ?
+                    ORDER BY {total_col} DESC
+                    LIMIT ?
+                )
+            )
+            GROUP BY user_id
+            ORDER BY total DESC
+            LIMIT ?
+        ''', (at, guild_id, session_type, guild_id, limit, limit))
+        return cursor.fetchall()
+
+    def windowed_top(self, guild_id, session_type, granularity, start, end, limit):
+        cursor = self.get_connection(guild_id).execute('''
+            SELECT user_id, SUM(total_time) AS total, SUM(sessions)
+            FROM session_rollups
+            WHERE granularity = ? AND guild_id = ? AND session_type = ?
+              AND bucket_start >= ? AND bucket_start < ?
+            GROUP BY user_id
+            ORDER BY total DESC
+            LIMIT ?
+        ''', (granularity, guild_id, session_type, start, end, limit))
+        return cursor.fetchall()
+
+    def prune(self, history_before, hourly_before=None):
+        removed = 0
+        for shard in self.shards:
+            conn = shard.get()
+            with conn:
+                cursor = conn.execute('DELETE FROM session_history WHERE end_time < ?', (history_before,))
+                removed += cursor.rowcount
+                if hourly_before is not None:
+                    conn.execute("DELETE FROM session_rollups WHERE granularity = 'hour' AND bucket_start < ?",
+                                 (hourly_before,))
+        return removed
+
+    def iter_rows(self, table, chunk_size):
+        for shard in self.shards:
+            if shard.using_memory:
+                yield from export.iter_sqlite(shard.get(), table, chunk_size)
+                continue
+            # own read-only connection: chunks never wait for, or hold up, the writer
+            conn = connect_readonly(shard.db_path)
+            try:
+                yield from export.iter_sqlite(conn, table, chunk_size)
+            finally:
+                conn.close()
+
+    def rename(self, renamed):
+        by_shard = {}
+        for guild_id, user_id, name in renamed:
+            by_shard.setdefault(self._shard_index(guild_id), []).append((name, guild_id, user_id))
+        for shard, rows in by_shard.items():
+            conn = self.shards[shard].get()
+            with conn:
+                for table, _, _, _ in SESSION_COLUMNS.values():
+                    conn.executemany(f'UPDATE {table} SET username = ? WHERE guild_id = ? AND user_id = ?', rows)
+
+    def count_open(self):
+        counts = {}
+        for shard in self.shards:
+            cursor = shard.get().execute('SELECT session_type, COUNT(*) FROM active_sessions GROUP BY session_type')
+            for session_type, count in cursor.fetchall():
+                counts[session_type] = counts.get(session_type, 0) + count
+        return counts
@@ -0,0 +1,36 @@
+# startup.py
+"""
+Startup timing
+- Imported first by main.py, so the clock starts before anything heavy is
+  loaded. `mark(step)` records the time since the previous mark as one step
+  of the cold start (imports, storage, login, first reconcile, ...).
+- `report(log)` logs the steps as one line once the process is ready and
+  exports them as voice_tracker_startup_seconds{step=...}.
+"""
+
+import time
+
+STARTED = time.perf_counter()
+steps = []  # (step, seconds) in order
+_last = STARTED
+
+
+def mark(step):
+    global _last
+    now = time.perf_counter()
+    steps.append((step, now - _last))
+    _last = now
+
+
+def _format(seconds):
+    return f"{seconds:.2f} s" if seconds >= 1 else f"{seconds * 1000:.0f} ms"
+
+
+def report(log, what="Ready"):
+    import metrics
+
+    for step, seconds in steps:
+        metrics.REGISTRY.gauge("voice_tracker_startup_seconds", "Time spent in each startup step",
+                               {"step": step}).set(seconds)
+    log.info("🚀 %s in %s (%s)", what, _format(_last - STARTED),
+             " · ".join(f"{step} {_format(seconds)}" for step, seconds in steps))
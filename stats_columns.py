@@ -0,0 +1,167 @@
+# stats_columns.py
+"""
+StatsColumns
+- Compact store for one totals table (streamers or voice_time): a
+  guild -> user_id -> slot index plus parallel array columns for guild,
+  user, total, session count and last seen, and one list of names. About a
+  fifth of the memory of a dict row per user, and no string keys.
+- Snapshots are binary (`save`/`load`): a small header, the raw columns and
+  the names joined by NUL. Loading memory-maps the file and copies each column
+  in one go, so a cold load is a few memcpys plus rebuilding the slot index.
+- Rows come in and out as the JournalStore row dicts ("guild:user" keys,
+  SESSION_COLUMNS field names), so the journal format doesn't change.
+"""
+
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+MAGIC = b"VTS1"
+# magic, byte order (0 little, 1 big), row count
+HEADER = struct.Struct("<4sIQ")
+# every numeric column is 8 bytes per row: guild_id, user_id, total, sessions, last_seen
+COLUMNS = (("guild_ids", "q"), ("user_ids", "q"), ("totals", "d"), ("sessions", "q"), ("last_seen", "q"))
+NO_TIME = -1  # last_seen of a row that never had one
+
+
+class StatsColumns:
+    def __init__(self, total_field, sessions_field, last_field):
+        self.fields = (total_field, sessions_field, last_field)
+        self.slots = {}  # guild_id -> user_id -> slot
+        for name, code in COLUMNS:
+            setattr(self, name, array(code))
+        self.names = []
+
+    def __len__(self):
+        return len(self.names)
+
+    def _slot(self, guild_id, user_id):
+        users = self.slots.get(guild_id)
+        return users.get(user_id) if users is not None else None
+
+    # ----------------------------
+    # Rows
+    # ----------------------------
+    def get(self, guild_id, user_id):
+        """(username, total, sessions, last_seen) of a user, or None."""
+        slot = self._slot(guild_id, user_id)
+        if slot is None:
+            return None
+        last_seen = self.last_seen[slot]
+        return (self.names[slot], self.totals[slot], self.sessions[slot],
+                last_seen if last_seen != NO_TIME else None)
+
+    def put(self, guild_id, user_id, username, total, sessions, last_seen):
+        slot = self._slot(guild_id, user_id)
+        if slot is None:
+            self.slots.setdefault(guild_id, {})[user_id] = len(self.names)
+            self.guild_ids.append(guild_id)
+            self.user_ids.append(user_id)
+            self.totals.append(total)
+            self.sessions.append(sessions)
+            self.last_seen.append(NO_TIME if last_seen is None else last_seen)
+            self.names.append(username)
+            return
+        self.names[slot] = username
+        self.totals[slot] = total
+        self.sessions[slot] = sessions
+        self.last_seen[slot] = NO_TIME if last_seen is None else last_seen
+
+    def remove(self, guild_id, user_id):
+        """Drop a user; the last row moves into its slot."""
+        slot = self._slot(guild_id, user_id)
+        if slot is None:
+            return
+        del self.slots[guild_id][user_id]
+        if not self.slots[guild_id]:
+            del self.slots[guild_id]
+        last = len(self.names) - 1
+        if slot != last:
+            for name, _ in COLUMNS:
+                column = getattr(self, name)
+                column[slot] = column[last]
+            self.names[slot] = self.names[last]
+            self.slots[self.guild_ids[slot]][self.user_ids[slot]] = slot
+        for name, _ in COLUMNS:
+            getattr(self, name).pop()
+        self.names.pop()
+
+    def rows(self):
+        """Every row as (guild_id, user_id, username, total, sessions, last_seen)."""
+        for slot in range(len(self.names)):
+            last_seen = self.last_seen[slot]
+            yield (self.guild_ids[slot], self.user_ids[slot], self.names[slot], self.totals[slot],
+                   self.sessions[slot], last_seen if last_seen != NO_TIME else None)
+
+    # ----------------------------
+    # JournalStore row dicts
+    # ----------------------------
+    @staticmethod
+    def split_key(key):
+        guild_id, _, user_id = key.rpartition(":")
+        return int(guild_id or 0), int(user_id)
+
+    def put_row(self, key, row):
+        total_field, sessions_field, last_field = self.fields
+        guild_id, user_id = self.split_key(key)
+        self.put(guild_id, user_id, row.get("username"), row.get(total_field) or 0,
+                 row.get(sessions_field) or 0, row.get(last_field))
+
+    def remove_row(self, key):
+        self.remove(*self.split_key(key))
+
+    def row_dict(self, guild_id, user_id):
+        """A user's row in JournalStore layout, or None."""
+        row = self.get(guild_id, user_id)
+        if row is None:
+            return None
+        total_field, sessions_field, last_field = self.fields
+        return {"guild_id": guild_id, "user_id": user_id, "username": row[0],
+                total_field: row[1], sessions_field: row[2], last_field: row[3]}
+
+    # ----------------------------
+    # Binary snapshots
+    # ----------------------------
+    def save(self, path):
+        """Write every row to `path` atomically (temp file + rename)."""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, sys.byteorder == "big", len(self.names)))
+            for name, _ in COLUMNS:
+                getattr(self, name).tofile(f)
+            f.write("\0".join(name or "" for name in self.names).encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def load(self, path):
+        """Replace the contents with the snapshot at `path`, if there is one. Returns the row count."""
+        if not os.path.exists(path) or os.path.getsize(path) < HEADER.size:
+            return 0
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            magic, big_endian, count = HEADER.unpack_from(mm)
+            if magic != MAGIC:
+                raise ValueError(f"{path}: not a stats snapshot")
+            offset = HEADER.size
+            view = memoryview(mm)
+            try:
+                for name, code in COLUMNS:
+                    column = array(code)
+                    column.frombytes(view[offset:offset + count * column.itemsize])
+                    if big_endian != (sys.byteorder == "big"):
+                        column.byteswap()
+                    setattr(self, name, column)
+                    offset += count * column.itemsize
+                names = bytes(view[offset:]).decode("utf-8")
+            finally:
+                view.release()
+        self.names = names.split("\0") if count else []
+        self.slots = {}
+        for slot, (guild_id, user_id) in enumerate(zip(self.guild_ids, self.user_ids)):
+            users = self.slots.get(guild_id)
+            if users is None:
+                users = self.slots[guild_id] = {}
+            users[user_id] = slot
+        return count
@@ -0,0 +1,207 @@
+# storage.py
+"""
+Storage backends
+- VoiceTrackerDatabase (database.py) keeps the caches, rankings and display
+  names; everything that touches stored data goes through a backend.
+- Three interchangeable backends implement StorageBackend:
+  - sqlite: WAL SQLite files, optionally sharded by guild (sqlite_backend.py)
+  - json:   in-memory dicts plus an append-only JSON journal (json_backend.py)
+  - memory: __slots__ records and dict indexes, snapshotted to disk every
+            few seconds, for very high event rates (memory_backend.py)
+- `open_backend(kind, ...)` picks one; "auto" is sqlite when the sqlite3
+  module loads and json otherwise. See STORAGE_BACKEND in config.py.
+"""
+
+import time
+
+# session_type -> (totals table, total column, session count column, last seen column)
+SESSION_COLUMNS = {
+    "voice": ("voice_time", "total_voice_time", "voice_sessions", "last_joined"),
+    "stream": ("streamers", "total_stream_time", "stream_sessions", "last_streamed"),
+}
+
+# guild used for data recorded before storage became guild-aware
+DEFAULT_GUILD = 0
+
+BACKENDS = ("sqlite", "json", "memory")
+
+
+def gateway_shard(guild_id, shard_count):
+    """Discord gateway shard a guild's events arrive on (guild_id >> 22) % shard_count."""
+    return ((guild_id or DEFAULT_GUILD) >> 22) % shard_count
+
+
+def epoch_ms(at=None):
+    # every stored time is integer epoch milliseconds (schema v2), in every backend
+    return int(round((at if at is not None else time.time()) * 1000))
+
+
+def placeholder_name(user_id, guild_id=DEFAULT_GUILD):
+    return f"User_{user_id}"
+
+
+class PartialBatchError(Exception):
+    """
+    apply_batch failed after part of the batch was stored (an earlier shard
+    file committed, or the in-memory backends had applied the events before
+    the failing one). `done` maps the index of every stored event to its
+    result and `changed` holds the totals they committed: retry only the
+    other events, or stored ones are counted twice.
+    """
+
+    def __init__(self, error, done, changed=()):
+        super().__init__(error, done, list(changed))
+        self.error = error
+        self.done = done
+        self.changed = list(changed)
+
+    def __str__(self):
+        return f"{self.error} ({len(self.done)} events of the batch were stored)"
+
+
+def apply_in_order(apply, changed, events):
+    """[apply(changed, *event) for event in events], raising PartialBatchError if a later event fails."""
+    results = []
+    for event in events:
+        try:
+            results.append(apply(changed, *event))
+        except Exception as e:
+            if not results:
+                raise
+            raise PartialBatchError(e, dict(enumerate(results)), changed) from e
+    return results
+
+
+class StorageBackend:
+    """
+    What VoiceTrackerDatabase needs from storage. Writes return `changed`:
+    the new committed totals as (guild_id, session_type, user_id, username,
+    total, sessions) rows, which the caller feeds into its rankings.
+    `name_of(user_id, guild_id)` gives the display name for rows a backend
+    has to create.
+    """
+
+    kind = None
+
+    def __init__(self, path, name_of=placeholder_name):
+        self.path = path
+        self.name_of = name_of
+
+    def apply_batch(self, events):
+        """
+        Start, end, move and bulk-close sessions: apply (action, session_type,
+        user_id, username, channel_id, at, guild_id) events in order, as one
+        transaction where the backend has them. Returns (results, changed).
+        Raises PartialBatchError when it fails after some events were stored.
+        """
+        raise NotImplementedError
+
+    def reconcile(self, present, at, stale_cap, shard=None):
+        """
+        Make the open sessions match `present`, a list of (guild_id, user_id,
+        session_type, channel_id). With shard=(shard_id, shard_count) only
+        sessions in that gateway shard's guilds are closed (see gateway_shard).
+        Returns ({'closed', 'opened', 'kept'}, changed).
+        """
+        raise NotImplementedError
+
+    def checkpoint(self, at):
+        """Credit the elapsed time of every open session. Returns (count, changed)."""
+        raise NotImplementedError
+
+    def adopt_guild(self, guild_id):
+        """
+        Move every row stored under DEFAULT_GUILD (from before guild support)
+        into `guild_id`: totals and rollups are added to the guild's own, open
+        sessions move unless the user already has one of that type there.
+        Returns changed (the guild's new totals); empty when there was nothing.
+        """
+        raise NotImplementedError
+
+    def load_totals(self, session_type):
+        """Every stored total as (guild_id, user_id, username, total, sessions)."""
+        raise NotImplementedError
+
+    def user_totals(self, guild_id, user_id, session_type):
+        """(total, sessions) of one user, or None."""
+        raise NotImplementedError
+
+    def open_sessions(self, guild_id, session_type):
+        """[(user_id, start_time in epoch ms)] of the sessions open in a guild."""
+        raise NotImplementedError
+
+    def live_top(self, guild_id, session_type, limit, at):
+        """
+        Top `limit` (user_id, username or None, total, sessions) counting the
+        time open sessions have run until `at` (epoch ms), or None when the
+        backend has nothing faster than VoiceTrackerDatabase's leaderboards.
+        """
+        return None
+
+    def windowed_top(self, guild_id, session_type, granularity, start, end, limit):
+        """Top `limit` (user_id, total, sessions) summed over rollup buckets in [start, end)."""
+        raise NotImplementedError
+
+    def prune(self, history_before, hourly_before=None):
+        """Drop history ending before `history_before` (epoch ms) and, optionally,
+        hourly rollups starting before `hourly_before` (epoch s). Returns rows removed."""
+        raise NotImplementedError
+
+    def iter_rows(self, table, chunk_size):
+        """Yield a table (streamers, voice_time, session_history) as lists of
+        rows in export.EXPORT_TABLES column order, one chunk at a time."""
+        raise NotImplementedError
+
+    def rename(self, renamed):
+        """Persist display names, given as (guild_id, user_id, name)."""
+        raise NotImplementedError
+
+    def count_open(self):
+        """{session_type: open sessions} across all guilds."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+def sqlite_available():
+    try:
+        import sqlite3  # noqa: F401
+        return True
+    except ImportError:
+        try:
+            from pysqlite3 import dbapi2  # noqa: F401
+            return True
+        except ImportError:
+            return False
+
+
+def resolve_backend(kind):
+    """The backend "auto" (or None) stands for on this host."""
+    if kind in (None, "auto"):
+        return "sqlite" if sqlite_available() else "json"
+    return kind
+
+
+def open_backend(kind, db_path, name_of=placeholder_name, **options):
+    """
+    Build the backend called `kind` ("sqlite", "json", "memory" or "auto").
+    Options the backend doesn't take are ignored, so one set of settings can
+    be passed whatever the backend is. read_only=True (sqlite only) opens
+    read-only connections to a file another process writes.
+    """
+    kind = resolve_backend(kind)
+    if options.get("read_only") and kind != "sqlite":
+        raise ValueError("Read-only storage needs the sqlite backend")
+    if kind == "sqlite":
+        from sqlite_backend import SQLiteBackend
+        return SQLiteBackend(db_path, name_of, pragma_profile=options.get("pragma_profile", "balanced"),
+                             shards=options.get("shards", 1), read_only=options.get("read_only", False))
+    if kind == "json":
+        from json_backend import JsonBackend
+        return JsonBackend(db_path + ".json", name_of)
+    if kind == "memory":
+        from memory_backend import MemoryBackend
+        return MemoryBackend(db_path + ".snapshot", name_of,
+                             snapshot_interval=options.get("snapshot_interval", 30.0))
+    raise ValueError(f"Unknown storage backend {kind!r}, expected one of {', '.join(BACKENDS)} or auto")
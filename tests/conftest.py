@@ -0,0 +1,27 @@
+# tests/conftest.py
+"""
+Shared fixtures
+- The modules live flat in the repository root; make them importable when
+  pytest is started from anywhere.
+- `db_path` is a fresh database path per test, `backend_kind` runs a test
+  once per storage backend.
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BACKEND_KINDS = ("sqlite", "json", "memory")
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "voice_tracker.db")
+
+
+@pytest.fixture(params=BACKEND_KINDS)
+def backend_kind(request):
+    return request.param
@@ -0,0 +1,32 @@
+import asyncio
+import urllib.request
+
+from database import VoiceTrackerDatabase
+from tracker import VoiceTimeTracker
+
+
+def test_scrapes_do_not_open_connections(db_path):
+    db = VoiceTrackerDatabase(db_path, backend="sqlite")
+    db.apply_batch([("start", "voice", 1, "alice", 5, None, 7)])
+
+    async def scrape():
+        tracker = VoiceTimeTracker(db)
+        tracker.start_metrics(port=0)
+        try:
+            await asyncio.sleep(0.1)  # first open-session count, on the read pool
+            url = f"http://127.0.0.1:{tracker._metrics_server.server_port}/metrics"
+            loop = asyncio.get_running_loop()
+            bodies = []
+            for _ in range(20):
+                bodies.append(await loop.run_in_executor(
+                    None, lambda: urllib.request.urlopen(url).read().decode()))
+                if len(bodies) == 1:
+                    connections = len(db.backend.shards[0]._connections)
+            return bodies, connections, len(db.backend.shards[0]._connections)
+        finally:
+            await tracker.close()
+
+    bodies, before, after = asyncio.run(scrape())
+    db.close()
+    assert after == before
+    assert 'voice_tracker_open_sessions{session_type="voice"} 1' in bodies[-1]
@@ -0,0 +1,93 @@
+import os
+import sqlite3
+import subprocess
+import sys
+
+import migrations
+from database import VoiceTrackerDatabase
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the tables the bot created before schema versioning (user_version 0)
+BASELINE_DDL = (
+    '''CREATE TABLE IF NOT EXISTS streamers (
+        user_id INTEGER PRIMARY KEY,
+        username TEXT,
+        total_stream_time REAL DEFAULT 0,
+        stream_sessions INTEGER DEFAULT 0,
+        last_streamed TEXT
+    )''',
+    '''CREATE TABLE IF NOT EXISTS voice_time (
+        user_id INTEGER PRIMARY KEY,
+        username TEXT,
+        total_voice_time REAL DEFAULT 0,
+        voice_sessions INTEGER DEFAULT 0,
+        last_joined TEXT
+    )''',
+    '''CREATE TABLE IF NOT EXISTS active_sessions (
+        user_id INTEGER PRIMARY KEY,
+        session_type TEXT,
+        start_time TEXT,
+        channel_id INTEGER
+    )''',
+)
+
+
+def build_v0(path):
+    conn = sqlite3.connect(path)
+    for create in BASELINE_DDL:
+        conn.execute(create)
+    conn.executemany("INSERT INTO voice_time VALUES (?, ?, ?, ?, datetime('now'))",
+                     [(1, "alice", 3600.0, 2), (2, "bob", 600.0, 1)])
+    conn.execute("INSERT INTO streamers VALUES (3, 'carl', 1200.0, 1, datetime('now'))")
+    conn.execute("INSERT INTO active_sessions VALUES (1, 'voice', datetime('now', '-5 minutes'), 42)")
+    conn.commit()
+    conn.close()
+
+
+def user_version(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def run_cli(*args):
+    return subprocess.run([sys.executable, os.path.join(REPO, "migrations.py"), *args],
+                          capture_output=True, text=True, cwd=REPO, timeout=60)
+
+
+def test_migrates_baseline_file_to_latest(db_path):
+    build_v0(db_path)
+    conn = sqlite3.connect(db_path)
+    assert migrations.migrate(conn.cursor()) == 0
+    conn.commit()
+    conn.close()
+    assert user_version(db_path) == migrations.LATEST_VERSION
+
+    db = VoiceTrackerDatabase(db_path, backend="sqlite")
+    try:
+        voice = [(row['user_id'], row['username'], row['total_voice_time'], row['sessions'])
+                 for row in db.get_top_voice_users(5)]
+        assert voice == [(1, "alice", 3600.0, 2), (2, "bob", 600.0, 1)]
+        assert [row['user_id'] for row in db.get_top_streamers(5)] == [3]
+        assert db.count_open_sessions() == {"voice": 1}
+    finally:
+        db.close()
+
+
+def test_cli_reports_on_baseline_file(db_path):
+    build_v0(db_path)
+    result = run_cli(db_path)
+    assert result.returncode == 0, result.stderr
+    assert "Schema v0 -> v3" in result.stdout
+    assert user_version(db_path) == 0  # the report only touches copies
+
+
+def test_cli_applies_to_baseline_file(db_path):
+    build_v0(db_path)
+    result = run_cli(db_path, "--apply")
+    assert result.returncode == 0, result.stderr
+    assert user_version(db_path) == migrations.LATEST_VERSION
+    assert user_version(db_path + ".bak") == 0
@@ -0,0 +1,145 @@
+import threading
+import time
+
+import pytest
+
+from database import VoiceTrackerDatabase
+from storage import PartialBatchError
+
+T = 1_700_000_000
+GUILD = 7
+
+
+def top(db, session_type="voice", guild_id=GUILD):
+    rows = db.get_top_voice_users(10, guild_id=guild_id) if session_type == "voice" \
+        else db.get_top_streamers(10, guild_id=guild_id)
+    total_col = "total_voice_time" if session_type == "voice" else "total_stream_time"
+    return [(row['user_id'], round(row[total_col]), row['sessions']) for row in rows]
+
+
+# ----------------------------
+# Atomic close
+# ----------------------------
+def test_concurrent_closes_count_a_session_once(db_path):
+    writer = VoiceTrackerDatabase(db_path, backend="sqlite")
+    other = VoiceTrackerDatabase(db_path, backend="sqlite")  # a second connection, as another process would have
+    now = time.time()
+    writer.apply_batch([("start", "voice", 1, "alice", 5, now - 600, GUILD)])
+
+    barrier = threading.Barrier(8)
+    results = []
+
+    def close(db):
+        barrier.wait()
+        results.append(db.end_voice_session(1, at=now, guild_id=GUILD))
+
+    threads = [threading.Thread(target=close, args=(db,)) for db in (writer, other) * 4]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(results, reverse=True)[0] == pytest.approx(10.0)
+    assert sorted(results)[:-1] == [0] * 7
+    other.close()
+    writer.close()
+    db = VoiceTrackerDatabase(db_path, backend="sqlite")
+    assert top(db) == [(1, 600, 1)]
+    assert db.count_open_sessions() == {}
+    db.close()
+
+
+def test_channel_close_credits_each_session_once(db_path, backend_kind):
+    db = VoiceTrackerDatabase(db_path, backend=backend_kind, snapshot_interval=0)
+    db.apply_batch([("start", "voice", 1, "alice", 5, T, GUILD),
+                    ("start", "voice", 2, "bob", 5, T + 100, GUILD),
+                    ("start", "stream", 2, "bob", 5, T + 200, GUILD),
+                    ("start", "voice", 3, "carl", 6, T, GUILD)])
+    closed = db.end_channel_sessions(5, at=T + 600, guild_id=GUILD)
+    assert sorted((row['user_id'], row['session_type'], row['minutes']) for row in closed) == [
+        (1, "voice", 10.0), (2, "stream", pytest.approx(400 / 60)), (2, "voice", pytest.approx(500 / 60))]
+    assert db.end_channel_sessions(5, at=T + 700, guild_id=GUILD) == []
+    assert top(db) == [(1, 600, 1), (2, 500, 1)]
+    assert top(db, "stream") == [(2, 400, 1)]
+    assert db.count_open_sessions() == {"voice": 1}
+    db.close()
+
+
+# ----------------------------
+# Partial batches
+# ----------------------------
+def failing_on(backend, user_id):
+    """Make the backend raise while applying any event of user_id."""
+    apply = backend._apply
+
+    def apply_or_fail(*args):
+        if user_id in args:
+            raise ValueError("boom")
+        return apply(*args)
+    backend._apply = apply_or_fail
+
+
+@pytest.mark.parametrize("backend_kind, shards", [("sqlite", 2), ("json", 1), ("memory", 1)])
+def test_partial_batch_reports_and_publishes_stored_events(db_path, backend_kind, shards):
+    db = VoiceTrackerDatabase(db_path, backend=backend_kind, shards=shards, snapshot_interval=0)
+    failing_on(db.backend, 99)
+    # guild 2 lives in shard file 0 and guild 3 in file 1, which is written second
+    events = [("start", "voice", 1, "alice", 5, T, 2),
+              ("end", "voice", 1, None, 5, T + 600, 2),
+              ("start", "voice", 99, "mallory", 5, T, 3)]
+    with pytest.raises(PartialBatchError) as raised:
+        db.apply_batch(events)
+    error = raised.value
+    assert str(error.error) == "boom"
+    assert error.done == {0: None, 1: 10.0}
+    assert [row[:5] for row in error.changed] == [(2, "voice", 1, "alice", 600)]
+    # the stored totals reached the leaderboard before the error
+    assert top(db, guild_id=2) == [(1, 600, 1)]
+    db.close()
+
+
+def test_failure_before_anything_is_stored_is_not_partial(db_path, backend_kind):
+    db = VoiceTrackerDatabase(db_path, backend=backend_kind, snapshot_interval=0)
+    failing_on(db.backend, 99)
+    with pytest.raises(ValueError):
+        db.apply_batch([("start", "voice", 99, "mallory", 5, T, GUILD),
+                        ("start", "voice", 1, "alice", 5, T, GUILD)])
+    db.close()
+
+
+# ----------------------------
+# Reconcile and checkpoints
+# ----------------------------
+def test_reconcile_closes_stale_and_opens_present(db_path, backend_kind):
+    db = VoiceTrackerDatabase(db_path, backend=backend_kind, snapshot_interval=0)
+    db.apply_batch([("start", "voice", 1, "alice", 5, T, GUILD),
+                    ("start", "voice", 2, "bob", 5, T, GUILD)])
+    counts = db.reconcile_sessions({GUILD: [(2, "voice", 5, "bob"), (3, "voice", 5, "carl"),
+                                            (3, "stream", 5, "carl")]}, at=T + 300)
+    assert counts == {'closed': 1, 'opened': 2, 'kept': 1}
+    assert top(db) == [(1, 300, 1)]
+    assert db.count_open_sessions() == {"voice": 2, "stream": 1}
+    # a second pass with the same members changes nothing
+    assert db.reconcile_sessions({GUILD: [(2, "voice", 5, "bob"), (3, "voice", 5, "carl"),
+                                          (3, "stream", 5, "carl")]}, at=T + 400) == \
+        {'closed': 0, 'opened': 0, 'kept': 3}
+    db.close()
+
+
+def test_checkpoint_credits_elapsed_time_once(db_path, backend_kind):
+    db = VoiceTrackerDatabase(db_path, backend=backend_kind, snapshot_interval=0)
+    db.apply_batch([("start", "voice", 1, "alice", 5, T, GUILD),
+                    ("start", "voice", 2, "bob", 5, T + 600, GUILD)])
+    assert db.checkpoint_sessions(at=T + 600) == 1  # bob's session has not run yet
+    assert top(db) == [(1, 600, 0)]
+    assert db.checkpoint_sessions(at=T + 900) == 2
+    assert top(db) == [(1, 900, 0), (2, 300, 0)]
+    # closing adds only the time since the last checkpoint, and the whole session to the count
+    assert db.end_voice_session(1, at=T + 1200, guild_id=GUILD) == pytest.approx(20.0)
+    assert top(db) == [(1, 1200, 1), (2, 300, 0)]
+    db.close()
+
+    db = VoiceTrackerDatabase(db_path, backend=backend_kind)
+    assert top(db) == [(1, 1200, 1), (2, 300, 0)]
+    assert db.count_open_sessions() == {"voice": 1}
+    db.close()
@@ -0,0 +1,89 @@
+import asyncio
+from types import SimpleNamespace
+
+import metrics
+from database import VoiceTrackerDatabase
+from tracker import VoiceTimeTracker
+
+GUILD = 7
+
+
+def member(user_id, name):
+    return SimpleNamespace(id=user_id, display_name=name, guild=SimpleNamespace(id=GUILD), bot=False)
+
+
+def channel(channel_id):
+    return SimpleNamespace(id=channel_id, name=f"channel-{channel_id}", guild=SimpleNamespace(id=GUILD))
+
+
+def run_tracker(db_path, scenario, debounce):
+    db = VoiceTrackerDatabase(db_path, backend="memory", snapshot_interval=0)
+
+    async def main():
+        tracker = VoiceTimeTracker(db, debounce=debounce, flush_interval=0.01)
+        try:
+            await scenario(tracker)
+        finally:
+            await tracker.close()
+        return tracker
+
+    tracker = asyncio.run(main())
+    voice = {row['user_id']: (row['total_voice_time'], row['sessions'])
+             for row in db.get_top_voice_users(10, guild_id=GUILD)}
+    open_sessions = db.count_open_sessions()
+    db.close()
+    return tracker, voice, open_sessions
+
+
+def test_quick_rejoin_keeps_the_session(db_path):
+    alice = member(1, "alice")
+
+    async def scenario(tracker):
+        await tracker.user_joined_voice(alice, channel(5))
+        await asyncio.sleep(0.05)
+        await tracker.user_left_voice(alice, channel(5))
+        await asyncio.sleep(0.05)
+        await tracker.user_joined_voice(alice, channel(6))  # back within the debounce window
+        await asyncio.sleep(0.3)  # past the window: nothing was ended
+        assert tracker.db.count_open_sessions() == {"voice": 1}
+
+    coalesced = metrics.REGISTRY.counter("voice_tracker_coalesced_total").value
+    tracker, voice, open_sessions = run_tracker(db_path, scenario, debounce=0.2)
+    assert tracker.coalesced.value == coalesced + 1
+    # the session never ended: nothing credited yet, still open after shutdown
+    assert voice == {}
+    assert open_sessions == {"voice": 1}
+
+
+def test_end_is_recorded_when_the_member_left(db_path):
+    alice = member(1, "alice")
+
+    async def scenario(tracker):
+        await tracker.user_joined_voice(alice, channel(5))
+        await asyncio.sleep(0.1)
+        await tracker.user_left_voice(alice, channel(5))
+        await asyncio.sleep(1.3)  # the debounce expires and the end is written
+        assert tracker.db.count_open_sessions() == {}
+
+    _, voice, _ = run_tracker(db_path, scenario, debounce=1.0)
+    total, sessions = voice[1]
+    assert sessions == 1
+    # counted up to the leave, not up to the end of the debounce window
+    assert 0.05 < total < 1.0
+
+
+def test_no_debounce_ends_immediately(db_path):
+    alice = member(1, "alice")
+
+    async def scenario(tracker):
+        await tracker.user_joined_voice(alice, channel(5))
+        await tracker.user_left_voice(alice, channel(5))
+        await tracker.user_joined_voice(alice, channel(5))
+        await asyncio.sleep(0.1)
+
+    coalesced = metrics.REGISTRY.counter("voice_tracker_coalesced_total").value
+    tracker, voice, open_sessions = run_tracker(db_path, scenario, debounce=0)
+    assert tracker.coalesced.value == coalesced
+    # the first session was closed, the second one is still open
+    assert voice[1][1] == 1
+    assert open_sessions == {"voice": 1}
@@ -1,54 +1,311 @@
-import discord
-from datetime import datetime
-from database import VoiceTrackerDatabase
+from event_queue import WriteBehindQueue
+from storage import SESSION_COLUMNS
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+import logs
+import metrics
+
+log = logs.get_logger("tracker")
 
 class VoiceTimeTracker:
-    def __init__(self, database):
+    def __init__(self, database, max_pending=10000, batch_size=200, flush_interval=0.05, debounce=2.0,
+                 read_workers=2):
         self.db = database
+        # joins/leaves are queued and written in batches off the event loop, on
+        # one writer thread, so a user's events are written in the order they happened
+        self.writes = WriteBehindQueue(database, max_pending, batch_size, flush_interval)
+        # leaderboard / stats queries run on their own small pool, never on the
+        # event loop and never queued behind a slow commit
+        self._readers = ThreadPoolExecutor(max_workers=read_workers, thread_name_prefix="db-reader")
+        # a session end waits this many seconds in case the member comes straight
+        # back (channel hopping, mobile reconnects); 0 writes every end immediately
+        self.debounce = debounce
+        # session_type "all" is a disconnect: every open session of the member ends together
+        self._pending_ends = {}  # (guild_id, user_id, session_type) -> (timer, member, channel_id, left_at, unit)
+        self.voice_events = {kind: metrics.REGISTRY.counter("voice_tracker_voice_events_total",
+                                                            "Voice state transitions handled", {"kind": kind})
+                             for kind in ("join", "leave", "move", "stream_start", "stream_stop", "channel_delete")}
+        self.coalesced = metrics.REGISTRY.counter("voice_tracker_coalesced_total",
+                                                  "Session ends cancelled because the member came back within the debounce window")
+        self._background_tasks = []
+        self._metrics_server = None
+        self._open_counts = {}  # {session_type: open sessions}, refreshed on the read pool
         print("✅ VoiceTimeTracker initialized")
+
+    def start_metrics(self, port=None, dump_interval=None, lag_interval=0.5, open_sessions_interval=15.0):
+        """
+        Register queue depth / open session gauges and start watching event
+        loop lag. Serves /metrics on `port` and/or logs a stats dump every
+        `dump_interval` seconds. Call from the running event loop.
+        """
+        registry = metrics.REGISTRY
+        registry.gauge("voice_tracker_write_queue_depth", "Events waiting for the database writer",
+                       fn=lambda: self.writes.pending)
+        loop = asyncio.get_running_loop()
+        count_open = getattr(self.db, "count_open_sessions", None)
+        if count_open is not None:
+            # scrapes read the last count: the HTTP handler threads never touch storage
+            for session_type in ("voice", "stream"):
+                registry.gauge("voice_tracker_open_sessions", "Sessions currently being tracked",
+                               {"session_type": session_type},
+                               fn=lambda kind=session_type: self._open_counts.get(kind, 0))
+            self._background_tasks.append(loop.create_task(
+                self._count_open_every(count_open, open_sessions_interval)))
+
+        self._background_tasks.append(loop.create_task(metrics.watch_loop_lag(lag_interval)))
+        if dump_interval:
+            self._background_tasks.append(loop.create_task(metrics.dump_periodically(dump_interval)))
+        if port is not None:
+            self._metrics_server = metrics.serve(port)
+
+    def start_checkpointer(self, interval=60.0):
+        """Every `interval` seconds, move open sessions' elapsed time into the totals."""
+        if getattr(self.db, "checkpoint_sessions", None) is None:
+            return
+        self._background_tasks.append(asyncio.get_running_loop().create_task(self._checkpoint_every(interval)))
+
+    def start_pruner(self, interval=3600.0, keep_days=30, keep_hourly_days=None):
+        """Apply the history retention (VoiceTrackerDatabase.prune_history) now and every `interval` seconds."""
+        if getattr(self.db, "prune_history", None) is None:
+            return
+        self._background_tasks.append(asyncio.get_running_loop().create_task(
+            self._prune_every(interval, keep_days, keep_hourly_days)))
+
+    def start_prerender(self, cache, guild_ids, interval=15.0):
+        """
+        Every `interval` seconds, re-render the leaderboard payloads in `cache`
+        (a render_cache.LeaderboardCache) whose top-K changed, for the guilds
+        `guild_ids()` returns. Runs on the read pool.
+        """
+        self._background_tasks.append(
+            asyncio.get_running_loop().create_task(self._prerender_every(cache, guild_ids, interval)))
+
+    async def _prerender_every(self, cache, guild_ids, interval):
+        while True:
+            try:
+                changed = await self.read(cache.refresh_guilds, guild_ids())
+                if changed:
+                    log.debug("🖼️ Re-rendered %d leaderboards", changed)
+            except Exception as e:
+                log.error("❌ Leaderboard pre-render failed: %s", e)
+            await asyncio.sleep(interval)
+
+    async def _count_open_every(self, count_open, interval):
+        while True:
+            try:
+                self._open_counts = await self.read(count_open)
+            except Exception as e:
+                log.error("❌ Counting open sessions failed: %s", e)
+            await asyncio.sleep(interval)
+
+    async def _checkpoint_every(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                # on the writer thread, in order with the queued joins/leaves
+                await self.writes.call(self.db.checkpoint_sessions)
+            except Exception as e:
+                log.error("❌ Checkpoint failed: %s", e)
+
+    async def _prune_every(self, interval, keep_days, keep_hourly_days):
+        while True:
+            try:
+                await self.writes.call(self.db.prune_history, keep_days, keep_hourly_days)
+            except Exception as e:
+                log.error("❌ History pruning failed: %s", e)
+            await asyncio.sleep(interval)
+
+    async def close(self):
+        """Flush queued events to the database (call on shutdown)."""
+        for task in self._background_tasks:
+            task.cancel()
+        if self._metrics_server is not None:
+            self._metrics_server.shutdown()
+        await self._flush_pending_ends()
+        await self.writes.close()
+        self._readers.shutdown(wait=True)
+
+    async def read(self, fn, *args, **kwargs):
+        """Run a database query (e.g. db.get_top_streamers) on the read pool and return its result."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, functools.partial(fn, *args, **kwargs))
+
+    async def reconcile(self, guilds, shard=None):
+        """
+        Sync active sessions with who is in voice right now (call from on_ready).
+        Closes sessions left over from before a restart and starts tracking
+        members who were already in voice, in one pass over the guild cache.
+        A gateway shard process passes shard=(shard_id, shard_count) so only
+        its own guilds' sessions are touched.
+        """
+        await self._flush_pending_ends()
+        snapshot = {guild.id: self._voice_snapshot(guild) for guild in guilds}
+        counts = await self.writes.call(functools.partial(self.db.reconcile_sessions, snapshot, shard=shard))
+        log.info("🔄 STARTUP SYNC: %d already in voice, %d stale sessions closed",
+                 counts['opened'], counts['closed'])
+        return counts
+
+    def _voice_snapshot(self, guild):
+        states = []
+        for channel in list(guild.voice_channels) + list(guild.stage_channels):
+            for member in channel.members:
+                # a streamer is in voice too: both sessions are tracked side by side
+                states.append((member.id, "voice", channel.id, member.display_name))
+                if member.voice is not None and member.voice.self_stream:
+                    states.append((member.id, "stream", channel.id, member.display_name))
+        return states
     
+    @metrics.timed("handle_voice_state_update")
     async def handle_voice_state_update(self, member, before, after):
         """Track voice channel joins/leaves and streaming"""
-        print(f"🎧 VOICE EVENT: {member.display_name} | "
-              f"Before: {before.channel.name if before and before.channel else 'None'} | "
-              f"After: {after.channel.name if after and after.channel else 'None'}")
+        if log.isEnabledFor(logs.logging.DEBUG):
+            log.debug("🎧 VOICE EVENT: %s | Before: %s | After: %s", member.display_name,
+                      before.channel.name if before and before.channel else 'None',
+                      after.channel.name if after and after.channel else 'None')
         
-        # User joined a voice channel
+        # User joined, left or moved between voice channels
         if before.channel != after.channel:
-            if after.channel:  # Joined
-                print(f"✅ JOIN: {member.display_name} joined {after.channel.name}")
+            if before.channel and after.channel:  # Moved: same session continues
+                log.info("🔀 MOVE: %s moved %s -> %s", member.display_name, before.channel.name, after.channel.name)
+                await self.user_moved_voice(member, after.channel)
+            elif after.channel:  # Joined
+                log.info("✅ JOIN: %s joined %s", member.display_name, after.channel.name)
                 await self.user_joined_voice(member, after.channel)
-            if before.channel:  # Left
-                print(f"✅ LEAVE: {member.display_name} left {before.channel.name}")
+            elif before.channel:  # Left
+                log.info("✅ LEAVE: %s left %s", member.display_name, before.channel.name)
                 await self.user_left_voice(member, before.channel)
         
-        # User started/stopped streaming
-        if before and after:
+        # User started/stopped streaming (leaving voice already ended the stream)
+        if before and after and (after.channel or not before.channel):
             if not before.self_stream and after.self_stream:
-                print(f"🎬 STREAM START: {member.display_name}")
+                log.info("🎬 STREAM START: %s", member.display_name)
                 await self.user_started_streaming(member, after.channel)
             if before.self_stream and not after.self_stream:
-                print(f"⏹️ STREAM STOP: {member.display_name}")
+                log.info("⏹️ STREAM STOP: %s", member.display_name)
                 await self.user_stopped_streaming(member, before.channel)
     
     async def user_joined_voice(self, member, channel):
         """User joined any voice channel"""
-        print(f"📝 Starting voice session for {member.display_name}")
-        self.db.start_voice_session(member.id, member.display_name, channel.id)
+        self.voice_events["join"].inc()
+        if await self._resume(member, "voice", channel):
+            return
+        log.debug("📝 Starting voice session for %s", member.display_name)
+        await self.writes.submit("start", "voice", member.id, member.display_name, channel.id,
+                                 guild_id=member.guild.id)
     
     async def user_left_voice(self, member, channel):
-        """User left any voice channel"""
-        print(f"📝 Ending voice session for {member.display_name}")
-        duration = self.db.end_voice_session(member.id)
-        print(f"⏱️ Recorded {duration:.1f} minutes for {member.display_name}")
+        """User left any voice channel: voice, stream and any other open session end together"""
+        self.voice_events["leave"].inc()
+        await self._end_session(member, "all", channel, "minutes")
+
+    async def user_moved_voice(self, member, channel):
+        """User switched voice channels: keep the session, just follow the channel"""
+        self.voice_events["move"].inc()
+        await self.writes.submit("move", "voice", member.id, member.display_name, channel.id,
+                                 guild_id=member.guild.id)
     
     async def user_started_streaming(self, member, channel):
         """User started screen sharing/streaming"""
-        print(f"📝 Starting stream session for {member.display_name}")
-        self.db.start_stream_session(member.id, member.display_name, channel.id)
+        self.voice_events["stream_start"].inc()
+        if await self._resume(member, "stream", channel):
+            return
+        log.debug("📝 Starting stream session for %s", member.display_name)
+        await self.writes.submit("start", "stream", member.id, member.display_name, channel.id,
+                                 guild_id=member.guild.id)
     
     async def user_stopped_streaming(self, member, channel):
         """User stopped screen sharing/streaming"""
-        print(f"📝 Ending stream session for {member.display_name}")
-        duration = self.db.end_stream_session(member.id)
-        print(f"⏱️ Recorded {duration:.1f} streaming minutes for {member.display_name}")
+        self.voice_events["stream_stop"].inc()
+        await self._end_session(member, "stream", channel, "streaming minutes")
+
+    # ----------------------------
+    # Debounced session ends
+    # ----------------------------
+    async def _end_session(self, member, session_type, channel, unit):
+        key = (member.guild.id, member.id, session_type)
+        left_at = time.time()
+        if self.debounce <= 0:
+            await self._submit_end(key, member, left_at, unit)
+            return
+        self._park(key, member, channel.id if channel else None, left_at, unit, self.debounce)
+
+    def _park(self, key, member, channel_id, left_at, unit, delay):
+        loop = asyncio.get_running_loop()
+        timer = loop.call_later(delay, lambda: loop.create_task(self._end_pending(key)))
+        self._pending_ends[key] = (timer, member, channel_id, left_at, unit)
+
+    async def _resume(self, member, session_type, channel):
+        """
+        If the member's session is waiting to end, cancel the end and keep it
+        going (moving it to `channel` if needed). Returns True when resumed.
+        A pending disconnect resumes only this session type; the others still
+        end at the time the member left.
+        """
+        guild_id = member.guild.id
+        pending = self._pending_ends.pop((guild_id, member.id, session_type), None)
+        if pending is None:
+            pending = self._pending_ends.pop((guild_id, member.id, "all"), None)
+            if pending is None:
+                return False
+            _, _, channel_id, left_at, unit = pending
+            remaining = max(0.0, self.debounce - (time.time() - left_at))
+            for other in SESSION_COLUMNS:
+                key = (guild_id, member.id, other)
+                if other != session_type and key not in self._pending_ends:
+                    self._park(key, member, channel_id, left_at, unit, remaining)
+        timer, _, channel_id, _, _ = pending
+        timer.cancel()
+        self.coalesced.inc()
+        log.debug("🔁 Resuming %s session for %s", session_type, member.display_name)
+        if channel is not None and channel.id != channel_id:
+            await self.writes.submit("move", session_type, member.id, member.display_name, channel.id,
+                                     guild_id=member.guild.id)
+        return True
+
+    async def _end_pending(self, key):
+        pending = self._pending_ends.pop(key, None)
+        if pending is None:
+            return
+        timer, member, _, left_at, unit = pending
+        timer.cancel()
+        await self._submit_end(key, member, left_at, unit)
+
+    async def _submit_end(self, key, member, left_at, unit):
+        guild_id, user_id, session_type = key
+        log.debug("📝 Ending %s session for %s", session_type, member.display_name)
+        # recorded at the time the member actually left, not when the debounce expired
+        if session_type == "all":
+            written = await self.writes.submit("end_all", None, user_id, member.display_name,
+                                               at=left_at, guild_id=guild_id)
+        else:
+            written = await self.writes.submit("end", session_type, user_id, member.display_name,
+                                               at=left_at, guild_id=guild_id)
+        written.add_done_callback(lambda f: self._report(f, member, unit))
+
+    async def _flush_pending_ends(self):
+        for key in list(self._pending_ends):
+            await self._end_pending(key)
+
+    @metrics.timed("handle_channel_delete")
+    async def handle_channel_delete(self, channel):
+        """Voice channel was deleted: close everyone's session in it in one statement"""
+        self.voice_events["channel_delete"].inc()
+        log.info("🗑️ CHANNEL DELETED: %s", channel.name)
+        # members who just left it are closed at the time they left
+        for key, pending in list(self._pending_ends.items()):
+            if key[0] == channel.guild.id and pending[2] == channel.id:
+                await self._end_pending(key)
+        written = await self.writes.submit("end_channel", None, None, channel_id=channel.id,
+                                           guild_id=channel.guild.id)
+        written.add_done_callback(
+            lambda f: log.info("⏱️ Closed %d sessions in %s", len(f.result()), channel.name)
+            if not f.cancelled() and f.exception() is None else None)
+
+    def _report(self, future, member, unit):
+        if not future.cancelled() and future.exception() is None:
+            minutes = future.result()
+            if isinstance(minutes, list):  # end_all: the sessions it closed
+                minutes = sum(sess['minutes'] if isinstance(sess, dict) else sess or 0 for sess in minutes)
+            log.debug("⏱️ Recorded %.1f %s for %s", minutes, unit, member.display_name)